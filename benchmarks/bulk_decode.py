@@ -0,0 +1,61 @@
+"""
+Throughput of bulk entity decoding.
+
+Compares per-record factory decoding against EntityContract.create_entities_from_dicts,
+both in a single process and across a process pool.
+
+    $ python -m benchmarks.bulk_decode --records 100000
+"""
+import argparse
+import json
+import os
+from time import perf_counter
+
+from scaladecore.entities import EntityContract
+from benchmarks.fixtures import fi_messages_obj_ds, variables_obj_ds
+
+
+def measure(label: str, records: int, func) -> float:
+    start = perf_counter()
+    func()
+    elapsed = perf_counter() - start
+    print('  %-28s %10.0f records/s  (%.3fs)' % (label, records / elapsed, elapsed))
+    return elapsed
+
+
+def run(records: int, workers: int):
+    datasets = (
+        ('FunctionInstanceLogMessage', fi_messages_obj_ds(records)),
+        ('Variable', variables_obj_ds(records, body_size=256)),
+    )
+    for type_, objs in datasets:
+        json_array = json.dumps(objs)
+        print('%s (%d records)' % (type_, records))
+        measure('per-record factory', records, lambda: [
+            EntityContract.create_entity_from_dict(type_, obj_d) for obj_d in objs])
+        measure('bulk, single process', records, lambda: EntityContract.create_entities_from_dicts(
+            type_, objs, max_workers=1))
+        measure('bulk, JSON array', records, lambda: EntityContract.create_entities_from_dicts(
+            type_, json_array, max_workers=1))
+        if records >= 2:
+            measure('bulk, %d worker processes' % workers, records,
+                    lambda: _decode_in_pool(type_, objs, workers))
+
+
+def _decode_in_pool(type_: str, objs: list, workers: int):
+    from scaladecore import entities
+
+    threshold = entities.BULK_DECODE_POOL_THRESHOLD
+    entities.BULK_DECODE_POOL_THRESHOLD = 0
+    try:
+        return EntityContract.create_entities_from_dicts(type_, objs, max_workers=workers)
+    finally:
+        entities.BULK_DECODE_POOL_THRESHOLD = threshold
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    run(args.records, args.workers)
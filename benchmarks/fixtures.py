@@ -0,0 +1,41 @@
+"""
+Benchmark fixtures, generated with the tests fixture data builders and scaled up
+to many variables and large bodies.
+"""
+from base64 import b64encode
+import os
+
+from scaladecore.utils import get_foo_function_config
+from tests.conftest import new_account_obj_d, new_fi_message_obj_d, new_function_instance_obj_d, \
+    new_function_type_obj_d, new_stream_obj_d, new_variable_obj_d
+
+SMALL_BODY_SIZE = 64
+LARGE_BODY_SIZE = 4 * 1024 * 1024
+MANY_VARIABLES = 500
+
+
+def function_config_data() -> dict:
+    return get_foo_function_config().serialize
+
+
+def function_instance_obj_d() -> dict:
+    account_obj_d = new_account_obj_d()
+    return new_function_instance_obj_d(
+        new_function_type_obj_d(function_config_data(), account_obj_d),
+        new_stream_obj_d(account_obj_d))
+
+
+def variable_obj_d(body_size: int = SMALL_BODY_SIZE, rank: int = 0) -> dict:
+    return new_variable_obj_d(
+        id_name='fake_input_%d' % rank,
+        body=b64encode(os.urandom(body_size)).decode(),
+        rank=rank,
+        type_='file')
+
+
+def variables_obj_ds(count: int = MANY_VARIABLES, body_size: int = SMALL_BODY_SIZE) -> list:
+    return [variable_obj_d(body_size, rank) for rank in range(count)]
+
+
+def fi_messages_obj_ds(count: int) -> list:
+    return [new_fi_message_obj_d('Log message number %d' % i) for i in range(count)]
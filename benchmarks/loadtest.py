@@ -0,0 +1,186 @@
+"""
+End-to-end load test of ContextManager against a local stand-in of the runtime API.
+
+Spawns N simulated function instances, each with its own token, and drives them
+concurrently through ContextManager with a configurable mix of Log, Output, Block and
+Complete calls. The stand-in runtime runs in a separate process so it does not compete
+with the clients for the GIL. Reports throughput and p50/p95/p99 latency per operation.
+
+    $ python -m benchmarks.loadtest --instances 500 --concurrency 32 --mix log=5,output=1,complete=1
+    $ python -m benchmarks.loadtest --transport unix
+"""
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+import shutil
+import tempfile
+from time import perf_counter
+from typing import Dict
+from uuid import uuid4
+
+from scaladecore.managers import ContextManager
+from scaladecore.testing import FakeRuntime, FakeRuntimeServer
+from scaladecore.transports import InProcessTransport, Transport
+from scaladecore.utils import encode_scalade_token, generate_token_payload, percentile
+from scaladecore.variables import Variable
+
+OPERATIONS = ('log', 'output', 'block', 'complete')
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Parses an operations mix like 'log=5,output=1,complete=1'."""
+    counts = dict.fromkeys(OPERATIONS, 0)
+    for item in filter(None, mix.split(',')):
+        name, _, count = item.partition('=')
+        if name not in counts:
+            raise argparse.ArgumentTypeError(
+                'Invalid operation "%s": valid ones are %s' % (name, OPERATIONS))
+        counts[name] = int(count or 1)
+
+    return counts
+
+
+def run_instance(token: str, mix: Dict[str, int], output_body: bytes,
+                 transport: Transport = None) -> Dict[str, list]:
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    def timed(name, func, *args):
+        start = perf_counter()
+        try:
+            result = func(*args)
+        except Exception:
+            errors[name] += 1
+            return None
+        latencies[name].append(perf_counter() - start)
+        return result
+
+    start = perf_counter()
+    ctx = timed('initialize', ContextManager.initialize_from_token, token, transport)
+    if ctx:
+        for _ in range(mix['log']):
+            timed('log', ctx.Log, 'Load test log message')
+        for i in range(mix['output']):
+            variable = Variable.create('text', 'output_%d' % i, bytes_=output_body)
+            timed('output', ctx.Output, variable)
+        for _ in range(mix['block']):
+            timed('block', ctx.Block)
+        for _ in range(mix['complete']):
+            timed('complete', ctx.Complete)
+    latencies['instance'].append(perf_counter() - start)
+
+    return dict(latencies=latencies, errors=errors)
+
+
+def run(instances: int, concurrency: int, mix: Dict[str, int], output_size: int,
+        transport: Transport = None):
+    tokens = [encode_scalade_token(generate_token_payload(str(uuid4())))
+              for _ in range(instances)]
+    output_body = b'x' * output_size
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda token: run_instance(token, mix, output_body, transport), tokens))
+    wall_time = perf_counter() - start
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for result in results:
+        for name, values in result['latencies'].items():
+            latencies[name].extend(values)
+        for name, count in result['errors'].items():
+            errors[name] += count
+
+    calls = sum(len(values) + errors[name] for name, values in latencies.items()
+                if name != 'instance')
+    print('%d instances, concurrency %d, mix %s, output size %d bytes' % (
+        instances, concurrency, mix, output_size))
+    print('wall time %.2fs: %.1f instances/s, %.1f runtime calls/s\n' % (
+        wall_time, instances / wall_time, calls / wall_time))
+    print('%-12s %8s %8s %10s %10s %10s %10s' % (
+        'operation', 'count', 'errors', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name in ('initialize', ) + OPERATIONS + ('instance', ):
+        values = sorted(latencies.get(name, []))
+        if not values and not errors[name]:
+            continue
+        row = [sum(values) / len(values), percentile(values, 50),
+               percentile(values, 95), percentile(values, 99)] if values else [0] * 4
+        print('%-12s %8d %8d %10.2f %10.2f %10.2f %10.2f' % (
+            name, len(values), errors[name], *(value * 1000 for value in row)))
+
+
+def serve_runtime(address_queue: multiprocessing.Queue, socket_path: str = None):
+    server = FakeRuntimeServer(FakeRuntime(auto_register=True), socket_path=socket_path)
+    address_queue.put((server.host, server.port))
+    server.serve_forever()
+
+
+def ensure_signing_keys():
+    """Generates a throwaway RSA key pair for signing tokens if none is configured."""
+    if os.getenv('SCALADE_PRIVATE_KEY'):
+        return
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    os.environ['SCALADE_PRIVATE_KEY'] = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption()).decode()
+    os.environ['SCALADE_PUBLIC_KEY'] = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--instances', type=int, default=200)
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('--mix', type=parse_mix, default='log=5,output=1,complete=1',
+                        help='Runtime calls per instance, i.e: log=5,output=1,block=0,complete=1.')
+    parser.add_argument('--output-size', type=int, default=1024,
+                        help='Output variable body size in bytes.')
+    parser.add_argument('--transport', choices=('tcp', 'unix', 'inprocess'), default='tcp',
+                        help='Transport to the stub: HTTP over TCP or over a unix socket, '
+                             'or in-process calls with no sockets.')
+    parser.add_argument('--target', help='host:port of a running runtime API instead of the stub.')
+    args = parser.parse_args(argv)
+
+    ensure_signing_keys()
+    runtime_process = None
+    transport = None
+    socket_dir = None
+    if args.target:
+        host, _, port = args.target.rpartition(':')
+    elif args.transport == 'inprocess':
+        host, port = None, None
+        transport = InProcessTransport(FakeRuntime(auto_register=True).handle)
+    else:
+        socket_path = None
+        if args.transport == 'unix':
+            socket_dir = tempfile.mkdtemp()
+            socket_path = os.path.join(socket_dir, 'runtime.sock')
+        address_queue = multiprocessing.Queue()
+        runtime_process = multiprocessing.Process(
+            target=serve_runtime, args=(address_queue, socket_path), daemon=True)
+        runtime_process.start()
+        host, port = address_queue.get(timeout=30)
+        if socket_path:
+            os.environ['SCALADE_API_SERVER_SOCKET'] = socket_path
+    if host:
+        os.environ['SCALADE_API_SERVER_HOST'] = host
+        os.environ['SCALADE_API_SERVER_PORT'] = str(port)
+        os.environ.setdefault('SCALADE_API_SERVER_USE_SSL', 'False')
+
+    try:
+        run(args.instances, args.concurrency, args.mix, args.output_size, transport)
+    finally:
+        if runtime_process:
+            runtime_process.terminate()
+        if socket_dir:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Crossover of parallel input variables decoding.
+
+Decodes the same inputs (a fixed count of variables whose bodies add up to increasing
+sizes) in a plain loop, on a thread pool and across a process pool, and reports the total
+body size from which the process pool wins: the value to set SCALADE_DECODE_POOL_THRESHOLD
+to on this host. Decoding holds the GIL, the thread pool is measured to show it.
+
+    $ python -m benchmarks.parallel_decode --inputs 16 --sizes 1,4,16,64,256
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+from time import perf_counter
+from typing import List
+
+from scaladecore.entities import BULK_DECODE_CHUNK_SIZE, EntityContract, VariableEntity, \
+    _create_entities_chunk, _split_chunks
+from benchmarks.fixtures import variables_obj_ds
+
+MIB = 1024 * 1024
+
+
+def measure(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def decode_in_threads(objs: List[dict], workers: int) -> list:
+    chunks = _split_chunks(objs, BULK_DECODE_CHUNK_SIZE,
+                           sum(len(obj_d['body']) for obj_d in objs) / workers, 'body')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [entity
+                for chunk in executor.map(lambda chunk: _create_entities_chunk(
+                    VariableEntity, chunk), chunks)
+                for entity in chunk]
+
+
+def run(inputs: int, sizes: List[int], workers: int, repeat: int):
+    # The pool is forced on, the threshold is what is being measured.
+    os.environ['SCALADE_DECODE_POOL_THRESHOLD'] = '0'
+    print('%d inputs, %d workers (%d CPUs)' % (inputs, workers, os.cpu_count() or 1))
+    print('  %10s %12s %12s %12s' % ('total MiB', 'loop', 'threads', 'processes'))
+    crossover = None
+    for size in sizes:
+        objs = variables_obj_ds(inputs, body_size=size * MIB // inputs)
+        loop = measure(lambda: EntityContract.create_entities_from_dicts(
+            'Variable', objs, max_workers=1), repeat)
+        threads = measure(lambda: decode_in_threads(objs, workers), repeat)
+        processes = measure(lambda: EntityContract.create_entities_from_dicts(
+            'Variable', objs, max_workers=workers), repeat)
+        print('  %10d %11.3fs %11.3fs %11.3fs' % (size, loop, threads, processes))
+        if crossover is None and processes < loop:
+            crossover = size, sum(len(obj_d['body']) for obj_d in objs)
+
+    if crossover is None:
+        print('The process pool does not pay off up to %d MiB on this host.' % sizes[-1])
+    else:
+        print('Crossover: the process pool wins from about %d MiB of bodies, '
+              'i.e: SCALADE_DECODE_POOL_THRESHOLD=%d (base64 bytes)' % crossover)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--inputs', type=int, default=16)
+    parser.add_argument('--sizes', default='1,4,16,64,256',
+                        help='comma separated total body sizes in MiB')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.inputs, [int(size) for size in args.sizes.split(',')], max(args.workers, 2),
+        args.repeat)
@@ -0,0 +1,272 @@
+"""
+Entity, variable and config microbenchmark suite.
+
+Reports ops/sec, allocations per op (memory blocks still alive after the op, as traced
+by tracemalloc) and peak traced memory per op, and compares them against a stored baseline.
+Speeds are stored relative to a fixed pure Python calibration loop measured on every run,
+so the baseline carries across hosts of different speed; it still is a guide, regenerate it
+on the host that gates on it.
+
+    $ python -m benchmarks.suite                      # run and compare with baseline.json
+    $ python -m benchmarks.suite --save-baseline      # run and store a new baseline
+    $ python -m benchmarks.suite -k Variable          # run only matching benchmarks
+"""
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+from timeit import Timer
+import tracemalloc
+from typing import Callable, Dict
+
+from scaladecore import config
+from scaladecore.config import FunctionConfig, VariableConfig
+from scaladecore.entities import EntityContract, FunctionInstanceEntity, VariableEntity
+from scaladecore.managers import create_variables
+from scaladecore.utils import decode_b64str
+from scaladecore.variables import Variable
+from benchmarks import fixtures
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+MEMORY_ITERATIONS = 10
+# Absolute slack added on top of the relative tolerance, so tiny ops don't flag on noise.
+MEMORY_METRICS_SLACK = dict(allocs_per_op=16, peak_bytes=4096)
+
+BENCHMARKS: Dict[str, Callable[[], Callable]] = {}
+
+
+def _calibration_op():
+    """Fixed interpreter work every benchmark speed is related to."""
+    obj_d = {}
+    for i in range(200):
+        obj_d['key%d' % i] = [i, str(i), {'value': i * 2}]
+    return json.loads(json.dumps(obj_d))
+
+
+def benchmark(name: str):
+    """
+    Registers a benchmark setup function.
+    The setup function builds its fixtures and returns the zero-arguments callable to measure.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+@benchmark('FunctionInstanceEntity.create_from_dict')
+def _fi_create_from_dict():
+    obj_d = fixtures.function_instance_obj_d()
+    return lambda: FunctionInstanceEntity.create_from_dict(obj_d)
+
+
+@benchmark('FunctionInstanceEntity.as_dict')
+def _fi_as_dict():
+    fi = FunctionInstanceEntity.create_from_dict(fixtures.function_instance_obj_d())
+    return lambda: fi.as_dict
+
+
+@benchmark('FunctionInstanceEntity.to_json_bytes')
+def _fi_to_json_bytes():
+    fi = FunctionInstanceEntity.create_from_dict(fixtures.function_instance_obj_d())
+    return fi.to_json_bytes
+
+
+@benchmark('VariableEntity.create_from_dict[small]')
+def _var_create_from_dict_small():
+    obj_d = fixtures.variable_obj_d()
+    return lambda: VariableEntity.create_from_dict(obj_d)
+
+
+@benchmark('VariableEntity.create_from_dict[large]')
+def _var_create_from_dict_large():
+    obj_d = fixtures.variable_obj_d(fixtures.LARGE_BODY_SIZE)
+    return lambda: VariableEntity.create_from_dict(obj_d)
+
+
+@benchmark('VariableEntity.as_dict[large]')
+def _var_as_dict_large():
+    var_entity = VariableEntity.create_from_dict(
+        fixtures.variable_obj_d(fixtures.LARGE_BODY_SIZE))
+    return lambda: var_entity.as_dict
+
+
+@benchmark('VariableEntity.to_var[large]')
+def _var_to_var_large():
+    var_entity = VariableEntity.create_from_dict(
+        fixtures.variable_obj_d(fixtures.LARGE_BODY_SIZE))
+    return lambda: var_entity.to_var
+
+
+@benchmark('Variable.dump[small]')
+def _var_dump_small():
+    variable = VariableEntity.create_from_dict(fixtures.variable_obj_d()).to_var
+    return variable.dump
+
+
+@benchmark('Variable.dump[large]')
+def _var_dump_large():
+    variable = VariableEntity.create_from_dict(
+        fixtures.variable_obj_d(fixtures.LARGE_BODY_SIZE)).to_var
+    return variable.dump
+
+
+@benchmark('JsonVariable.path[large]')
+def _json_var_path_large():
+    document = {'items': [{'id': i, 'name': 'item %d' % i} for i in range(50000)]}
+    variable = Variable.create('json', 'document', value=document)
+    return lambda: variable.path('items', -1, 'name')
+
+
+@benchmark('decode_b64str[large]')
+def _decode_b64str_large():
+    body = fixtures.variable_obj_d(fixtures.LARGE_BODY_SIZE)['body']
+    return lambda: decode_b64str(body)
+
+
+@benchmark('create_variables[many]')
+def _create_variables_many():
+    variables_data = fixtures.variables_obj_ds()
+    return lambda: create_variables(variables_data)
+
+
+@benchmark('EntityContract.create_entities_from_dicts[log messages]')
+def _create_log_messages():
+    objs = fixtures.fi_messages_obj_ds(fixtures.MANY_VARIABLES)
+    return lambda: EntityContract.create_entities_from_dicts('FunctionInstanceLogMessage', objs)
+
+
+@benchmark('FunctionConfig.deserialize')
+def _function_config_deserialize():
+    config_data = fixtures.function_config_data()
+    return lambda: FunctionConfig.deserialize(config_data)
+
+
+@benchmark('VariableConfig.deserialize')
+def _variable_config_deserialize():
+    config_data = fixtures.function_config_data()['inputs'][0]
+    return lambda: VariableConfig.deserialize(config_data)
+
+
+@benchmark('load_config_file[cached]')
+def _load_config_file_cached():
+    filepath = os.path.join(os.path.dirname(config.__file__), 'fixture', 'config', 'function.yml')
+    return lambda: config.load_config_file(filepath)
+
+
+def measure_speed(op: Callable, min_time: float) -> float:
+    timer = Timer(op)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=3, number=number))
+    return number / best
+
+
+def measure_memory(op: Callable) -> Dict[str, float]:
+    op()  # warm up lazy imports and caches
+    gc.collect()
+    tracemalloc.start()
+    try:
+        op()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+
+        exclude_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        before = tracemalloc.take_snapshot().filter_traces(exclude_tracemalloc)
+        results = [op() for _ in range(MEMORY_ITERATIONS)]
+        after = tracemalloc.take_snapshot().filter_traces(exclude_tracemalloc)
+        allocs = sum(stat.count_diff for stat in after.compare_to(before, 'filename')
+                     if stat.count_diff > 0)
+        del results
+    finally:
+        tracemalloc.stop()
+
+    return dict(allocs_per_op=allocs / MEMORY_ITERATIONS, peak_bytes=peak_bytes)
+
+
+def run(pattern: str = None, min_time: float = 0.2) -> Dict[str, dict]:
+    calibration_ops_per_sec = measure_speed(_calibration_op, min_time)
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        op = setup()
+        ops_per_sec = measure_speed(op, min_time)
+        result = dict(ops_per_sec=ops_per_sec,
+                      relative_speed=ops_per_sec / calibration_ops_per_sec)
+        result.update(measure_memory(op))
+        results[name] = result
+
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> list:
+    """Returns the list of (benchmark name, metric) pairs that regressed beyond tolerance."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['relative_speed'] < base['relative_speed'] * (1 - tolerance):
+            regressions.append((name, 'relative_speed'))
+        for metric, slack in MEMORY_METRICS_SLACK.items():
+            if result[metric] > base[metric] * (1 + tolerance) + slack:
+                regressions.append((name, metric))
+
+    return regressions
+
+
+def report(results: Dict[str, dict], baseline: Dict[str, dict], regressions: list):
+    regressed = set(regressions)
+    print('%-55s %14s %12s %14s %10s' % ('benchmark', 'ops/sec', 'allocs/op', 'peak KiB', 'vs base'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        delta = '%+.1f%%' % (
+            (result['relative_speed'] / base['relative_speed'] - 1) * 100) if base else 'n/a'
+        flags = ''.join(
+            '!' for metric in ('relative_speed', 'allocs_per_op', 'peak_bytes')
+            if (name, metric) in regressed)
+        print('%-55s %14.1f %12.1f %14.1f %10s %s' % (
+            name, result['ops_per_sec'], result['allocs_per_op'],
+            result['peak_bytes'] / 1024, delta, flags))
+
+    for name, metric in regressions:
+        print('REGRESSION: %s (%s)' % (name, metric))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', dest='pattern', help='Only run benchmarks matching this regex.')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Minimum measured time per repetition, in seconds.')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Allowed relative regression before failing (default 0.3).')
+    args = parser.parse_args(argv)
+
+    results = run(args.pattern, args.min_time)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+    if args.save_baseline:
+        # Absolute speeds only hold on this host, they are not stored.
+        baseline.update({name: {metric: value for metric, value in result.items()
+                                if metric != 'ops_per_sec'}
+                         for name, result in results.items()})
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        report(results, {}, [])
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    report(results, baseline, regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,40 @@
+from concurrent.futures import Future
+
+from .instrumentation import PHASE_CONTEXT_INIT, PHASE_TOKEN_READ, PHASE_USER_FUNCTION, \
+    phase, record_timings
 from .managers import ContextManager
+from .streaming import OutputChunk, is_output_stream, stream_outputs
 
 import os
 
+__all__ = ['ContextManager', 'OutputChunk', 'scalade_func']
+
 
 def scalade_func(func):
-    def execute(*args, **kwargs):
-        SCALADE_FI_TOKEN = os.getenv('SCALADE_FI_TOKEN')
-        context = ContextManager.initialize_from_token(SCALADE_FI_TOKEN)
-        return func(context)
+    def execute(*args, token: str = None, context=None, **kwargs):
+        """
+        :param token: (str) the function instance token, default SCALADE_FI_TOKEN.
+        :param context: (ContextManager|Future) an already initialized context, or the
+            future of a prefetched one, instead of initializing it from the token.
+        """
+        with record_timings(func.__qualname__) as timings:
+            with phase(PHASE_TOKEN_READ):
+                SCALADE_FI_TOKEN = token or os.getenv('SCALADE_FI_TOKEN')
+            with phase(PHASE_CONTEXT_INIT):
+                if isinstance(context, Future):
+                    context = context.result()
+                elif context is None:
+                    context = ContextManager.initialize_from_token(SCALADE_FI_TOKEN)
+            if timings:
+                timings.fi_uuid = str(context.fi.uuid)
+            try:
+                with phase(PHASE_USER_FUNCTION):
+                    result = func(context)
+                    if is_output_stream(result):
+                        # Generator functions stream their outputs and complete implicitly.
+                        return stream_outputs(context, result)
+                    return result
+            finally:
+                context.Close()
 
     return execute
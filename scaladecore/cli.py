@@ -1,11 +1,25 @@
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, \
+    as_completed, wait
+from fnmatch import fnmatch
+from glob import glob, has_magic
+from hashlib import sha256
+from functools import partial
 from importlib import util
+from itertools import islice
+import json
 import os
-import yaml
 from shutil import copytree, rmtree, ignore_patterns
+import sys
+from time import perf_counter
+from typing import Callable, Iterable, List, Optional, TextIO, Tuple
 
 import click
-from scaladecore.config import FunctionConfig
-from scaladecore.utils import encode_scalade_token, generate_token_payload
+from scaladecore.config import FunctionConfig, parse_yaml, write_config_snapshot
+from scaladecore.managers import ContextManager
+from scaladecore.profiling import PROFILERS, create_profiler
+from scaladecore.utils import encode_scalade_token, generate_token_payload, \
+    get_pckg_dist_version_num, get_rsa_key, percentile
 
 
 WORKING_DIR = os.getcwd()
@@ -15,6 +29,14 @@ FIXTURES_DIR = os.path.join(
 
 FUNCTION_MODULE = None
 
+# The scalade function of a process worker of 'scalade run --executor process'.
+RUN_WORKER_FUNC = None
+
+VERIFY_CONFIG_CACHE_FILE = '.scalade_verifyconfig_cache.json'
+
+# Bulk token generation reads and signs FI UUIDs in batches of this size.
+TOKENS_BATCH_SIZE = 10000
+
 
 @click.group()
 def cli_handler():
@@ -30,10 +52,20 @@ command_collection = click.CommandCollection(
 
 
 @cli_handler.command('token')
-@click.argument('fi_uuid', type=str, envvar='FI_UUID')
-def generate_token(fi_uuid):
+@click.option('-f', '--from-file', 'uuids_file', type=click.File('r'),
+              help="Bulk mode: reads FunctionInstance UUIDs, one per line, from a file "
+                   "('-' for stdin) and prints 'uuid,token' lines.")
+@click.option('-j', '--jobs', type=int,
+              help='Number of worker processes in bulk mode (default: number of CPUs).')
+@click.argument('fi_uuid', type=str, envvar='FI_UUID', required=False)
+def generate_token(fi_uuid, uuids_file, jobs):
     """Generates an new token with the given FunctionInstance (fi_uuid)."""
-    _generate_token(fi_uuid)
+    if uuids_file:
+        _generate_tokens(uuids_file, jobs)
+    elif fi_uuid:
+        _generate_token(fi_uuid)
+    else:
+        raise click.UsageError("Missing argument 'FI_UUID' or option '--from-file'.")
 
 
 @cli_handler.command('startfunction')
@@ -52,16 +84,49 @@ def start_function(project_name, **options):
               help='Function module path. Default location is $(pwd)/src/function.py.')
 @click.option('--self', is_flag=True,
               help='With this flag it runs with Self mode (suitable for development).')
+@click.option('--record', type=click.Path(dir_okay=False, writable=True),
+              help='Records the context and every runtime call response to a file.')
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False),
+              help='Runs against a recording file instead of the runtime API (no network).')
+@click.option('--tokens-file', type=click.File('r'),
+              help='Runs a function instance per token of a file, one per line.')
+@click.option('--tokens-stdin', is_flag=True,
+              help='Runs a function instance per token read from stdin, one per line.')
+@click.option('-c', '--concurrency', type=int, default=4, show_default=True,
+              help='Function instances run concurrently with tokens.')
+@click.option('--executor', type=click.Choice(['thread', 'process']), default='thread',
+              show_default=True, help='Runs concurrent function instances on threads or processes.')
+@click.option('--profile', type=click.Choice(list(PROFILERS)),
+              help='Profiles the run with cProfile, stack sampling or tracemalloc.')
+@click.option('--profile-output', type=str,
+              help='Profile file path (default: ./scalade-<mode>.<ext>).')
+@click.option('--profile-interval', type=float, default=0.005, show_default=True,
+              help='Sampling interval in seconds of the sample profile mode.')
 def run(**options):
     """Runs a FunctionInstance."""
     _run(**options)
 
 
 @cli_handler.command('verifyconfig')
-@click.argument('config', type=str)
-def verify_config(config):
-    """Verifies a Function config."""
-    _verify_config(config)
+@click.option('--snapshot', is_flag=True,
+              help='Writes a precompiled JSON snapshot next to a valid config, '
+                   'which is loaded at runtime instead of parsing the YAML.')
+@click.option('-j', '--jobs', type=int,
+              help='Number of worker processes (default: number of CPUs).')
+@click.option('--pattern', default='function.yml',
+              help="File name pattern of the configs searched in directories (default: 'function.yml').")
+@click.option('--cache-file', default=VERIFY_CONFIG_CACHE_FILE,
+              help='Cache of the content hashes of previously verified configs.')
+@click.option('--no-cache', is_flag=True,
+              help='Verifies every config, ignoring and not updating the cache.')
+@click.argument('configs', type=str, nargs=-1, required=True)
+def verify_config(configs, **options):
+    """Verifies Function configs: files, directories or glob patterns.
+    Prints a JSON report and exits with status 1 if any config is invalid."""
+    report = _verify_configs(configs, **options)
+    print(json.dumps(report, indent=2))
+    if not report['valid']:
+        sys.exit(1)
 
 
 def _generate_token(fi_uuid: str) -> str:
@@ -71,6 +136,33 @@ def _generate_token(fi_uuid: str) -> str:
           (payload, token))
 
 
+def _generate_tokens(uuids_file: TextIO, jobs: int = None, output: TextIO = None):
+    output = output or sys.stdout
+    fi_uuids = (line.strip() for line in uuids_file)
+    fi_uuids = (fi_uuid for fi_uuid in fi_uuids if fi_uuid)
+    batches = iter(lambda: list(islice(fi_uuids, TOKENS_BATCH_SIZE)), [])
+
+    if jobs == 1:
+        for batch in batches:
+            output.writelines(_sign_tokens(batch))
+        return
+
+    jobs = jobs or os.cpu_count() or 1
+    chunk_size = max(1, TOKENS_BATCH_SIZE // (4 * jobs))
+    # Each worker parses the private key once, up front.
+    with ProcessPoolExecutor(max_workers=jobs, initializer=get_rsa_key,
+                             initargs=('SCALADE_PRIVATE_KEY', )) as executor:
+        for batch in batches:
+            chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+            for lines in executor.map(_sign_tokens, chunks):
+                output.writelines(lines)
+
+
+def _sign_tokens(fi_uuids: Iterable[str]) -> List[str]:
+    return ['%s,%s\n' % (fi_uuid, encode_scalade_token(generate_token_payload(fi_uuid)))
+            for fi_uuid in fi_uuids]
+
+
 def _start_function(project_name: str, template: str, destdir: str = None):
     src = os.path.join(FIXTURES_DIR, template)
     if destdir:
@@ -97,63 +189,274 @@ def _start_function(project_name: str, template: str, destdir: str = None):
                   % (project_name, dest))
 
 
-def _run(function: str = None, **kwargs):
-    def import_function_module(function_file):
-        global FUNCTION_MODULE
-
-        spec = util.spec_from_file_location('function_module', function_file)
-        FUNCTION_MODULE = util.module_from_spec(spec)
-        spec.loader.exec_module(FUNCTION_MODULE)
-
-    def find_scalade_func(function_file):
-        err = import_function_module(function_file)
-        if not err:
-            attr_names = [
-                item for item in FUNCTION_MODULE.__dict__ if item[:2] != '__']
-            for name in attr_names:
-                attr_ = getattr(FUNCTION_MODULE, name)
-                try:
-                    if attr_.__qualname__ == 'scalade_func.<locals>.execute':
-                        return attr_
-                except AttributeError:
-                    pass
-
-        # todo: custom exception
-        raise Exception()
-
+def _run(function: str = None, record: str = None, replay: str = None, profile: str = None,
+         profile_output: str = None, profile_interval: float = 0.005, tokens_file: TextIO = None,
+         tokens_stdin: bool = False, concurrency: int = 4, executor: str = 'thread', **kwargs):
     self_mode = kwargs.get('self')
     if not function:
         function_file = os.path.join(WORKING_DIR, 'src', 'function.py')
     else:
         function_file = function
 
-    scalade_func = find_scalade_func(function_file)
-    print("Running Function in '%s' mode .." %
-          ('self' if self_mode else 'scalade'))
-    scalade_func.__call__()
-
+    if tokens_stdin:
+        tokens_file = sys.stdin
+    if record and replay:
+        raise click.UsageError("Options '--record' and '--replay' are mutually exclusive.")
+    if self_mode and (record or replay):
+        raise click.UsageError("Option '--self' can't be used with '--record' or '--replay', "
+                               "they run against the recorded runtime API.")
+    if tokens_file and (record or profile):
+        raise click.UsageError("Options '--record' and '--profile' run a single function "
+                               "instance, they can't be used with tokens.")
+    if record:
+        with open(record, 'w'):
+            pass
+        os.environ['SCALADE_RECORD_FILE'] = record
+    if replay:
+        os.environ['SCALADE_REPLAY_FILE'] = replay
+
+    # A single function instance retrieves its context while the function module (and its
+    # dependencies) import, unless profiling: the profile covers the context retrieval.
+    context = None
+    if not tokens_file and not profile:
+        context = ContextManager.prefetch(os.getenv('SCALADE_FI_TOKEN'))
+    scalade_func = _find_scalade_func(function_file)
+    print("Running Function in '%s' mode%s .." % (
+        'self' if self_mode else 'scalade',
+        ", recording to '%s'" % record if record else
+        ", replaying '%s'" % replay if replay else ''))
+    if tokens_file:
+        tokens = [line.strip() for line in tokens_file if line.strip()]
+        summary = _run_many(scalade_func, function_file, tokens, concurrency, executor)
+        print(_format_run_summary(summary))
+        if summary['failed']:
+            sys.exit(1)
+        return
+    if not profile:
+        scalade_func.__call__(context=context)
+        return
 
-def _verify_config(config_file: str):
-    filepath = config_file
+    profiler = create_profiler(
+        profile, output_file=profile_output,
+        user_paths=[os.path.dirname(os.path.abspath(function_file))],
+        interval=profile_interval)
     try:
-        with open(filepath, 'r') as file:
-            config_data = yaml.safe_load(file)
-    except FileNotFoundError as exc:
-        print(f'An error occurred: {exc}')
-        return
+        with profiler:
+            scalade_func.__call__()
+    finally:
+        profiler.write()
+        print(profiler.summary())
+
+
+def _import_function_module(function_file: str):
+    global FUNCTION_MODULE
+
+    spec = util.spec_from_file_location('function_module', function_file)
+    FUNCTION_MODULE = util.module_from_spec(spec)
+    spec.loader.exec_module(FUNCTION_MODULE)
+
+
+def _find_scalade_func(function_file: str) -> Callable:
+    err = _import_function_module(function_file)
+    if not err:
+        attr_names = [
+            item for item in FUNCTION_MODULE.__dict__ if item[:2] != '__']
+        for name in attr_names:
+            attr_ = getattr(FUNCTION_MODULE, name)
+            try:
+                if attr_.__qualname__ == 'scalade_func.<locals>.execute':
+                    return attr_
+            except AttributeError:
+                pass
+
+    # todo: custom exception
+    raise Exception()
+
+
+def _run_many(scalade_func: Callable, function_file: str, tokens: List[str],
+              concurrency: int = 4, executor: str = 'thread') -> dict:
+    """
+    Runs a function instance per token concurrently, on threads or on processes (each one
+    imports the function module once), and returns the aggregate summary of the run.
+    """
+    if executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=concurrency, initializer=_init_run_worker,
+                                   initargs=(function_file, ))
+        run_instance = _run_worker_instance
+    else:
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+        run_instance = partial(_run_instance, scalade_func)
+
+    results = []
+    start = perf_counter()
+    with pool:
+        # Bounded submission keeps memory flat for large token lists.
+        pending = set()
+        for token in tokens:
+            if len(pending) >= concurrency * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            pending.add(pool.submit(run_instance, token))
+        results.extend(future.result() for future in as_completed(pending))
+    wall_time = perf_counter() - start
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    errors = Counter(error for _, error in results if error)
+    return dict(
+        instances=len(results),
+        completed=len(results) - sum(errors.values()),
+        failed=sum(errors.values()),
+        errors=dict(errors.most_common()),
+        concurrency=concurrency,
+        executor=executor,
+        wall_time=wall_time,
+        latency=dict(
+            mean=sum(latencies) / len(latencies),
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+            max=latencies[-1], ) if latencies else {}, )
+
+
+def _run_instance(scalade_func: Callable, token: str) -> Tuple[float, Optional[str]]:
+    start = perf_counter()
     try:
+        scalade_func(token=token)
+        error = None
+    except Exception as exc:
+        error = '%s: %s' % (exc.__class__.__name__, exc)
+
+    return perf_counter() - start, error
+
+
+def _init_run_worker(function_file: str):
+    global RUN_WORKER_FUNC
+    RUN_WORKER_FUNC = _find_scalade_func(function_file)
+
+
+def _run_worker_instance(token: str) -> Tuple[float, Optional[str]]:
+    return _run_instance(RUN_WORKER_FUNC, token)
+
+
+def _format_run_summary(summary: dict) -> str:
+    lines = ['%d instances (concurrency %d, %s executor) in %.2fs: %.1f instances/s' % (
+        summary['instances'], summary['concurrency'], summary['executor'],
+        summary['wall_time'], summary['instances'] / (summary['wall_time'] or 1)),
+        'completed %d, failed %d' % (summary['completed'], summary['failed'])]
+    if summary['latency']:
+        lines.append('latency ms: ' + ', '.join(
+            '%s %.2f' % (name, value * 1000) for name, value in summary['latency'].items()))
+    lines.extend('  %6d x %s' % (count, error) for error, count in summary['errors'].items())
+
+    return '\n'.join(lines)
+
+
+def _verify_configs(configs: List[str], jobs: int = None, pattern: str = 'function.yml',
+                    cache_file: str = VERIFY_CONFIG_CACHE_FILE, no_cache: bool = False,
+                    snapshot: bool = False) -> dict:
+    filepaths = _find_config_files(configs, pattern)
+    verified_hashes = set() if no_cache else _read_verify_config_cache(cache_file)
+
+    results = {}
+    pending = []
+    for filepath in filepaths:
+        try:
+            with open(filepath, 'rb') as file:
+                content_hash = sha256(file.read()).hexdigest()
+        except OSError as exc:
+            results[filepath] = dict(path=filepath, status='error',
+                                     error='%s: %s' % (exc.__class__.__name__, exc))
+            continue
+        if content_hash in verified_hashes:
+            results[filepath] = dict(path=filepath, status='cached', sha256=content_hash)
+        else:
+            pending.append(filepath)
+
+    if len(pending) > 1 and jobs != 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            verified = list(executor.map(_verify_config_file, pending, chunksize=8))
+    else:
+        verified = [_verify_config_file(filepath) for filepath in pending]
+    for result in verified:
+        results[result['path']] = result
+
+    report_results = [results[filepath] for filepath in filepaths]
+    if snapshot:
+        for result in report_results:
+            if result['status'] in ('valid', 'cached'):
+                result['snapshot'] = write_config_snapshot(result['path'])
+    if not no_cache:
+        verified_hashes.update(result['sha256'] for result in verified
+                               if result['status'] == 'valid')
+        _write_verify_config_cache(cache_file, verified_hashes)
+
+    counts = {status: 0 for status in ('valid', 'cached', 'invalid', 'error')}
+    for result in report_results:
+        counts[result['status']] += 1
+
+    return dict(
+        valid=bool(report_results) and not (counts['invalid'] or counts['error']),
+        total=len(report_results),
+        counts=counts,
+        results=report_results, )
+
+
+def _find_config_files(configs: List[str], pattern: str) -> List[str]:
+    filepaths = []
+    for config in configs:
+        paths = sorted(glob(config, recursive=True)) if has_magic(config) else [config]
+        for path in paths:
+            if os.path.isdir(path):
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames[:] = sorted(dirname for dirname in dirnames if dirname[0] != '.')
+                    filepaths.extend(os.path.join(dirpath, filename)
+                                     for filename in sorted(filenames) if fnmatch(filename, pattern))
+            else:
+                filepaths.append(path)
+
+    return list(dict.fromkeys(os.path.normpath(filepath) for filepath in filepaths))
+
+
+def _verify_config_file(filepath: str) -> dict:
+    try:
+        with open(filepath, 'rb') as file:
+            content = file.read()
+        content_hash = sha256(content).hexdigest()
+        config_data = parse_yaml(content)
         for i, ipt in enumerate(config_data['inputs']):
             ipt['__rank__'] = i
         for j, opt in enumerate(config_data['outputs']):
             opt['__rank__'] = j
         _ = FunctionConfig.deserialize(
             config_data)
+    except OSError as exc:
+        return dict(path=filepath, status='error',
+                    error='%s: %s' % (exc.__class__.__name__, exc))
     except Exception as exc:
-        print("Function configuration is invalid\n%s: %s" %
-              (exc.__class__.__name__, exc))
-        return
+        return dict(path=filepath, status='invalid', sha256=content_hash,
+                    error='%s: %s' % (exc.__class__.__name__, exc))
+
+    return dict(path=filepath, status='valid', sha256=content_hash)
 
-    print('Verified Function configuration ..')
+
+def _read_verify_config_cache(cache_file: str) -> set:
+    try:
+        with open(cache_file, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return set()
+    if cache.get('version') != get_pckg_dist_version_num():
+        return set()
+
+    return set(cache.get('sha256', []))
+
+
+def _write_verify_config_cache(cache_file: str, verified_hashes: set):
+    tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+    with open(tmp_file, 'w') as file:
+        json.dump(dict(version=get_pckg_dist_version_num(),
+                       sha256=sorted(verified_hashes)), file)
+    os.replace(tmp_file, cache_file)
 
 
 if __name__ == '__main__':
@@ -1,39 +1,53 @@
+from collections import defaultdict, deque
+import json
 import os
-from requests import Session
+import threading
+from time import monotonic, perf_counter
+from requests.exceptions import Timeout
 from requests.models import Response
-from requests.structures import CaseInsensitiveDict
 from typing import Tuple
 
-from .utils import get_pckg_dist_version_num
+from .exceptions import DeadlineExceededError, ReplayError
+from .instrumentation import api_call_phase, phase
+from .transports import API_NAMESPACE, HTTPTransport, Transport, build_response, \
+    create_transport
 
 
 class ScaladeRuntimeAPIClient:
     """
-    Scalade runtime API namespace HTTP client.
+    Scalade runtime API namespace client, runtime API calls go through its transport
+    (HTTP over TCP by default, see scaladecore.transports).
     """
-    API_NAMESPACE = '/api/{version}/runtime/'
+    API_NAMESPACE = API_NAMESPACE
     BASE_HEADERS = {
         'Authorization': 'Bearer {token}',
         'Content-Type': 'application/json'
     }
 
-    def __init__(self, token: str = None):
-        self._set_base_api_url()
+    def __init__(self, token: str = None, transport: Transport = None, deadline: float = None):
         self._token = token or os.getenv('SCALADE_FI_TOKEN')
+        self._transport = transport or create_transport()
+        # Every call is bounded by the SCALADE_API_TIMEOUT seconds and by the deadline, a
+        # time.monotonic() timestamp.
+        self.timeout = float(os.getenv('SCALADE_API_TIMEOUT', 0)) or None
+        self.deadline = deadline
+        self._headers = dict(self.BASE_HEADERS)
+        self._headers['Authorization'] = self._headers['Authorization'].format(
+            token=self._token)
 
-        self.new_http_session()
+    @property
+    def transport(self) -> Transport:
+        return self._transport
 
-    def _set_base_api_url(self):
-        use_ssl = os.getenv('SCALADE_API_SERVER_USE_SSL', 'False')
-        self._base_api_url = "{protocol}://{hostname}:{port}{relative_url}".format(
-            protocol='https' if use_ssl == 'True' else 'http',
-            hostname=os.getenv(
-                'SCALADE_API_SERVER_HOST', 'localhost'),
-            port=os.getenv(
-                'SCALADE_API_SERVER_PORT', '8000'),
-            relative_url=self.API_NAMESPACE.format(
-                version="v%s" % get_pckg_dist_version_num())
-        )
+    def new_http_session(self):
+        """
+        Replaces the transport with a new HTTP(S) one, on a new session carrying the client
+        headers. Kept for callers of the former session based client.
+        """
+        self._transport.close()
+        self._transport = HTTPTransport.from_environ()
+        self._session = self._transport.session
+        self._session.headers.update(self._headers)
 
     def _eval_response(self, resp: Response) -> Tuple[Response, bool]:
         if resp.status_code == 200:
@@ -41,29 +55,131 @@ class ScaladeRuntimeAPIClient:
         else:
             return resp, False
 
-    def new_http_session(self):
-        headers = dict()
-        headers |= self.BASE_HEADERS
-        headers['Authorization'] = headers['Authorization'].format(
-            token=self._token)
+    def _request(self, name: str, method: str, endpoint: str, body: dict = None,
+                 headers: dict = None) -> Tuple[Response, bool]:
+        """Performs a runtime API call, every client call goes through it."""
+        timeout = self._get_timeout(name)
+        headers = dict(self._headers, **headers) if headers else self._headers
+        with phase(api_call_phase(name)):
+            try:
+                return self._eval_response(
+                    self._transport.request(method, endpoint, headers, body, timeout))
+            except (Timeout, TimeoutError):
+                if self.deadline is not None and monotonic() >= self.deadline:
+                    raise DeadlineExceededError(name)
+                raise
 
-        self._session = Session()
-        default_headers = dict(self._session.headers)
-        headers |= default_headers
-        self._session.headers = CaseInsensitiveDict(headers)
+    def _get_timeout(self, name: str) -> float:
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError(name)
+        return remaining if self.timeout is None else min(self.timeout, remaining)
 
-    def retrieve_fi_context(self):
-        return self._eval_response(
-            self._session.get(self._base_api_url + 'retrieve-fi-context/'))
+    def retrieve_fi_context(self, etag: str = None):
+        """
+        Retrieves the function instance context, conditionally if the ETag of a previously
+        retrieved one is given: then a 304 response means it has not been modified.
+        """
+        return self._request('retrieve_fi_context', 'GET', 'retrieve-fi-context/',
+                             headers={'If-None-Match': etag} if etag else None)
 
     def create_fi_log_message(self, body: dict):
-        return self._eval_response(
-            self._session.post(self._base_api_url + 'create-fi-log-message/', json=body))
+        return self._request('create_fi_log_message', 'POST', 'create-fi-log-message/', body)
 
     def update_fi_status(self, body: dict):
-        return self._eval_response(
-            self._session.patch(self._base_api_url + 'update-fi-status/', json=body))
+        return self._request('update_fi_status', 'PATCH', 'update-fi-status/', body)
 
     def create_fi_output(self, body: dict):
-        return self._eval_response(
-            self._session.post(self._base_api_url + 'create-fi-output/', json=body))
+        return self._request('create_fi_output', 'POST', 'create-fi-output/', body)
+
+
+class RecordingRuntimeAPIClient(ScaladeRuntimeAPIClient):
+    """
+    Runtime API client that appends every call response, as JSON lines, to a file
+    which ReplayRuntimeAPIClient replays afterwards.
+    """
+
+    def __init__(self, token: str = None, record_file: str = None, transport: Transport = None,
+                 deadline: float = None):
+        super().__init__(token, transport, deadline)
+        self._record_file = record_file or os.getenv('SCALADE_RECORD_FILE')
+        self._lock = threading.Lock()
+
+    def _request(self, name: str, method: str, endpoint: str, body: dict = None,
+                 headers: dict = None) -> Tuple[Response, bool]:
+        start = perf_counter()
+        resp, ok = super()._request(name, method, endpoint, body, headers)
+        line = json.dumps(dict(
+            call=name,
+            status_code=resp.status_code,
+            content_type=resp.headers.get('Content-Type'),
+            etag=resp.headers.get('ETag'),
+            content=resp.text,
+            elapsed=perf_counter() - start, )) + '\n'
+        with self._lock, open(self._record_file, 'a') as file:
+            file.write(line)
+
+        return resp, ok
+
+
+class ReplayTransport(Transport):
+    """
+    Serves the responses recorded by RecordingRuntimeAPIClient, in order per call, with no
+    network at all. Every transport replays the whole file.
+    """
+
+    def __init__(self, replay_file: str):
+        self.replay_file = replay_file
+        self._lock = threading.Lock()
+        self._responses = defaultdict(deque)
+        with open(replay_file, 'r') as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    self._responses[record['call']].append(record)
+
+    def request(self, method: str, endpoint: str, headers: dict, body: dict = None,
+                timeout: float = None) -> Response:
+        # Calls are recorded by client method name, i.e: 'retrieve-fi-context/' is
+        # 'retrieve_fi_context'.
+        name = endpoint.strip('/').replace('-', '_')
+        with self._lock:
+            try:
+                record = self._responses[name].popleft()
+            except IndexError:
+                raise ReplayError(name, self.replay_file)
+
+        resp_headers = {'Content-Type': record['content_type'] or 'application/json'}
+        if record.get('etag'):
+            resp_headers['ETag'] = record['etag']
+        return build_response(
+            record['status_code'], record['content'].encode('utf-8'), resp_headers,
+            'replay://%s/%s' % (os.path.abspath(self.replay_file), endpoint))
+
+
+class ReplayRuntimeAPIClient(ScaladeRuntimeAPIClient):
+    """Runtime API client on a ReplayTransport of SCALADE_REPLAY_FILE."""
+
+    def __init__(self, token: str = None, replay_file: str = None, deadline: float = None):
+        self._replay_file = replay_file or os.getenv('SCALADE_REPLAY_FILE')
+        super().__init__(token, ReplayTransport(self._replay_file), deadline)
+
+
+def create_runtime_api_client(token: str = None, transport: Transport = None,
+                              deadline: float = None) -> ScaladeRuntimeAPIClient:
+    """
+    Factory function of the runtime API client: a replaying one if SCALADE_REPLAY_FILE is set,
+    a recording one if SCALADE_RECORD_FILE is set, else a live one.
+
+    :param token: (str) the function instance token.
+    :param transport: (Transport) overrides the default transport of live clients.
+    :param deadline: (float) the time.monotonic() deadline bounding every call.
+    """
+    if os.getenv('SCALADE_REPLAY_FILE'):
+        return ReplayRuntimeAPIClient(token, deadline=deadline)
+    if os.getenv('SCALADE_RECORD_FILE'):
+        return RecordingRuntimeAPIClient(token, transport=transport, deadline=deadline)
+
+    return ScaladeRuntimeAPIClient(token, transport=transport, deadline=deadline)
@@ -1,9 +1,23 @@
 from abc import ABC, abstractmethod
-from typing import List
+from copy import deepcopy
+from typing import Any, List, Optional
+import hashlib
 import json
 import os
+import threading
 import yaml
 
+try:
+    from yaml import CSafeLoader as YAMLSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLSafeLoader
+
+# Precompiled config snapshots are JSON sidecar files next to the YAML, i.e: function.yml.json
+CONFIG_SNAPSHOT_SUFFIX = '.json'
+
+_CONFIG_CACHE = {}
+_CONFIG_CACHE_LOCK = threading.Lock()
+
 
 class ConfigSerializer(ABC):
     @classmethod
@@ -21,6 +35,10 @@ class ConfigSerializer(ABC):
 
 class VariableConfig(ConfigSerializer):
     def __init__(self, id_name: str, type_: str, verbose_name: str, rank: int):
+        # Imported here: variables import config through utils.
+        from .variables import get_variable_type
+
+        get_variable_type(type_)
         self.id_name = id_name
         self.type = type_
         self.verbose_name = verbose_name
@@ -129,7 +147,89 @@ class FunctionConfigProvider:
     @staticmethod
     def read_config():
         filepath = os.path.join(os.getcwd(), 'config', 'function.yml')
-        with open(filepath, 'r') as file:
-            config_data = yaml.safe_load(file.read())
-
-        return config_data
+        return load_config_file(filepath)
+
+
+def parse_yaml(stream) -> Any:
+    """Parses YAML with the C SafeLoader when libyaml is available."""
+    return yaml.load(stream, Loader=YAMLSafeLoader)
+
+
+def load_config_file(filepath: str) -> Any:
+    """
+    Loads a YAML config file through a process-wide cache keyed by path and mtime, so it
+    is only parsed again when the file changes.
+    A precompiled snapshot (see write_config_snapshot) of the same YAML contents (by sha256)
+    is loaded instead of parsing YAML, also when the YAML file itself is not deployed.
+    It returns a copy of the cached data that callers are free to mutate.
+    """
+    filepath = os.path.abspath(filepath)
+    snapshot_path = filepath + CONFIG_SNAPSHOT_SUFFIX
+    try:
+        stat = os.stat(filepath)
+        yaml_missing = False
+    except FileNotFoundError:
+        if not os.path.exists(snapshot_path):
+            raise
+        stat = os.stat(snapshot_path)
+        yaml_missing = True
+    cache_key = (yaml_missing, stat.st_mtime_ns, stat.st_size)
+
+    with _CONFIG_CACHE_LOCK:
+        cached = _CONFIG_CACHE.get(filepath)
+    if cached and cached[0] == cache_key:
+        return deepcopy(cached[1])
+
+    snapshot = _read_config_snapshot(snapshot_path)
+    if yaml_missing:
+        config_data = snapshot['config']
+    else:
+        with open(filepath, 'rb') as file:
+            content = file.read()
+        if snapshot and snapshot.get('sha256') == hashlib.sha256(content).hexdigest():
+            config_data = snapshot['config']
+        else:
+            config_data = parse_yaml(content)
+
+    with _CONFIG_CACHE_LOCK:
+        _CONFIG_CACHE[filepath] = (cache_key, config_data)
+
+    return deepcopy(config_data)
+
+
+def write_config_snapshot(filepath: str) -> Optional[str]:
+    """
+    Precompiles a YAML config file into its JSON snapshot sidecar and returns its path.
+    YAML that does not map to JSON (i.e: dates) gets no snapshot and None is returned.
+    """
+    with open(filepath, 'rb') as file:
+        content = file.read()
+    snapshot_path = os.path.abspath(filepath) + CONFIG_SNAPSHOT_SUFFIX
+    try:
+        snapshot = json.dumps(dict(sha256=hashlib.sha256(content).hexdigest(),
+                                   config=parse_yaml(content)))
+    except (TypeError, ValueError):
+        # A stale snapshot would outlive the YAML file it no longer matches.
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+        return None
+    with open(snapshot_path, 'w') as file:
+        file.write(snapshot)
+
+    return snapshot_path
+
+
+def _read_config_snapshot(snapshot_path: str) -> Optional[dict]:
+    try:
+        with open(snapshot_path, 'rb') as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return None
+    if not isinstance(snapshot, dict) or 'config' not in snapshot:
+        return None
+    return snapshot
+
+
+def clear_config_cache():
+    with _CONFIG_CACHE_LOCK:
+        _CONFIG_CACHE.clear()
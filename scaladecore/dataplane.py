@@ -0,0 +1,116 @@
+"""
+Local data plane: large output bodies are published into shared memory (a tmpfs directory
+such as /dev/shm) and only a reference to them travels through the runtime API. Downstream
+function instances on the same host map the reference zero-copy.
+
+It is enabled by SCALADE_DATA_PLANE_DIR, bodies from SCALADE_DATA_PLANE_THRESHOLD bytes
+(default 1 MiB) are published. Published bodies are content addressed, so republishing the
+same body is free; purge_data_plane removes the stale ones.
+"""
+from hashlib import sha256
+import json
+import mmap
+import os
+import socket
+import threading
+from time import time
+from typing import Optional, Union
+
+from .exceptions import DataPlaneError
+
+REFERENCE_PREFIX = b'scalade+shm://'
+DEFAULT_THRESHOLD = 1024 * 1024
+
+
+def get_data_plane_dir() -> Optional[str]:
+    return os.getenv('SCALADE_DATA_PLANE_DIR') or None
+
+
+def get_data_plane_threshold() -> int:
+    return int(os.getenv('SCALADE_DATA_PLANE_THRESHOLD', DEFAULT_THRESHOLD))
+
+
+def should_publish(size: int) -> bool:
+    """Whether a body of size bytes is to be published."""
+    return get_data_plane_dir() is not None and size >= get_data_plane_threshold()
+
+
+def publish(body: Union[bytes, memoryview]) -> bytes:
+    """Publishes a body (a bytes-like object) into the data plane directory, returns its reference."""
+    data_plane_dir = get_data_plane_dir()
+    os.makedirs(data_plane_dir, exist_ok=True)
+    digest = sha256(body).hexdigest()
+    path = os.path.join(data_plane_dir, digest)
+    if not os.path.exists(path):
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as file:
+            file.write(body)
+        os.replace(tmp_path, path)
+    else:
+        os.utime(path)
+
+    return REFERENCE_PREFIX + json.dumps(dict(
+        host=socket.gethostname(), path=path, size=len(body), sha256=digest)).encode()
+
+
+def is_reference(body: Union[bytes, memoryview]) -> bool:
+    return bytes(body[:len(REFERENCE_PREFIX)]) == REFERENCE_PREFIX
+
+
+def resolve(body: bytes) -> Union[bytes, memoryview]:
+    """
+    Resolves a data plane reference into a read-only memoryview of the shared memory
+    mapping of its body, any other body is returned as is, as are references while the
+    data plane is disabled.
+    Only bodies published into the data plane directory of this host, whose contents still
+    match their sha256, are mapped.
+    """
+    data_plane_dir = get_data_plane_dir()
+    if data_plane_dir is None or not is_reference(body):
+        return body
+    try:
+        reference = json.loads(bytes(body[len(REFERENCE_PREFIX):]))
+        path, size, digest = reference['path'], reference['size'], reference['sha256']
+    except (ValueError, TypeError, KeyError):
+        # Not a reference, a body that happens to start like one.
+        return body
+
+    if reference.get('host') != socket.gethostname():
+        raise DataPlaneError(reference, 'published on another host')
+    path = os.path.realpath(path)
+    if os.path.dirname(path) != os.path.realpath(data_plane_dir):
+        raise DataPlaneError(reference, 'outside of the data plane directory')
+    if os.path.basename(path) != digest:
+        raise DataPlaneError(reference, 'path does not match its sha256')
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size != size:
+                raise DataPlaneError(reference, 'size mismatch')
+            if not size:
+                mapped = b''
+            else:
+                # The view keeps the mapping alive, the file can be closed.
+                mapped = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    except OSError as exc:
+        raise DataPlaneError(reference, str(exc))
+    if sha256(mapped).hexdigest() != digest:
+        raise DataPlaneError(reference, 'sha256 mismatch')
+
+    return mapped
+
+
+def purge_data_plane(max_age: float) -> int:
+    """Removes the bodies published more than max_age seconds ago, returns how many."""
+    data_plane_dir = get_data_plane_dir()
+    if not data_plane_dir or not os.path.isdir(data_plane_dir):
+        return 0
+    removed = 0
+    for entry in os.scandir(data_plane_dir):
+        try:
+            if entry.is_file() and time() - entry.stat().st_mtime > max_age:
+                os.unlink(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+
+    return removed
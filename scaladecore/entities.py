@@ -1,20 +1,73 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import sys
-from typing import List
+from itertools import repeat
+import json
+import multiprocessing
+import os
+from typing import List, Optional, Tuple, Type, Union
 from uuid import UUID, uuid4
 
-from .config import InputConfig, OutputConfig, PositionConfig
-from .exceptions import EntityFactoryError
+from . import dataplane
+from .config import ConfigSerializer, InputConfig, OutputConfig, PositionConfig
+from .exceptions import DuplicateEntityTypeError, EntityFactoryError
+from .memory import get_memory_budget
 from .utils import parse_dt, format_dt, decode_b64str, bytes_to_b64str
 from .variables import Variable
 
+# Batches with at least this many entities, or whose SIZE_FIELD values add up to this many
+# bytes (SCALADE_DECODE_POOL_THRESHOLD), are decoded across a process pool.
+BULK_DECODE_POOL_THRESHOLD = 50000
+BULK_DECODE_CHUNK_SIZE = 5000
+VARIABLES_DECODE_POOL_THRESHOLD = 64 * 1024 * 1024
+# Decoding runs while other threads (spool, output uploads, prefetches) may hold locks: the
+# pool workers are not forked from this process, which would inherit those locks held.
+BULK_DECODE_START_METHOD = 'forkserver' \
+    if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_ENTITY_TYPES = {}
+
+
+def _normalize_type_name(type_: str) -> str:
+    return type_.replace('_', '').lower()
+
 
 class EntityContract(ABC):
+    # Attribute names (without the leading underscore) that hold nested entities.
+    NESTED_ENTITIES: Tuple[str, ...] = ()
+    # Attribute names that hold mutable objects (lists, configs): their in-place mutations
+    # aren't seen by __setattr__, the cached JSON serialization is keyed by their state.
+    MUTABLE_FIELDS: Tuple[str, ...] = ()
+    # Data dict key of the bulk of an entity data (i.e: a base64 body), decoding is chunked
+    # by its size too.
+    SIZE_FIELD: Optional[str] = None
+
     def __init__(self, uuid: UUID = None, created: datetime = None):
         self.__uuid = uuid or uuid4()
         self._created = created or datetime.utcnow()
 
+    def __init_subclass__(cls, register: bool = True, **kwargs):
+        """
+        Registers the entity type by its class name (without 'Entity'),
+        register=False opts out i.e: for test doubles.
+        """
+        super().__init_subclass__(**kwargs)
+        if not register:
+            return
+        type_name = cls.__name__
+        if type_name.endswith('Entity'):
+            type_name = type_name[:-len('Entity')]
+        type_name = _normalize_type_name(type_name)
+        if type_name in _ENTITY_TYPES:
+            raise DuplicateEntityTypeError(type_name, _ENTITY_TYPES[type_name])
+        _ENTITY_TYPES[type_name] = cls
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # Any mutation invalidates the cached JSON serialization.
+        if '_json_cache' in self.__dict__:
+            del self.__dict__['_json_cache']
+
     @property
     def uuid(self):
         return self.__uuid
@@ -27,6 +80,18 @@ class EntityContract(ABC):
     def create_from_dict(cls, obj_d: dict):
         pass
 
+    @staticmethod
+    def get_entity_type(type_: str) -> Type['EntityContract']:
+        """
+        Resolves an entity class from the registry of entity types.
+
+        :param type_: (str) the entity type name i.e: 'Account', 'FunctionType', 'function_type'.
+        """
+        try:
+            return _ENTITY_TYPES[_normalize_type_name(type_)]
+        except KeyError:
+            raise EntityFactoryError('%sEntity' % type_)
+
     @classmethod
     def create_entity_from_dict(cls, type_: str, obj_d: dict):
         """Factory function
@@ -36,20 +101,99 @@ class EntityContract(ABC):
         :param type_: (str) the entity type name i.e: 'Account', 'User', 'FunctionType', 'Stream'.
         :param obj_d: (dict) the entity data.
         """
-        class_name = '%sEntity' % type_.capitalize()
-        try:
-            entity_type = getattr(sys.modules[__name__], class_name)
-        except AttributeError:
-            raise EntityFactoryError(class_name)
-        return entity_type.create_from_dict(obj_d)
+        return cls.get_entity_type(type_).create_from_dict(obj_d)
+
+    @classmethod
+    def create_entities_from_dicts(cls, type_: str, objs: Union[List[dict], str, bytes],
+                                   max_workers: int = None) -> list:
+        """Bulk factory function
+        Creates a list of entities of the same type, resolving the entity class only once.
+        Batches of at least BULK_DECODE_POOL_THRESHOLD entities, or whose SIZE_FIELD values
+        add up to SCALADE_DECODE_POOL_THRESHOLD bytes (default VARIABLES_DECODE_POOL_THRESHOLD),
+        are decoded across a process pool in chunks of at most BULK_DECODE_CHUNK_SIZE entities
+        and about the same size, smaller ones in a plain loop. Decoding holds the GIL (base64,
+        UUID and datetime parsing): threads would not help.
+
+        :param type_: (str) the entity type name i.e: 'Variable', 'FunctionInstanceLogMessage'.
+        :param objs: (list|str|bytes) a list of entity data dicts or a JSON array of them.
+        :param max_workers: (int) process pool size, default the CPU count, 1 disables the pool.
+        """
+        entity_type = cls.get_entity_type(type_)
+        if isinstance(objs, (str, bytes, bytearray)):
+            objs = json.loads(objs)
+
+        workers = min(max_workers or os.cpu_count() or 1, len(objs))
+        size_field = entity_type.SIZE_FIELD
+        size = sum(len(obj_d.get(size_field) or '') for obj_d in objs) if size_field else 0
+        threshold = int(os.getenv('SCALADE_DECODE_POOL_THRESHOLD', VARIABLES_DECODE_POOL_THRESHOLD))
+        if workers < 2 or (len(objs) < BULK_DECODE_POOL_THRESHOLD and
+                           (not size_field or size < threshold)):
+            return _create_entities_chunk(entity_type, objs)
+
+        chunks = _split_chunks(objs, BULK_DECODE_CHUNK_SIZE, size / workers, size_field)
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                 mp_context=multiprocessing.get_context(
+                                     BULK_DECODE_START_METHOD)) as executor:
+            return [entity
+                    for chunk in executor.map(_create_entities_chunk, repeat(entity_type), chunks)
+                    for entity in chunk]
 
     @property
-    @abstractmethod
     def as_dict(self) -> dict:
+        entity_d = self.fields_dict
+        for name in self.NESTED_ENTITIES:
+            nested = self.get(name)
+            entity_d[name] = nested.as_dict if nested else None
+
+        return entity_d
+
+    @property
+    def fields_dict(self) -> dict:
+        """
+        Serialized entity fields, NESTED_ENTITIES are None placeholders (keeping the order of
+        the keys) filled in by as_dict and to_json_bytes.
+        """
         return dict(
             uuid=str(self.uuid),
             created=format_dt(self._created), )
 
+    def to_json_bytes(self) -> bytes:
+        """
+        Serializes the entity straight to UTF-8 encoded JSON bytes.
+        The result is cached until the entity or the state of its MUTABLE_FIELDS changes,
+        nested entities are spliced in from their own cached serialization so they are not
+        rebuilt on every call. It is equivalent to json.dumps(self.as_dict).encode().
+        """
+        nested = tuple(entity.to_json_bytes() if entity else b'null'
+                       for entity in map(self.get, self.NESTED_ENTITIES))
+        mutable_state = tuple(_serialize_mutable(self.get(name)) for name in self.MUTABLE_FIELDS)
+        cached = self.__dict__.get('_json_cache')
+        if cached and all(a is b for a, b in zip(cached[0], nested)) and \
+                cached[1] == mutable_state:
+            return cached[2]
+
+        fields = self.fields_dict
+        if not nested:
+            json_bytes = json.dumps(fields).encode()
+        else:
+            # Runs of plain fields are dumped at once, nested entities spliced in between.
+            nested_by_name = dict(zip(self.NESTED_ENTITIES, nested))
+            parts, run = [], {}
+            for name, value in fields.items():
+                if name not in nested_by_name:
+                    run[name] = value
+                    continue
+                if run:
+                    parts.append(json.dumps(run)[1:-1].encode())
+                    run = {}
+                parts.append(b'"%s": %s' % (name.encode(), nested_by_name[name]))
+            if run:
+                parts.append(json.dumps(run)[1:-1].encode())
+            json_bytes = b'{' + b', '.join(parts) + b'}'
+        self.__dict__['_json_cache'] = (nested, mutable_state, json_bytes)
+
+        return json_bytes
+
     @staticmethod
     def get_base_kwargs(obj_d: dict) -> dict:
         return dict(
@@ -79,8 +223,8 @@ class AccountEntity(EntityContract):
             last_login=parse_dt(last_login) if last_login else None, )
 
     @property
-    def as_dict(self) -> dict:
-        acc_d = super().as_dict
+    def fields_dict(self) -> dict:
+        acc_d = super().fields_dict
         acc_d.update(dict(
             auth_id=self._auth_id,
             username=self._username,
@@ -92,6 +236,8 @@ class AccountEntity(EntityContract):
 
 
 class BusinessEntity(EntityContract):
+    NESTED_ENTITIES = ('master_account', )
+
     def __init__(self, master_account: AccountEntity, organization_name: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._master_account = master_account
@@ -106,10 +252,10 @@ class BusinessEntity(EntityContract):
             organization_name=obj_d.get('organization_name'), )
 
     @property
-    def as_dict(self) -> dict:
-        bs_d = super().as_dict
+    def fields_dict(self) -> dict:
+        bs_d = super().fields_dict
         bs_d.update(dict(
-            master_account=self._master_account.as_dict,
+            master_account=None,
             organization_name=self._organization_name,
         ))
 
@@ -117,6 +263,8 @@ class BusinessEntity(EntityContract):
 
 
 class UserEntity(EntityContract):
+    NESTED_ENTITIES = ('account', 'business', )
+
     def __init__(self, account: AccountEntity, business: BusinessEntity, first_name: str,
                  last_name: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -136,11 +284,11 @@ class UserEntity(EntityContract):
         )
 
     @property
-    def as_dict(self) -> dict:
-        user_d = super().as_dict
+    def fields_dict(self) -> dict:
+        user_d = super().fields_dict
         user_d.update(dict(
-            account=self._account.as_dict,
-            business=self._business.as_dict,
+            account=None,
+            business=None,
             first_name=self._first_name,
             last_name=self._last_name, ))
 
@@ -148,6 +296,8 @@ class UserEntity(EntityContract):
 
 
 class WorkspaceEntity(EntityContract):
+    NESTED_ENTITIES = ('business', )
+
     def __init__(self, name: str, business: BusinessEntity, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._name = name
@@ -162,17 +312,20 @@ class WorkspaceEntity(EntityContract):
         )
 
     @property
-    def as_dict(self) -> dict:
-        ws_d = super().as_dict
+    def fields_dict(self) -> dict:
+        ws_d = super().fields_dict
         ws_d.update(dict(
             name=self._name,
-            business=self._business.as_dict,
+            business=None,
         ))
 
         return ws_d
 
 
 class FunctionTypeEntity(EntityContract):
+    NESTED_ENTITIES = ('account', )
+    MUTABLE_FIELDS = ('inputs', 'outputs', )
+
     def __init__(self, key: str, verbose_name: str, description: str, updated: datetime,
                  account: AccountEntity, inputs: List[InputConfig] = None,
                  outputs: List[OutputConfig] = None, *args, **kwargs):
@@ -205,8 +358,8 @@ class FunctionTypeEntity(EntityContract):
         )
 
     @property
-    def as_dict(self) -> dict:
-        ft_d = super().as_dict
+    def fields_dict(self) -> dict:
+        ft_d = super().fields_dict
         ft_d.update(dict(
             key=self._key,
             verbose_name=self._verbose_name,
@@ -215,7 +368,7 @@ class FunctionTypeEntity(EntityContract):
             inputs=[it.serialize for it in self._inputs] if self._inputs else None,
             outputs=[
                 ot.serialize for ot in self._outputs] if self._outputs else None,
-            account=self._account.as_dict, ))
+            account=None, ))
 
         return ft_d
 
@@ -228,6 +381,7 @@ class StreamEntity(EntityContract):
         ('cancelled', 'Cancelled'),
         ('finished', 'Finished'),
     ]
+    NESTED_ENTITIES = ('account', )
 
     def __init__(self, name: str, updated: datetime, status: str, account: AccountEntity,
                  pushed: datetime = None, finished: datetime = None,
@@ -255,15 +409,15 @@ class StreamEntity(EntityContract):
         )
 
     @property
-    def as_dict(self) -> dict:
-        stream_d = super().as_dict
+    def fields_dict(self) -> dict:
+        stream_d = super().fields_dict
         stream_d.update(dict(
             name=self._name,
             pushed=format_dt(self._pushed) if self._pushed else None,
             updated=format_dt(self._updated),
             finished=format_dt(self._finished) if self._finished else None,
             status=self._status,
-            account=self._account.as_dict, ))
+            account=None, ))
 
         return stream_d
 
@@ -276,6 +430,13 @@ class FunctionInstanceEntity(EntityContract):
         ('canceled', 'Canceled'),
         ('completed', 'Completed'),
     ]
+    # Statuses each status method (see ContextManager.Block and Complete) is valid from.
+    STATUS_METHODS = {
+        'block': ('pending', 'running'),
+        'complete': ('pending', 'running'),
+    }
+    NESTED_ENTITIES = ('function_type', 'stream', )
+    MUTABLE_FIELDS = ('position', )
 
     def __init__(self, function_type: FunctionTypeEntity, stream: StreamEntity,
                  position: PositionConfig, updated: datetime, status: str,
@@ -307,11 +468,11 @@ class FunctionInstanceEntity(EntityContract):
         )
 
     @property
-    def as_dict(self) -> dict:
-        fi_d = super().as_dict
+    def fields_dict(self) -> dict:
+        fi_d = super().fields_dict
         fi_d.update(dict(
-            function_type=self._function_type.as_dict,
-            stream=self._stream.as_dict,
+            function_type=None,
+            stream=None,
             position=self._position.serialize,
             initialized=format_dt(
                 self._initialized) if self._initialized else None,
@@ -326,6 +487,8 @@ class FunctionInstanceEntity(EntityContract):
 
 
 class VariableEntity(EntityContract):
+    SIZE_FIELD = 'body'
+
     def __init__(self, iot: str, id_name: str, type_: str, charset: str, bytes_: bytes,
                  fi_uuid: str, rank: int, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -333,7 +496,7 @@ class VariableEntity(EntityContract):
         self._id_name = id_name
         self._type = type_
         self._charset = charset
-        self._bytes = bytes_
+        self._set_bytes(bytes_)
         self._fi_uuid = fi_uuid
         self._rank = rank
 
@@ -351,8 +514,8 @@ class VariableEntity(EntityContract):
         )
 
     @property
-    def as_dict(self) -> dict:
-        var_d = super().as_dict
+    def fields_dict(self) -> dict:
+        var_d = super().fields_dict
         var_d.update(dict(
             iot=self._iot,
             id_name=self._id_name,
@@ -366,13 +529,31 @@ class VariableEntity(EntityContract):
 
     @property
     def to_var(self) -> Variable:
+        # The variable gets a view of the body admitted by the entity, not another copy.
+        body = dataplane.resolve(self._bytes)
         return Variable.create(
             type_=self._type,
             id_name=self._id_name,
-            bytes_=self._bytes,
+            bytes_=memoryview(body) if isinstance(body, bytes) else body,
             charset=self._charset,
         )
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if isinstance(self._bytes, memoryview):
+            state['_bytes'] = self._bytes.tobytes()
+        state.pop('_release', None)
+        return state
+
+    def __setstate__(self, state):
+        body = state.pop('_bytes', None)
+        self.__dict__.update(state)
+        self._set_bytes(body)
+
+    def _set_bytes(self, body):
+        """Sets the body, admitted into the process memory budget once per entity."""
+        self._bytes, self._release = get_memory_budget().admit(self, body)
+
 
 class FunctionInstanceLogMessageEntity(EntityContract):
     LOG_LEVELS = [('debug', 'Debug'),
@@ -397,11 +578,45 @@ class FunctionInstanceLogMessageEntity(EntityContract):
         )
 
     @property
-    def as_dict(self) -> dict:
-        fi_log_message_d = super().as_dict
+    def fields_dict(self) -> dict:
+        fi_log_message_d = super().fields_dict
         fi_log_message_d.update(dict(
             fi_uuid=str(self._fi_uuid),
             log_message=self._log_message,
             log_level=self._log_level, ))
 
         return fi_log_message_d
+
+
+def _serialize_mutable(value):
+    """The state of a mutable field: serialized configs, lists of them or the value itself."""
+    if isinstance(value, list):
+        return [_serialize_mutable(item) for item in value]
+    if isinstance(value, ConfigSerializer):
+        return value.serialize
+    return value
+
+
+def _create_entities_chunk(entity_type: Type[EntityContract], objs: List[dict]) -> list:
+    create_from_dict = entity_type.create_from_dict
+    return [create_from_dict(obj_d) for obj_d in objs]
+
+
+def _split_chunks(objs: List[dict], chunk_len: int, chunk_size: float = 0,
+                  size_field: str = None) -> List[List[dict]]:
+    """
+    Splits entity data dicts, in order, into chunks of at most chunk_len of them and, with a
+    size_field, of about chunk_size bytes of it.
+    """
+    chunks, chunk, size = [], [], 0
+    for obj_d in objs:
+        chunk.append(obj_d)
+        if size_field:
+            size += len(obj_d.get(size_field) or '')
+        if len(chunk) >= chunk_len or (size_field and size >= chunk_size):
+            chunks.append(chunk)
+            chunk, size = [], 0
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
@@ -6,11 +6,66 @@ class EntityFactoryError(Exception):
         return f'"{self.entity_type}" is not a valid entity type.'
 
 
+class DuplicateEntityTypeError(Exception):
+    def __init__(self, type_name: str, registered: type):
+        self.type_name = type_name
+        self.registered = registered
+
+    def __str__(self):
+        return (f'Entity type "{self.type_name}" is already registered by '
+                f'{self.registered.__module__}.{self.registered.__qualname__}.')
+
+
 class BearerTokenParseError(Exception):
     def __str__(self):
         return "Unable to parse Bearer Token: failed matching regular expression."
 
 
+class ReplayError(Exception):
+    def __init__(self, call: str, replay_file: str):
+        self.call = call
+        self.replay_file = replay_file
+
+    def __str__(self):
+        return (f'No more recorded "{self.call}" responses in "{self.replay_file}": '
+                f'the function diverged from the recording.')
+
+
+class DataPlaneError(Exception):
+    def __init__(self, reference: dict, reason: str):
+        self.reference = reference
+        self.reason = reason
+
+    def __str__(self):
+        return f'Unable to resolve data plane reference {self.reference}: {self.reason}.'
+
+
+class DeadlineExceededError(Exception):
+    def __init__(self, call: str):
+        self.call = call
+
+    def __str__(self):
+        return f'The function instance deadline was exceeded on "{self.call}".'
+
+
+class SpoolClosedError(Exception):
+    def __init__(self, journal_path: str, call: str):
+        self.journal_path = journal_path
+        self.call = call
+
+    def __str__(self):
+        return f'Unable to spool "{self.call}": the spool {self.journal_path} is closed.'
+
+
+class VariableTypeError(Exception):
+    def __init__(self, type_: str, reason: str):
+        self.type = type_
+        self.reason = reason
+
+    def __str__(self):
+        return f'Invalid variable type "{self.type}": {self.reason}.'
+
+
 class BaseContextError(Exception):
     def __init__(self, error_payload: dict = None):
         self._error_payload = error_payload
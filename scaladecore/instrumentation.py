@@ -0,0 +1,200 @@
+"""
+Labeled phases of a function instance execution.
+scaladecore wraps its own work (token read, context retrieval and decode, runtime API calls,
+outputs upload ..) and the user function call in phases, which registered listeners
+(i.e: profilers) are notified about and which are timed into one record per function instance.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import json
+import os
+import threading
+from time import perf_counter
+from typing import Callable, List, Optional
+import warnings
+
+from .memory import get_memory_stats
+
+PHASE_TOKEN_READ = 'token_read'
+PHASE_CONTEXT_INIT = 'context_init'
+PHASE_CONTEXT_RETRIEVAL = 'context_retrieval'
+PHASE_CONTEXT_DECODE = 'context_decode'
+PHASE_USER_FUNCTION = 'user_function'
+PHASE_OUTPUT_UPLOAD = 'output_upload'
+API_CALL_PHASE_PREFIX = 'api:'
+
+# Phases of scaladecore's own work, everything else runs user code.
+SCALADECORE_PHASES = (PHASE_TOKEN_READ, PHASE_CONTEXT_INIT, PHASE_CONTEXT_RETRIEVAL,
+                      PHASE_CONTEXT_DECODE, PHASE_OUTPUT_UPLOAD, )
+
+
+def api_call_phase(name: str) -> str:
+    return API_CALL_PHASE_PREFIX + name
+
+
+def is_scaladecore_phase(name: str) -> bool:
+    return name in SCALADECORE_PHASES or name.startswith(API_CALL_PHASE_PREFIX)
+
+
+class PhaseListener:
+    def phase_started(self, name: str):
+        pass
+
+    def phase_finished(self, name: str, elapsed: float):
+        pass
+
+
+_phase_listeners: List[PhaseListener] = []
+
+
+def add_phase_listener(listener: PhaseListener):
+    _phase_listeners.append(listener)
+
+
+def remove_phase_listener(listener: PhaseListener):
+    _phase_listeners.remove(listener)
+
+
+class TimingsRecord:
+    """
+    Timings of a function instance execution: the elapsed seconds of every phase, the
+    count and elapsed seconds of every runtime API call and the process memory accounting
+    of variable bodies when it finished.
+    """
+
+    def __init__(self, function: str = None):
+        self.function = function
+        self.fi_uuid = None
+        self.started = datetime.utcnow()
+        self.phases = {}
+        self.api_calls = {}
+        self.error = None
+        self.memory = None
+        self._start = perf_counter()
+        self._elapsed = None
+
+    def add(self, name: str, elapsed: float):
+        if name.startswith(API_CALL_PHASE_PREFIX):
+            call = self.api_calls.setdefault(
+                name[len(API_CALL_PHASE_PREFIX):], {'count': 0, 'elapsed': 0.0})
+            call['count'] += 1
+            call['elapsed'] += elapsed
+        else:
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def finish(self, error: BaseException = None):
+        self._elapsed = perf_counter() - self._start
+        self.memory = get_memory_stats()
+        if error is not None:
+            self.error = error.__class__.__name__
+
+    @property
+    def as_dict(self) -> dict:
+        return dict(
+            fi_uuid=self.fi_uuid,
+            function=self.function,
+            started=self.started.isoformat(),
+            elapsed=self._elapsed,
+            status='error' if self.error else 'ok',
+            error=self.error,
+            phases=self.phases,
+            api_calls=self.api_calls,
+            memory=self.memory, )
+
+
+class JsonLinesFileSink:
+    """Appends every timings record as a JSON line to a file."""
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+    def __call__(self, record: dict):
+        line = json.dumps(record) + '\n'
+        with self._lock, open(self.filepath, 'a') as file:
+            file.write(line)
+
+
+_timings_sink: Optional[Callable[[dict], None]] = None
+_current_timings: ContextVar[Optional[TimingsRecord]] = ContextVar(
+    'scaladecore_timings', default=None)
+
+
+def set_timings_sink(sink: Optional[Callable[[dict], None]]):
+    """
+    Sets the callable that receives the timings record (dict) of every function instance,
+    it overrides the SCALADE_TIMINGS_FILE sink. None unsets it.
+    """
+    global _timings_sink
+    _timings_sink = sink
+
+
+def get_timings_sink() -> Optional[Callable[[dict], None]]:
+    if _timings_sink is not None:
+        return _timings_sink
+    filepath = os.getenv('SCALADE_TIMINGS_FILE')
+    if filepath:
+        return _get_file_sink(filepath)
+
+    return None
+
+
+_file_sinks = {}
+
+
+def _get_file_sink(filepath: str) -> JsonLinesFileSink:
+    try:
+        return _file_sinks[filepath]
+    except KeyError:
+        return _file_sinks.setdefault(filepath, JsonLinesFileSink(filepath))
+
+
+@contextmanager
+def record_timings(function: str = None):
+    """
+    Times the phases run within it into a TimingsRecord, which is emitted to the timings
+    sink on exit. It yields None when no sink is configured.
+    """
+    sink = get_timings_sink()
+    if sink is None:
+        yield None
+        return
+
+    record = TimingsRecord(function)
+    token = _current_timings.set(record)
+    error = None
+    try:
+        yield record
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        _current_timings.reset(token)
+        record.finish(error)
+        try:
+            sink(record.as_dict)
+        except Exception as exc:
+            warnings.warn('Timings sink failed: %s: %s' % (exc.__class__.__name__, exc))
+
+
+@contextmanager
+def phase(name: str):
+    """Wraps a labeled phase, it is a no-op when there are no listeners nor timings record."""
+    record = _current_timings.get()
+    if not _phase_listeners and record is None:
+        yield
+        return
+
+    listeners = list(_phase_listeners)
+    for listener in listeners:
+        listener.phase_started(name)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        if record is not None:
+            record.add(name, elapsed)
+        for listener in listeners:
+            listener.phase_finished(name, elapsed)
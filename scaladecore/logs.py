@@ -0,0 +1,169 @@
+"""
+Routing of standard logging records to the runtime as function instance log messages.
+
+Records below the minimum level are dropped on the client, then per-logger sampling and
+token-bucket rate limits are applied before a record is formatted, so verbose libraries
+cannot swamp the runtime API. Accepted records are sent by a background thread through a
+bounded queue, emitting a record never blocks.
+"""
+from collections import Counter
+import logging
+import os
+import queue
+import random
+import threading
+from time import monotonic
+from typing import Dict, Optional
+
+DEFAULT_LOG_LEVEL = 'INFO'
+DEFAULT_RATE = 50.0
+DEFAULT_BURST = 100
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_FLUSH_TIMEOUT = 5.0
+# Name prefix of scaladecore's own threads (log sender, spool sender, output uploads): their
+# records come from runtime calls the handler itself causes and would loop forever.
+INTERNAL_THREAD_PREFIX = 'scalade-'
+
+
+def get_log_level(levelno: int) -> str:
+    """Maps a logging level number to a runtime log level, critical is sent as 'error'."""
+    if levelno < logging.INFO:
+        return 'debug'
+    if levelno < logging.WARNING:
+        return 'info'
+    if levelno < logging.ERROR:
+        return 'warning'
+    return 'error'
+
+
+def parse_sample_rates(sample_rates: str) -> Dict[str, float]:
+    """Parses logger sample rates like 'urllib3=0.1,app.db=0.5'."""
+    rates = {}
+    for item in filter(None, (item.strip() for item in sample_rates.split(','))):
+        name, _, rate = item.partition('=')
+        rates[name.strip()] = float(rate)
+
+    return rates
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = monotonic()
+
+    def consume(self) -> bool:
+        now = monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class ScaladeLogHandler(logging.Handler):
+    """
+    Logging handler that sends records as log messages of a function instance.
+
+    :param context: (ContextManager) the function instance context.
+    :param level: (int|str) the minimum level, default SCALADE_LOG_LEVEL or INFO.
+    :param sample_rates: (dict) fraction of records kept per logger name (and its children),
+        default SCALADE_LOG_SAMPLING i.e: 'urllib3=0.1'.
+    :param rate: (float) records per second allowed per logger, default SCALADE_LOG_RATE or 50.
+    :param burst: (int) token-bucket burst per logger, default SCALADE_LOG_BURST or 100.
+    :param queue_size: (int) records waiting to be sent, beyond it records are dropped.
+    :param flush_timeout: (float) seconds closing the context waits for queued records,
+        default SCALADE_LOG_FLUSH_TIMEOUT or 5.
+    """
+
+    def __init__(self, context, level=None, sample_rates: Dict[str, float] = None,
+                 rate: float = None, burst: int = None, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 flush_timeout: float = None):
+        super().__init__(level or os.getenv('SCALADE_LOG_LEVEL', DEFAULT_LOG_LEVEL).upper())
+        self.context = context
+        self.sample_rates = sample_rates if sample_rates is not None else parse_sample_rates(
+            os.getenv('SCALADE_LOG_SAMPLING', ''))
+        self.rate = rate or float(os.getenv('SCALADE_LOG_RATE', DEFAULT_RATE))
+        self.burst = burst or int(os.getenv('SCALADE_LOG_BURST', DEFAULT_BURST))
+        self.flush_timeout = flush_timeout if flush_timeout is not None else float(
+            os.getenv('SCALADE_LOG_FLUSH_TIMEOUT', DEFAULT_FLUSH_TIMEOUT))
+        self.dropped = Counter()
+        self._buckets = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._sender = threading.Thread(
+            target=self._send_loop, name=INTERNAL_THREAD_PREFIX + 'log-handler', daemon=True)
+        self._sender.start()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (record.threadName or '').startswith(INTERNAL_THREAD_PREFIX):
+            return False
+        if not super().filter(record):
+            return False
+        # Near the deadline only warnings and errors are worth the remaining time.
+        if record.levelno < logging.WARNING and self.context.near_deadline():
+            self.dropped['deadline'] += 1
+            return False
+        with self.lock:
+            sample_rate = self._get_sample_rate(record.name)
+            if sample_rate < 1 and random.random() >= sample_rate:
+                self.dropped['sampled'] += 1
+                return False
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = TokenBucket(self.rate, self.burst)
+            if not bucket.consume():
+                self.dropped['rate_limited'] += 1
+                return False
+
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self._queue.put_nowait((self.format(record), get_log_level(record.levelno)))
+        except queue.Full:
+            self.dropped['queue_full'] += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until queued records are sent, returns False if timeout is reached first."""
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None):
+        if self._sender.is_alive():
+            self.flush(timeout)
+            try:
+                self._queue.put_nowait((None, None))
+                self._sender.join(timeout)
+            except queue.Full:
+                # The sender is stuck on the runtime API, it is a daemon thread.
+                pass
+        super().close()
+
+    def _get_sample_rate(self, name: Optional[str]) -> float:
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition('.')[0]
+        return self.sample_rates.get('', 1.0)
+
+    def _send_loop(self):
+        while True:
+            message, level = self._queue.get()
+            try:
+                if message is None:
+                    return
+                self.context.Log(message, level=level)
+            except Exception:
+                self.dropped['failed'] += 1
+            finally:
+                self._queue.task_done()
@@ -1,23 +1,65 @@
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from functools import partial
+import logging
+import os
+import threading
+from time import monotonic
+from typing import List, Optional, Tuple
 
 
-from .clients import ScaladeRuntimeAPIClient
-from .entities import FunctionInstanceEntity, VariableEntity
+from . import dataplane
+from .clients import ScaladeRuntimeAPIClient, create_runtime_api_client
+from .entities import EntityContract, FunctionInstanceEntity, FunctionInstanceLogMessageEntity, \
+    VariableEntity
 from .exceptions import ContextBlockError, ContextCompleteError, ContextInitError, \
     ContextLogError, ContextOutputError
+from .instrumentation import PHASE_CONTEXT_DECODE, PHASE_CONTEXT_RETRIEVAL, \
+    PHASE_OUTPUT_UPLOAD, phase
+from .logs import INTERNAL_THREAD_PREFIX, ScaladeLogHandler
+from .snapshots import ContextSnapshot, get_context_cache_dir, load_context_snapshot, \
+    save_context_snapshot
+from .spool import Spool, get_spool_dir
+from .transports import Transport
+from .utils import get_fi_deadline, read_token_claims
 from .variables import Variable
 
+# Background uploads of ContextManager.OutputAsync.
+OUTPUT_WORKERS = 4
+OUTPUT_MAX_PENDING = 32
+
+SPOOL_FLUSH_TIMEOUT = 30.0
+DEADLINE_MARGIN = 5.0
+LOG_LEVELS = tuple(level for level, _ in FunctionInstanceLogMessageEntity.LOG_LEVELS)
+SPOOL_CALL_ERRORS = {
+    'create_fi_log_message': ContextLogError,
+    'create_fi_output': ContextOutputError,
+    'update_fi_status': ContextCompleteError,
+}
+
 
 class ContextManager:
     def __init__(self,
                  fi: FunctionInstanceEntity,
                  api_client: ScaladeRuntimeAPIClient,
                  inputs: List[VariableEntity],
-                 outputs: List[VariableEntity] = None):
+                 outputs: List[VariableEntity] = None,
+                 spool: Spool = None,
+                 deadline: float = None):
         self._fi = fi
         self.__client = api_client
+        self._spool = spool
+        self._deadline = deadline
         self._inputs = inputs
         self._outputs = outputs
+        self._outputs_lock = threading.Lock()
+        self._output_executor = None
+        self._pending_outputs = {}
+        self._output_futures = set()
+        self._output_errors = []
+        self._log_handlers = []
+        self._outputs_semaphore = threading.BoundedSemaphore(
+            int(os.getenv('SCALADE_OUTPUT_MAX_PENDING', OUTPUT_MAX_PENDING)))
 
     @property
     def fi(self):
@@ -31,29 +73,79 @@ class ContextManager:
     def outputs(self):
         return self._outputs
 
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the function instance deadline, None if it has no deadline."""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - monotonic())
+
+    def near_deadline(self) -> bool:
+        """Whether the deadline is within SCALADE_DEADLINE_MARGIN seconds (default 5)."""
+        remaining = self.remaining()
+        return remaining is not None and \
+            remaining < float(os.getenv('SCALADE_DEADLINE_MARGIN', DEADLINE_MARGIN))
+
     @classmethod
-    def initialize_from_token(cls, token):
-        api_client = ScaladeRuntimeAPIClient(token)
-        resp, ok = api_client.retrieve_fi_context()
-        data = resp.json()
-        if ok:
-            return cls(
-                fi=create_function_instance(data['function_instance']),
-                api_client=api_client,
-                inputs=create_variables(data['inputs']),
-                outputs=create_variables(data['outputs']),
-            )
-        else:
-            raise ContextInitError(data)
+    def initialize_from_token(cls, token, transport: Transport = None):
+        deadline = get_fi_deadline(token)
+        api_client = create_runtime_api_client(token, transport, deadline)
+        fi, inputs, outputs = retrieve_context(
+            api_client, read_token_claims(token).get('fi_uuid') if token else None)
+
+        return cls(
+            fi=fi,
+            api_client=api_client,
+            inputs=inputs,
+            outputs=outputs,
+            spool=Spool.open(str(fi.uuid), api_client) if get_spool_dir() else None,
+            deadline=deadline,
+        )
+
+    @classmethod
+    def prefetch(cls, token, transport: Transport = None) -> Future:
+        """
+        Initializes the context from a token on a background thread, i.e: while the function
+        module is imported, and returns a future of it.
+        """
+        future = Future()
+
+        def initialize():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(cls.initialize_from_token(token, transport))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        threading.Thread(target=initialize, name='scalade-context-prefetch', daemon=True).start()
+        return future
 
-    def Log(self, message: str):
-        resp, ok = self.__client.create_fi_log_message(
-            body={"log_message": message})
+    def Log(self, message: str, level: str = None):
+        """
+        Creates a log message of the function instance.
+
+        :param message: (str) the log message.
+        :param level: (str) 'debug', 'info', 'warning' or 'error', the runtime default if None.
+        """
+        body = {"log_message": message}
+        if level is not None:
+            if level not in LOG_LEVELS:
+                raise ValueError('Invalid log level "%s": valid ones are %s' % (level, LOG_LEVELS))
+            body["log_level"] = level
+        if self._spool:
+            self._spool.append('create_fi_log_message', body)
+            return
+        resp, ok = self.__client.create_fi_log_message(body=body)
         data = resp.json()
         if not ok:
             raise ContextLogError(data)
 
     def Block(self):
+        if self._spool:
+            self._check_status_method('block', ContextBlockError)
+            self._spool.append('update_fi_status', {"status_method": "block"})
+            self._fi._status = 'blocked'
+            return
         resp, ok = self.__client.update_fi_status(
             body={"status_method": "block"})
         data = resp.json()
@@ -64,24 +156,201 @@ class ContextManager:
             self._fi = create_function_instance(data['function_instance'])
 
     def Complete(self):
-        resp, ok = self.__client.update_fi_status(
-            body={"status_method": "complete"})
-        data = resp.json()
-        if not ok:
-            # todo: raise custom exception
-            raise ContextCompleteError(data)
-        else:
-            self._fi = create_function_instance(data['function_instance'])
+        try:
+            self.WaitOutputs()
+            if self._spool:
+                self._check_status_method('complete', ContextCompleteError)
+                self._spool.append('update_fi_status', {"status_method": "complete"})
+                self._fi._status = 'completed'
+                return
+            resp, ok = self.__client.update_fi_status(
+                body={"status_method": "complete"})
+            data = resp.json()
+            if not ok:
+                # todo: raise custom exception
+                raise ContextCompleteError(data)
+            else:
+                self._fi = create_function_instance(data['function_instance'])
+        finally:
+            self._shutdown_output_executor()
+
+    def _check_status_method(self, status_method: str, error_class: type):
+        # Spooled status updates are applied optimistically, invalid ones are rejected here
+        # as the runtime API would.
+        status = self._fi.get('status')
+        if status not in FunctionInstanceEntity.STATUS_METHODS[status_method]:
+            raise error_class({'status_method': ['Invalid status method for status "%s".'
+                                                 % status]})
 
     def Output(self, variable: Variable):
-        resp, ok = self.__client.create_fi_output(
-            body={"output": variable.dump()})
-        data = resp.json()
-        if not ok:
-            # todo: raise custom exception
-            raise ContextOutputError(data)
-        else:
-            self._outputs = create_variables(data['outputs'])
+        with phase(PHASE_OUTPUT_UPLOAD):
+            with self._outputs_lock:
+                previous = self._pending_outputs.get(variable.id_name)
+            if previous is not None:
+                wait([previous])
+            outputs = self._create_output(variable, {"output": self._dump_output(variable)})
+        self._merge_output(variable.id_name, outputs)
+
+    def OutputAsync(self, variable: Variable) -> Future:
+        """
+        Non-blocking Output: encodes and uploads the variable on a bounded background pool
+        and returns a future of it. Outputs of the same id_name are uploaded in call order,
+        it blocks while SCALADE_OUTPUT_MAX_PENDING outputs are in flight.
+        """
+        self._outputs_semaphore.acquire()
+        try:
+            with self._outputs_lock:
+                if self._output_executor is None:
+                    self._output_executor = ThreadPoolExecutor(
+                        max_workers=int(os.getenv('SCALADE_OUTPUT_WORKERS', OUTPUT_WORKERS)),
+                        thread_name_prefix=INTERNAL_THREAD_PREFIX + 'output')
+                previous = self._pending_outputs.get(variable.id_name)
+                # Phases of the upload are timed into the caller's timings record.
+                future = self._output_executor.submit(
+                    copy_context().run, self._output_async, variable, previous)
+                self._pending_outputs[variable.id_name] = future
+                self._output_futures.add(future)
+        except BaseException:
+            self._outputs_semaphore.release()
+            raise
+        future.add_done_callback(partial(self._output_done, variable.id_name))
+
+        return future
+
+    def WaitOutputs(self):
+        """Waits for all pending outputs and raises the first error of the failed ones."""
+        with self._outputs_lock:
+            futures = list(self._output_futures)
+        wait(futures)
+        with self._outputs_lock:
+            errors, self._output_errors = self._output_errors, []
+        if errors:
+            raise errors[0]
+
+    def _output_async(self, variable: Variable, previous: Future = None):
+        with phase(PHASE_OUTPUT_UPLOAD):
+            body = {"output": self._dump_output(variable)}
+            if previous is not None:
+                wait([previous])
+            outputs = self._create_output(variable, body)
+        self._merge_output(variable.id_name, outputs)
+
+    def _merge_output(self, id_name: str, outputs: List[VariableEntity]):
+        # Responses may complete out of order (with OutputAsync ones in flight): only the
+        # uploaded output is taken from them. A response without it is taken as a whole.
+        output = next((opt for opt in outputs if opt.get('id_name') == id_name), None)
+        with self._outputs_lock:
+            if output is None:
+                self._outputs = outputs
+                return
+            self._outputs = [opt for opt in self._outputs or []
+                             if opt.get('id_name') != id_name] + [output]
+
+    def Flush(self, timeout: float = None) -> bool:
+        """
+        Waits for pending outputs and for the spool to be drained, returns False if timeout
+        (by default, the remaining time until the deadline) is reached first. Raises the error
+        of the first call the runtime API rejected, once: it is then discarded.
+        """
+        self.WaitOutputs()
+        if not self._spool:
+            return True
+        flushed = self._spool.flush(self.remaining() if timeout is None else timeout)
+        rejected = self._spool.pop_rejected()
+        if rejected:
+            entry, data = rejected
+            if entry['body'].get('status_method') == 'block':
+                raise ContextBlockError(data)
+            raise SPOOL_CALL_ERRORS[entry['call']](data)
+        return flushed
+
+    def CaptureLogging(self, logger: logging.Logger = None, **options) -> ScaladeLogHandler:
+        """
+        Routes the records of a logger (the root one by default) to the function instance
+        log messages, until the context is closed. Options are the ScaladeLogHandler ones.
+        """
+        handler = ScaladeLogHandler(self, **options)
+        logger = logger or logging.getLogger()
+        logger.addHandler(handler)
+        self._log_handlers.append((logger, handler))
+
+        return handler
+
+    def Close(self):
+        """
+        Releases the context, flushing by priority within the deadline: pending outputs and
+        the spool within SCALADE_SPOOL_FLUSH_TIMEOUT seconds, captured log records within the
+        handler flush timeout (dropped when near the deadline) in between. Unsent calls stay
+        spooled for a later replay.
+        """
+        with self._outputs_lock:
+            futures = list(self._output_futures)
+        wait(futures, timeout=self._get_flush_timeout())
+        self._shutdown_output_executor()
+        for logger, handler in self._log_handlers:
+            logger.removeHandler(handler)
+            handler.close(0 if self.near_deadline() else
+                          self._get_flush_timeout(handler.flush_timeout))
+        self._log_handlers = []
+        if self._spool:
+            self._spool.flush(self._get_flush_timeout())
+            self._spool.close(self._get_flush_timeout())
+
+    def _get_flush_timeout(self, timeout: float = None) -> float:
+        if timeout is None:
+            timeout = float(os.getenv('SCALADE_SPOOL_FLUSH_TIMEOUT', SPOOL_FLUSH_TIMEOUT))
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def _create_output(self, variable: Variable, body: dict) -> List[VariableEntity]:
+        """Sends an output and returns the outputs after it."""
+        if not self._spool:
+            resp, ok = self.__client.create_fi_output(body=body)
+            data = resp.json()
+            if not ok:
+                # todo: raise custom exception
+                raise ContextOutputError(data)
+            return create_variables(data['outputs'])
+
+        self._spool.append('create_fi_output', body)
+        with self._outputs_lock:
+            outputs = list(self._outputs or [])
+        ranks = [opt.get('rank') for opt in outputs if opt.get('id_name') == variable.id_name]
+        output = VariableEntity(
+            iot='output',
+            id_name=variable.id_name,
+            type_=variable.type,
+            charset=variable.charset,
+            bytes_=variable.bytes,
+            fi_uuid=str(self._fi.uuid),
+            rank=ranks[0] if ranks else len(outputs), )
+
+        return [opt for opt in outputs if opt.get('id_name') != variable.id_name] + [output]
+
+    def _output_done(self, id_name: str, future: Future):
+        with self._outputs_lock:
+            self._output_futures.discard(future)
+            if self._pending_outputs.get(id_name) is future:
+                del self._pending_outputs[id_name]
+            if future.exception() is not None:
+                self._output_errors.append(future.exception())
+        self._outputs_semaphore.release()
+
+    def _shutdown_output_executor(self):
+        with self._outputs_lock:
+            executor, self._output_executor = self._output_executor, None
+            self._pending_outputs = {}
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _dump_output(variable: Variable) -> str:
+        if dataplane.should_publish(variable.estimate_size()):
+            # Only the data plane reference travels through the runtime API.
+            variable = Variable.create(variable.type, variable.id_name,
+                                       bytes_=dataplane.publish(variable.buffer()),
+                                       charset=variable.charset)
+        return variable.dump()
 
     def GetInput(self, id_name: str) -> Variable:
         for ipt in self._inputs:
@@ -100,13 +369,38 @@ class ContextManager:
         raise Exception()
 
 
+def retrieve_context(api_client: ScaladeRuntimeAPIClient, fi_uuid: str = None) -> \
+        Tuple[FunctionInstanceEntity, List[VariableEntity], List[VariableEntity]]:
+    """
+    Retrieves and decodes the context of a function instance: (fi, inputs, outputs).
+    With SCALADE_CONTEXT_CACHE_DIR set, it is fetched conditionally on the ETag of the
+    fi_uuid snapshot, which is loaded instead on a 304 response.
+    """
+    use_snapshots = bool(fi_uuid and get_context_cache_dir())
+    with phase(PHASE_CONTEXT_DECODE):
+        snapshot = load_context_snapshot(fi_uuid) if use_snapshots else None
+    with phase(PHASE_CONTEXT_RETRIEVAL):
+        resp, ok = api_client.retrieve_fi_context(etag=snapshot.etag if snapshot else None)
+    with phase(PHASE_CONTEXT_DECODE):
+        if snapshot and resp.status_code == 304:
+            return snapshot.fi, snapshot.inputs, snapshot.outputs
+        data = resp.json()
+        if not ok:
+            raise ContextInitError(data)
+        fi = create_function_instance(data['function_instance'])
+        inputs = create_variables(data['inputs'])
+        outputs = create_variables(data['outputs'])
+        etag = resp.headers.get('ETag')
+        if use_snapshots and etag:
+            save_context_snapshot(fi_uuid, ContextSnapshot(etag, fi, inputs, outputs))
+
+    return fi, inputs, outputs
+
+
 def create_function_instance(function_instance_data: dict) -> FunctionInstanceEntity:
     return FunctionInstanceEntity.create_from_dict(
         function_instance_data)
 
 
-def create_variables(variables_data: dict) -> List[VariableEntity]:
-    return [
-        VariableEntity.create_from_dict(var_)
-        for var_ in variables_data
-    ]
+def create_variables(variables_data: List[dict]) -> List[VariableEntity]:
+    return EntityContract.create_entities_from_dicts('Variable', variables_data)
@@ -0,0 +1,159 @@
+"""
+Per-process memory budget of variable bodies.
+
+Variable bodies (and the ones of variable entities, once when decoded: their variables get
+views of them) are admitted into the budget when they are set: bodies from
+SCALADE_SPILL_THRESHOLD bytes, or the ones that would take the resident bodies beyond
+SCALADE_MEMORY_BUDGET bytes, are spilled to an unlinked temporary file (in SCALADE_SPILL_DIR,
+default the system temporary directory) and read through a read-only memory mapping of it,
+so the page cache rather than the process heap holds them. Both are disabled when unset.
+
+Spilled bodies share segment files of SPILL_SEGMENT_SIZE bytes (larger bodies get a segment
+of their own), so open file descriptors grow with the segments rather than with the bodies.
+Segments are bump allocated: their disk space is freed once all their bodies are released.
+
+Admitted bodies are released when their owner is garbage collected or updated,
+get_memory_stats returns the accounting, i.e: to size worker pods.
+"""
+import mmap
+import os
+import threading
+from tempfile import TemporaryFile
+from typing import Optional, Tuple, Union
+import weakref
+
+SPILL_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class _SpillSegment:
+    """A memory mapped, unlinked, spill file that bodies are appended to."""
+
+    def __init__(self, size: int, spill_dir: str = None):
+        with TemporaryFile(prefix='scalade-spill-', dir=spill_dir) as file:
+            file.truncate(size)
+            # The mapping keeps the unlinked file alive (on its own descriptor), it can be closed.
+            self._mmap = mmap.mmap(file.fileno(), size)
+        self.size = size
+        self.offset = 0
+        self.live = 0
+
+    def append(self, body: bytes) -> memoryview:
+        start, self.offset = self.offset, self.offset + len(body)
+        self._mmap[start:self.offset] = body
+        self.live += 1
+        return memoryview(self._mmap)[start:self.offset].toreadonly()
+
+
+class MemoryBudget:
+    """
+    :param budget: (int) bytes of resident variable bodies, beyond them bodies are spilled.
+    :param spill_threshold: (int) bodies from these bytes are always spilled.
+    :param spill_dir: (str) directory of the spill files.
+    :param segment_size: (int) bytes of every spill file, default SPILL_SEGMENT_SIZE.
+    """
+
+    def __init__(self, budget: int = None, spill_threshold: int = None, spill_dir: str = None,
+                 segment_size: int = SPILL_SEGMENT_SIZE):
+        self.budget = budget
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.segment_size = segment_size
+        self._segment: Optional[_SpillSegment] = None
+        self._segments = 0
+        self._lock = threading.Lock()
+        self._resident = 0
+        self._peak_resident = 0
+        self._spilled = 0
+        self._spills = 0
+
+    @classmethod
+    def from_environ(cls) -> 'MemoryBudget':
+        """Factory function of the budget configured by the SCALADE_MEMORY_BUDGET environ."""
+        return cls(budget=int(os.getenv('SCALADE_MEMORY_BUDGET', 0)) or None,
+                   spill_threshold=int(os.getenv('SCALADE_SPILL_THRESHOLD', 0)) or None,
+                   spill_dir=os.getenv('SCALADE_SPILL_DIR') or None)
+
+    def admit(self, owner: object, body: Union[bytes, memoryview]) -> \
+            Tuple[Union[bytes, memoryview], Optional[weakref.finalize]]:
+        """
+        Admits the body of owner (i.e: a Variable) and returns it as it is to be held, as is or
+        spilled, and the finalizer releasing it: called explicitly or when owner is collected.
+        """
+        if not body or isinstance(body, memoryview):
+            # Mapped bodies (i.e: from the data plane) are not resident.
+            return body, None
+        size = len(body)
+        with self._lock:
+            spill = (self.spill_threshold is not None and size >= self.spill_threshold) or \
+                (self.budget is not None and self._resident + size > self.budget)
+            if not spill:
+                self._resident += size
+                self._peak_resident = max(self._peak_resident, self._resident)
+        segment = None
+        if spill:
+            with self._lock:
+                segment = self._get_segment(size)
+                body = segment.append(body)
+                self._spilled += size
+                self._spills += 1
+
+        return body, weakref.finalize(owner, self._release, size, segment)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                budget=self.budget,
+                spill_threshold=self.spill_threshold,
+                resident=self._resident,
+                peak_resident=self._peak_resident,
+                spilled=self._spilled,
+                spills=self._spills,
+                spill_segments=self._segments, )
+
+    def _get_segment(self, size: int) -> _SpillSegment:
+        segment = self._segment
+        if segment is not None and segment.offset + size <= segment.size:
+            return segment
+        self._segments += 1
+        if size >= self.segment_size:
+            return _SpillSegment(size, self.spill_dir)
+        if segment is not None and not segment.live:
+            self._segments -= 1
+        self._segment = _SpillSegment(self.segment_size, self.spill_dir)
+        return self._segment
+
+    def _release(self, size: int, segment: Optional[_SpillSegment]):
+        with self._lock:
+            if segment is None:
+                self._resident -= size
+                return
+            self._spilled -= size
+            segment.live -= 1
+            # Full segments are unmapped (closing their file) once their views are collected.
+            if not segment.live and segment is not self._segment:
+                self._segments -= 1
+
+
+_memory_budget: Optional[MemoryBudget] = None
+_memory_budget_lock = threading.Lock()
+
+
+def get_memory_budget() -> MemoryBudget:
+    global _memory_budget
+
+    if _memory_budget is None:
+        with _memory_budget_lock:
+            if _memory_budget is None:
+                _memory_budget = MemoryBudget.from_environ()
+    return _memory_budget
+
+
+def set_memory_budget(budget: Optional[MemoryBudget]):
+    """Replaces the process memory budget, None reloads it from the environ on next use."""
+    global _memory_budget
+
+    _memory_budget = budget
+
+
+def get_memory_stats() -> dict:
+    return get_memory_budget().stats()
@@ -0,0 +1,251 @@
+"""
+Profilers for 'scalade run --profile'.
+Every profiler writes a profile file and builds a short summary of the top functions (or
+allocations), where scaladecore's own code and phases are labeled separately from user code.
+"""
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import List, Optional
+
+from .instrumentation import PhaseListener, add_phase_listener, is_scaladecore_phase, \
+    remove_phase_listener
+
+SCALADECORE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_ENTRIES = 10
+
+
+class BaseProfiler(PhaseListener, ABC):
+    MODE = None
+    FILE_EXTENSION = None
+
+    def __init__(self, output_file: str = None, user_paths: List[str] = None,
+                 interval: float = 0.005):
+        self.output_file = output_file or 'scalade-%s.%s' % (self.MODE, self.FILE_EXTENSION)
+        self.user_paths = [os.path.abspath(path) for path in user_paths or []]
+        self.interval = interval
+        self.phases = defaultdict(float)
+        self.started = False
+
+    def phase_finished(self, name: str, elapsed: float):
+        self.phases[name] += elapsed
+
+    def start(self):
+        add_phase_listener(self)
+        try:
+            self._start()
+        except BaseException:
+            remove_phase_listener(self)
+            raise
+        self.started = True
+
+    def stop(self):
+        self._stop()
+        remove_phase_listener(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @abstractmethod
+    def _start(self):
+        pass
+
+    @abstractmethod
+    def _stop(self):
+        pass
+
+    def write(self) -> Optional[str]:
+        """Writes the profile file and returns its path, None if the profiler never started."""
+        if not self.started:
+            return None
+        return self._write()
+
+    @abstractmethod
+    def _write(self):
+        pass
+
+    @abstractmethod
+    def top_entries(self) -> List[str]:
+        pass
+
+    def label(self, filename: str) -> str:
+        """Labels a code filename as 'scaladecore', 'user' or 'library' code."""
+        if not filename or filename.startswith('<'):
+            return 'library'
+        filename = os.path.abspath(filename)
+        if _is_within(filename, SCALADECORE_DIR):
+            return 'scaladecore'
+        if any(_is_within(filename, path) for path in self.user_paths):
+            return 'user'
+        return 'library'
+
+    def summary(self) -> str:
+        if not self.started:
+            return 'Profile (%s) not started' % self.MODE
+        lines = ['Profile (%s) written to %s' % (self.MODE, self.output_file), 'Phases:']
+        for name, elapsed in self.phases.items():
+            owner = 'scaladecore' if is_scaladecore_phase(name) else 'user'
+            lines.append('  [%-11s] %-28s %10.4fs' % (owner, name, elapsed))
+        lines.append('Top %d:' % TOP_ENTRIES)
+        lines.extend('  ' + entry for entry in self.top_entries())
+
+        return '\n'.join(lines)
+
+
+class CProfileProfiler(BaseProfiler):
+    """Deterministic profiler, writes a pstats file."""
+    MODE = 'cprofile'
+    FILE_EXTENSION = 'prof'
+
+    def _start(self):
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def _stop(self):
+        self._profile.disable()
+
+    def _write(self):
+        self._profile.dump_stats(self.output_file)
+        return self.output_file
+
+    def top_entries(self) -> List[str]:
+        stats = pstats.Stats(self._profile).stats
+        top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_ENTRIES]
+        return ['[%-11s] %10.4fs self %10.4fs cumulative %8d calls  %s:%d(%s)' % (
+            self.label(filename), tottime, cumtime, ncalls, filename, lineno, func_name)
+            for (filename, lineno, func_name), (_, ncalls, tottime, cumtime, _) in top]
+
+
+class SamplingProfiler(BaseProfiler):
+    """
+    Statistical profiler: samples the profiled thread stack every interval seconds from a
+    background thread and writes collapsed stacks, the input format of flame graph tools.
+    """
+    MODE = 'sample'
+    FILE_EXTENSION = 'collapsed'
+
+    def _start(self):
+        self._stacks = Counter()
+        self._self_samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop_event = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _stop(self):
+        self._stop_event.set()
+        self._sampler.join()
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self._self_samples[stack[0][0], stack[0][2]] += 1
+                self._stacks[';'.join(
+                    '%s (%s)' % (name, os.path.basename(filename))
+                    for filename, _, name in reversed(stack))] += 1
+
+    def _write(self):
+        with open(self.output_file, 'w') as file:
+            for stack, count in self._stacks.items():
+                file.write('%s %d\n' % (stack, count))
+        return self.output_file
+
+    def top_entries(self) -> List[str]:
+        total = sum(self._self_samples.values()) or 1
+        return ['[%-11s] %6.1f%% %8d samples  %s(%s)' % (
+            self.label(filename), count * 100 / total, count, filename, name)
+            for (filename, name), count in self._self_samples.most_common(TOP_ENTRIES)]
+
+
+class TracemallocProfiler(BaseProfiler):
+    """Memory profiler, writes a tracemalloc snapshot and reports peak allocations per phase."""
+    MODE = 'tracemalloc'
+    FILE_EXTENSION = 'snapshot'
+    TRACEBACK_LIMIT = 10
+
+    def _start(self):
+        self.phase_peaks = {}
+        self._open_phases = []
+        self._peak = 0
+        # Tracing started by someone else (i.e: python -X tracemalloc) is left running.
+        self._owns_tracing = not tracemalloc.is_tracing()
+        if self._owns_tracing:
+            tracemalloc.start(self.TRACEBACK_LIMIT)
+
+    def _stop(self):
+        self._snapshot = tracemalloc.take_snapshot()
+        self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+        if self._owns_tracing:
+            tracemalloc.stop()
+
+    def _update_peaks(self):
+        _, peak = tracemalloc.get_traced_memory()
+        self._peak = max(self._peak, peak)
+        for name in self._open_phases:
+            self.phase_peaks[name] = max(peak, self.phase_peaks.get(name, 0))
+
+    def phase_started(self, name: str):
+        # Peaks per phase need tracemalloc.reset_peak (Python 3.9+).
+        if hasattr(tracemalloc, 'reset_peak'):
+            self._update_peaks()
+            tracemalloc.reset_peak()
+            self._open_phases.append(name)
+
+    def phase_finished(self, name: str, elapsed: float):
+        super().phase_finished(name, elapsed)
+        if hasattr(tracemalloc, 'reset_peak'):
+            self._update_peaks()
+            self._open_phases.remove(name)
+
+    def _write(self):
+        self._snapshot.dump(self.output_file)
+        return self.output_file
+
+    def top_entries(self) -> List[str]:
+        stats = self._snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')
+        return ['[%-11s] %10.1f KiB %8d blocks  %s:%d' % (
+            self.label(stat.traceback[0].filename), stat.size / 1024, stat.count,
+            stat.traceback[0].filename, stat.traceback[0].lineno)
+            for stat in stats[:TOP_ENTRIES]]
+
+    def summary(self) -> str:
+        if not self.started:
+            return super().summary()
+        lines = [super().summary(), 'Peak traced memory: %.1f KiB' % (self._peak / 1024)]
+        lines.extend('  [%-11s] %-28s peak %10.1f KiB' % (
+            'scaladecore' if is_scaladecore_phase(name) else 'user', name, peak / 1024)
+            for name, peak in self.phase_peaks.items())
+
+        return '\n'.join(lines)
+
+
+def _is_within(filename: str, dirname: str) -> bool:
+    return filename == dirname or filename.startswith(dirname.rstrip(os.sep) + os.sep)
+
+
+PROFILERS = {profiler.MODE: profiler
+             for profiler in (CProfileProfiler, SamplingProfiler, TracemallocProfiler)}
+
+
+def create_profiler(mode: str, *args, **kwargs) -> BaseProfiler:
+    try:
+        return PROFILERS[mode](*args, **kwargs)
+    except KeyError:
+        raise ValueError('Invalid profile mode "%s": valid ones are %s'
+                         % (mode, tuple(PROFILERS)))
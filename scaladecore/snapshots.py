@@ -0,0 +1,69 @@
+"""
+On-disk snapshots of the last retrieved context of every function instance.
+
+With SCALADE_CONTEXT_CACHE_DIR set, the decoded context is kept per FI UUID together with the
+ETag of the retrieve-fi-context/ response. Re-fetches send it as If-None-Match and load the
+snapshot on a 304 Not Modified, so restarted or retried instances don't download their inputs
+again. Snapshots are JSON documents of the entities dicts, as the runtime API sends them.
+"""
+import json
+import os
+import threading
+from typing import List, NamedTuple, Optional
+
+from .entities import EntityContract, FunctionInstanceEntity, VariableEntity
+
+SNAPSHOT_VERSION = 1
+
+
+class ContextSnapshot(NamedTuple):
+    etag: str
+    fi: FunctionInstanceEntity
+    inputs: List[VariableEntity]
+    outputs: List[VariableEntity]
+
+    def as_dict(self) -> dict:
+        return dict(
+            version=SNAPSHOT_VERSION,
+            etag=self.etag,
+            function_instance=self.fi.as_dict,
+            inputs=[ipt.as_dict for ipt in self.inputs],
+            outputs=[opt.as_dict for opt in self.outputs], )
+
+    @classmethod
+    def create_from_dict(cls, obj_d: dict) -> 'ContextSnapshot':
+        return cls(
+            etag=obj_d['etag'],
+            fi=FunctionInstanceEntity.create_from_dict(obj_d['function_instance']),
+            inputs=EntityContract.create_entities_from_dicts('Variable', obj_d['inputs']),
+            outputs=EntityContract.create_entities_from_dicts('Variable', obj_d['outputs']), )
+
+
+def get_context_cache_dir() -> Optional[str]:
+    return os.getenv('SCALADE_CONTEXT_CACHE_DIR') or None
+
+
+def _get_snapshot_path(fi_uuid: str) -> str:
+    return os.path.join(get_context_cache_dir(), '%s.snapshot' % fi_uuid)
+
+
+def load_context_snapshot(fi_uuid: str) -> Optional[ContextSnapshot]:
+    """Loads the context snapshot of a function instance, None if there is none or it is unreadable."""
+    try:
+        with open(_get_snapshot_path(fi_uuid), 'rb') as file:
+            obj_d = json.load(file)
+        if obj_d.get('version') != SNAPSHOT_VERSION:
+            return None
+        return ContextSnapshot.create_from_dict(obj_d)
+    except Exception:
+        # Missing, torn or of another snapshot version: the context is just re-fetched.
+        return None
+
+
+def save_context_snapshot(fi_uuid: str, snapshot: ContextSnapshot):
+    os.makedirs(get_context_cache_dir(), exist_ok=True)
+    path = _get_snapshot_path(fi_uuid)
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w') as file:
+        json.dump(snapshot.as_dict(), file)
+    os.replace(tmp_path, path)
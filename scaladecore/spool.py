@@ -0,0 +1,208 @@
+"""
+Durable local spool of outbound runtime calls (log messages, outputs and status updates).
+
+Calls are appended to a per function instance journal (JSON lines) and acknowledged right
+away, a background sender drains the journal in order, retrying transient failures
+(connection errors and 5xx responses) with exponential backoff: delivery is at least once.
+The number of sent entries is kept in an ack file next to the journal, so a spool reopened
+for the same function instance (i.e: after a restart) replays the unsent entries first.
+Every spooled call is bounded by SCALADE_SPOOL_CALL_TIMEOUT seconds, so a hung runtime API
+call is retried rather than holding the sender.
+
+It is enabled by SCALADE_SPOOL_DIR.
+"""
+from collections import deque
+from copy import copy
+from http.client import HTTPException
+import json
+import os
+import threading
+from time import monotonic
+from typing import List, Optional, Tuple
+
+from requests.exceptions import RequestException
+
+from .clients import ScaladeRuntimeAPIClient
+from .exceptions import DeadlineExceededError, SpoolClosedError
+from .logs import INTERNAL_THREAD_PREFIX
+
+RETRY_MIN_DELAY = 0.1
+RETRY_MAX_DELAY = 5.0
+CALL_TIMEOUT = 10.0
+
+
+def get_spool_dir() -> Optional[str]:
+    return os.getenv('SCALADE_SPOOL_DIR') or None
+
+
+class Spool:
+    def __init__(self, journal_path: str, api_client: ScaladeRuntimeAPIClient,
+                 fsync: bool = False, call_timeout: float = None):
+        self.journal_path = journal_path
+        self.ack_path = journal_path + '.ack'
+        self._client = copy(api_client)
+        if call_timeout:
+            self._client.timeout = min(api_client.timeout or call_timeout, call_timeout)
+        self._fsync = fsync
+        self._cond = threading.Condition()
+        self._closed = False
+        self._abandoned = False
+        self._rejected = []
+        self._acked = self._read_ack()
+        self._pending = deque(self._read_unsent())
+        self._journal = open(self.journal_path, 'a')
+        self._sender = threading.Thread(
+            target=self._send_loop, name=INTERNAL_THREAD_PREFIX + 'spool', daemon=True)
+        self._sender.start()
+
+    @classmethod
+    def open(cls, fi_uuid: str, api_client: ScaladeRuntimeAPIClient) -> 'Spool':
+        """Factory function of the spool of a function instance in SCALADE_SPOOL_DIR."""
+        spool_dir = get_spool_dir()
+        os.makedirs(spool_dir, exist_ok=True)
+        return cls(os.path.join(spool_dir, '%s.jsonl' % fi_uuid), api_client,
+                   fsync=os.getenv('SCALADE_SPOOL_FSYNC', 'False') == 'True',
+                   call_timeout=float(os.getenv('SCALADE_SPOOL_CALL_TIMEOUT', CALL_TIMEOUT)))
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def rejected(self) -> List[Tuple[dict, dict]]:
+        """(entry, response data) of the entries the runtime API rejected."""
+        with self._cond:
+            return list(self._rejected)
+
+    def pop_rejected(self) -> Optional[Tuple[dict, dict]]:
+        """Removes and returns the first rejected (entry, response data), None if there is none."""
+        with self._cond:
+            return self._rejected.pop(0) if self._rejected else None
+
+    def append(self, call: str, body: dict):
+        """Appends a runtime call to the journal, it is sent in the background."""
+        entry = dict(call=call, body=body)
+        line = json.dumps(entry) + '\n'
+        with self._cond:
+            if self._closed:
+                raise SpoolClosedError(self.journal_path, call)
+            self._journal.write(line)
+            self._journal.flush()
+            if self._fsync:
+                os.fsync(self._journal.fileno())
+            self._pending.append(entry)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until the journal is drained, returns False if timeout is reached first."""
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None):
+        """
+        Stops the sender, unsent entries stay in the journal for a later replay. It waits up
+        to timeout for a call in flight, which is otherwise abandoned: resent on replay.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._sender.join(timeout)
+        with self._cond:
+            self._abandoned = self._sender.is_alive()
+            self._journal.close()
+            if not self._pending:
+                self._remove_files()
+
+    def _send_loop(self):
+        delay = RETRY_MIN_DELAY
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                entry = self._pending[0]
+
+            sent, data = self._send(entry)
+            if not sent:
+                with self._cond:
+                    self._cond.wait(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+                continue
+            delay = RETRY_MIN_DELAY
+            with self._cond:
+                if self._abandoned:
+                    return
+                if data is not None:
+                    self._rejected.append((entry, data))
+                self._pending.popleft()
+                self._acked += 1
+                self._write_ack()
+                self._cond.notify_all()
+
+    def _send(self, entry: dict) -> Tuple[bool, Optional[dict]]:
+        """Returns whether the entry was sent and the response data if it was rejected."""
+        try:
+            resp, ok = getattr(self._client, entry['call'])(body=entry['body'])
+        except (RequestException, HTTPException, OSError, DeadlineExceededError):
+            return False, None
+        if ok:
+            return True, None
+        if resp.status_code >= 500:
+            return False, None
+        try:
+            return True, resp.json()
+        except ValueError:
+            return True, {'detail': resp.text}
+
+    def _read_ack(self) -> int:
+        try:
+            with open(self.ack_path, 'r') as file:
+                return int(file.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_ack(self):
+        tmp_path = self.ack_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(str(self._acked))
+        os.replace(tmp_path, self.ack_path)
+
+    def _read_unsent(self) -> List[dict]:
+        """Reads the unsent entries and compacts the journal down to them."""
+        entries = []
+        try:
+            with open(self.journal_path, 'r') as file:
+                for i, line in enumerate(file):
+                    if i < self._acked:
+                        continue
+                    if not line.endswith('\n'):
+                        # A torn last line of a crashed append was never acknowledged.
+                        break
+                    entries.append(json.loads(line))
+        except FileNotFoundError:
+            return entries
+
+        # Resetting the ack first: a crash in between resends entries rather than losing them.
+        self._acked = 0
+        self._write_ack()
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(tmp_path, self.journal_path)
+
+        return entries
+
+    def _remove_files(self):
+        for path in (self.journal_path, self.ack_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,93 @@
+"""
+Streaming outputs of generator and async generator scalade functions.
+
+Every yielded Variable is uploaded in the background (ContextManager.OutputAsync) while the
+function keeps running. File outputs can be yielded in chunks (OutputChunk): the runtime API
+takes whole outputs only, so chunks are accumulated into a spooled temporary file (in memory
+up to SCALADE_STREAM_SPOOL_SIZE bytes, on disk beyond it) and the file output is uploaded on
+its last chunk or at the end of the stream. The stream ends with an implicit Complete.
+"""
+import asyncio
+import inspect
+import os
+from tempfile import SpooledTemporaryFile
+from typing import Any, AsyncIterator, Dict, Iterator, NamedTuple, Union
+
+from .variables import Variable
+
+DEFAULT_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class OutputChunk(NamedTuple):
+    """A chunk of the file output id_name, last=True uploads it without waiting for the end."""
+    id_name: str
+    data: bytes
+    last: bool = False
+
+
+def is_output_stream(result: Any) -> bool:
+    return inspect.isgenerator(result) or inspect.isasyncgen(result)
+
+
+class OutputStream:
+    def __init__(self, context):
+        self.context = context
+        self._chunked: Dict[str, SpooledTemporaryFile] = {}
+
+    def handle(self, item: Union[Variable, OutputChunk]):
+        if isinstance(item, Variable):
+            self.context.OutputAsync(item)
+        elif isinstance(item, OutputChunk):
+            file = self._chunked.get(item.id_name)
+            if file is None:
+                file = self._chunked[item.id_name] = SpooledTemporaryFile(
+                    max_size=int(os.getenv('SCALADE_STREAM_SPOOL_SIZE', DEFAULT_SPOOL_SIZE)))
+            file.write(item.data)
+            if item.last:
+                self._output_chunked(item.id_name)
+        else:
+            raise TypeError(f'Invalid yielded output: {item!r}, expected a Variable '
+                            f'or an OutputChunk')
+
+    def finish(self):
+        """Uploads the unfinished chunked outputs and completes the function instance."""
+        for id_name in list(self._chunked):
+            self._output_chunked(id_name)
+        if self.context.fi.get('status') != 'completed':
+            self.context.Complete()
+        else:
+            self.context.WaitOutputs()
+
+    def discard(self):
+        for file in self._chunked.values():
+            file.close()
+        self._chunked.clear()
+
+    def _output_chunked(self, id_name: str):
+        file = self._chunked.pop(id_name)
+        try:
+            # FileVariable encodes the file contents synchronously, the upload is async.
+            self.context.OutputAsync(Variable.create('file', id_name, value=file))
+        finally:
+            file.close()
+
+
+def stream_outputs(context, stream: Union[Iterator, AsyncIterator]):
+    """Drives the generator (or async generator) of a scalade function to the end."""
+    output_stream = OutputStream(context)
+    try:
+        if inspect.isasyncgen(stream):
+            asyncio.run(_consume_async(output_stream, stream))
+        else:
+            for item in stream:
+                output_stream.handle(item)
+        output_stream.finish()
+    finally:
+        if inspect.isgenerator(stream):
+            stream.close()
+        output_stream.discard()
+
+
+async def _consume_async(output_stream: OutputStream, stream: AsyncIterator):
+    async for item in stream:
+        output_stream.handle(item)
@@ -0,0 +1,275 @@
+"""
+Local stand-in of the Scalade runtime API namespace, for tests, benchmarks and load tests.
+"""
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import pickle
+from socketserver import ThreadingUnixStreamServer
+import threading
+from typing import List, Tuple
+from uuid import UUID, uuid4
+
+import jwt
+from requests.structures import CaseInsensitiveDict
+
+from .config import PositionConfig
+from .entities import AccountEntity, FunctionInstanceEntity, FunctionInstanceLogMessageEntity, \
+    FunctionTypeEntity, StreamEntity, VariableEntity
+from .transports import call_handler
+from .utils import decode_b64str
+from .variables import Variable
+
+
+class FakeRuntime:
+    """
+    In-memory runtime API: keeps the function instances state and handles runtime calls.
+    Function instances are identified by the 'fi_uuid' claim of the request token, whose
+    signature is not verified.
+    """
+
+    def __init__(self, auto_register: bool = False):
+        self.auto_register = auto_register
+        self._lock = threading.RLock()
+        self._instances = {}
+        self._routes = {
+            ('GET', 'retrieve-fi-context/'): self._retrieve_fi_context,
+            ('POST', 'create-fi-log-message/'): self._create_fi_log_message,
+            ('PATCH', 'update-fi-status/'): self._update_fi_status,
+            ('POST', 'create-fi-output/'): self._create_fi_output,
+        }
+        self._account = AccountEntity(
+            auth_id='fake/runtime', username='runtime', email='runtime@scalade.io',
+            date_joined=_now())
+
+    def register_function_instance(self, fi_uuid: str = None, inputs: List[Variable] = None,
+                                   status: str = 'running') -> str:
+        fi_uuid = fi_uuid or str(uuid4())
+        fi = FunctionInstanceEntity(
+            uuid=UUID(fi_uuid),
+            function_type=FunctionTypeEntity(
+                key='fake/function', verbose_name='Fake Function',
+                description='Fake function type', updated=_now(), account=self._account),
+            stream=StreamEntity(
+                name='FakeStream', updated=_now(), status='pushed', account=self._account),
+            position=PositionConfig(row=0, col=0),
+            updated=_now(),
+            initialized=_now(),
+            status=status, )
+        with self._lock:
+            self._instances[fi_uuid] = dict(
+                fi=fi,
+                inputs=[self._new_variable_entity(fi_uuid, 'input', var, rank)
+                        for rank, var in enumerate(inputs or [])],
+                outputs=[],
+                log_messages=[],
+                version=0, )
+
+        return fi_uuid
+
+    def get_function_instance(self, fi_uuid: str) -> dict:
+        return self._instances[fi_uuid]
+
+    def handle(self, method: str, endpoint: str, authorization: str, body: dict = None,
+               headers: dict = None) -> tuple:
+        """
+        Handles a runtime API call and returns its (status code, response data), and the
+        response headers too if the request headers are given: (status code, data, headers).
+
+        :param method: (str) the HTTP method i.e: 'GET', 'POST', 'PATCH'.
+        :param endpoint: (str) the endpoint relative to the runtime namespace i.e: 'retrieve-fi-context/'.
+        :param authorization: (str) the Authorization header value.
+        :param body: (dict) the request JSON body.
+        :param headers: (dict) the request headers i.e: If-None-Match.
+        """
+        result = self._handle(method, endpoint, authorization, body, headers)
+        return result if headers is not None else result[:2]
+
+    def _handle(self, method: str, endpoint: str, authorization: str, body: dict = None,
+                headers: dict = None) -> Tuple[int, dict, dict]:
+        route = self._routes.get((method, endpoint))
+        if not route:
+            return 404, {'detail': 'Not found.'}, {}
+        try:
+            _, token = authorization.split(' ', 1)
+            fi_uuid = jwt.decode(token, options={'verify_signature': False})['fi_uuid']
+        except Exception:
+            return 401, {'detail': 'Invalid token.'}, {}
+
+        with self._lock:
+            if fi_uuid not in self._instances:
+                if not self.auto_register:
+                    return 404, {'detail': 'Function instance not found.'}, {}
+                self.register_function_instance(fi_uuid)
+            instance = self._instances[fi_uuid]
+            status, data = route(fi_uuid, instance, body or {})
+            # The context changes with its status and outputs.
+            if status == 200 and method != 'GET' and endpoint != 'create-fi-log-message/':
+                instance['version'] += 1
+            etag = '"%s-%d"' % (fi_uuid, instance['version'])
+            if endpoint == 'retrieve-fi-context/' and \
+                    CaseInsensitiveDict(headers or {}).get('If-None-Match') == etag:
+                return 304, {}, {'ETag': etag}
+
+            return status, data, {'ETag': etag} if endpoint == 'retrieve-fi-context/' else {}
+
+    def _retrieve_fi_context(self, fi_uuid: str, instance: dict, body: dict):
+        return 200, {
+            'function_instance': instance['fi'].as_dict,
+            'inputs': [ipt.as_dict for ipt in instance['inputs']],
+            'outputs': [opt.as_dict for opt in instance['outputs']], }
+
+    def _create_fi_log_message(self, fi_uuid: str, instance: dict, body: dict):
+        log_message = body.get('log_message')
+        if not isinstance(log_message, str):
+            return 400, {'log_message': ['This field is required.']}
+        log_entity = FunctionInstanceLogMessageEntity(
+            fi_uuid=UUID(fi_uuid),
+            log_message=log_message,
+            log_level=body.get('log_level', FunctionInstanceLogMessageEntity.LOG_LEVELS[1][0]))
+        instance['log_messages'].append(log_entity)
+
+        return 200, {'log_message': log_entity.as_dict}
+
+    def _update_fi_status(self, fi_uuid: str, instance: dict, body: dict):
+        fi = instance['fi']
+        status_method = body.get('status_method')
+        if fi.get('status') not in FunctionInstanceEntity.STATUS_METHODS.get(status_method, ()):
+            return 400, {'status_method': ['Invalid status method for status "%s".'
+                                           % fi.get('status')]}
+        if status_method == 'block':
+            fi._status = 'blocked'
+        else:
+            fi._status = 'completed'
+            fi._completed = _now()
+        fi._updated = _now()
+
+        return 200, {'function_instance': fi.as_dict}
+
+    def _create_fi_output(self, fi_uuid: str, instance: dict, body: dict):
+        try:
+            variable = pickle.loads(decode_b64str(body['output']))
+            assert isinstance(variable, Variable)
+        except Exception:
+            return 400, {'output': ['Invalid output variable.']}
+        outputs = [opt for opt in instance['outputs']
+                   if opt.get('id_name') != variable.id_name]
+        outputs.append(self._new_variable_entity(fi_uuid, 'output', variable, len(outputs)))
+        instance['outputs'] = outputs
+
+        return 200, {'outputs': [opt.as_dict for opt in outputs]}
+
+    @staticmethod
+    def _new_variable_entity(fi_uuid: str, iot: str, variable: Variable, rank: int):
+        return VariableEntity(
+            iot=iot,
+            id_name=variable.id_name,
+            type_=variable.type,
+            charset=variable.charset,
+            bytes_=variable.bytes,
+            fi_uuid=fi_uuid,
+            rank=rank, )
+
+
+class FakeRuntimeServer:
+    """
+    Serves a FakeRuntime over HTTP on a background thread, over TCP or over a unix
+    domain socket if socket_path is given.
+
+    Usage:
+        with FakeRuntimeServer() as server:
+            server.configure_environ()
+            ...
+    """
+
+    def __init__(self, runtime: FakeRuntime = None, host: str = '127.0.0.1', port: int = 0,
+                 socket_path: str = None):
+        self.runtime = runtime or FakeRuntime()
+        self.socket_path = socket_path
+        if socket_path:
+            self._httpd = ThreadingUnixStreamServer(
+                socket_path, _new_request_handler(self.runtime, tcp=False))
+        else:
+            self._httpd = ThreadingHTTPServer((host, port), _new_request_handler(self.runtime))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self) -> str:
+        return None if self.socket_path else self._httpd.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return None if self.socket_path else self._httpd.server_address[1]
+
+    def configure_environ(self):
+        """Points ScaladeRuntimeAPIClient instances to this server."""
+        if self.socket_path:
+            os.environ['SCALADE_API_SERVER_SOCKET'] = self.socket_path
+            return
+        os.environ.pop('SCALADE_API_SERVER_SOCKET', None)
+        os.environ['SCALADE_API_SERVER_HOST'] = self.host
+        os.environ['SCALADE_API_SERVER_PORT'] = str(self.port)
+        os.environ['SCALADE_API_SERVER_USE_SSL'] = 'False'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _new_request_handler(runtime: FakeRuntime, tcp: bool = True):
+    class RuntimeRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = tcp
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PATCH(self):
+            self._handle('PATCH')
+
+        def _handle(self, method: str):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            endpoint = self.path.split('/runtime/', 1)[-1]
+            status, data, headers = call_handler(
+                runtime.handle, method, endpoint, self.headers.get('Authorization'), body,
+                dict(self.headers))
+
+            payload = json.dumps(data).encode() if status != 304 else b''
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return RuntimeRequestHandler
+
+
+def _now() -> datetime:
+    return datetime.utcnow().replace(microsecond=0)
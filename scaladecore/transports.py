@@ -0,0 +1,236 @@
+"""
+Transports of the runtime API client: how a runtime API call reaches the runtime.
+"""
+from abc import ABC, abstractmethod
+from http.client import HTTPConnection, RemoteDisconnected
+import inspect
+import json
+import os
+import socket
+import threading
+from typing import Callable, Tuple
+from urllib.parse import urljoin
+
+from requests import Session
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from .utils import get_pckg_dist_version_num
+
+API_NAMESPACE = '/api/{version}/runtime/'
+# Methods safe to send twice: a request on a keep-alive connection the runtime closed may
+# or may not have been processed.
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+def get_api_namespace() -> str:
+    return API_NAMESPACE.format(version="v%s" % get_pckg_dist_version_num())
+
+
+def build_response(status_code: int, content: bytes, headers: dict = None, url: str = None,
+                   reason: str = None) -> Response:
+    """Factory function of a requests Response, for transports not backed by requests."""
+    resp = Response()
+    resp.status_code = status_code
+    resp.reason = reason
+    resp.headers = CaseInsensitiveDict(headers or {'Content-Type': 'application/json'})
+    resp.encoding = 'utf-8'
+    resp._content = content
+    resp.url = url
+
+    return resp
+
+
+class Transport(ABC):
+    @abstractmethod
+    def request(self, method: str, endpoint: str, headers: dict, body: dict = None,
+                timeout: float = None) -> Response:
+        """
+        Performs a runtime API call.
+
+        :param method: (str) the HTTP method i.e: 'GET', 'POST', 'PATCH'.
+        :param endpoint: (str) the endpoint relative to the runtime namespace i.e: 'retrieve-fi-context/'.
+        :param headers: (dict) the request headers, Authorization included.
+        :param body: (dict) the request JSON body.
+        :param timeout: (float) seconds to wait for the runtime, None waits forever.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class HTTPTransport(Transport):
+    """HTTP(S) over TCP, on a keep-alive requests session."""
+
+    def __init__(self, host: str, port: int, use_ssl: bool = False):
+        self.base_url = urljoin('%s://%s:%s' % ('https' if use_ssl else 'http', host, port),
+                                get_api_namespace())
+        self._session = Session()
+
+    @classmethod
+    def from_environ(cls) -> 'HTTPTransport':
+        """
+        Factory function of the transport to SCALADE_API_SERVER_HOST:SCALADE_API_SERVER_PORT.
+        """
+        return cls(host=os.getenv('SCALADE_API_SERVER_HOST', 'localhost'),
+                   port=os.getenv('SCALADE_API_SERVER_PORT', '8000'),
+                   use_ssl=os.getenv('SCALADE_API_SERVER_USE_SSL', 'False') == 'True')
+
+    @property
+    def session(self) -> Session:
+        return self._session
+
+    def request(self, method: str, endpoint: str, headers: dict, body: dict = None,
+                timeout: float = None) -> Response:
+        return self._session.request(
+            method, urljoin(self.base_url, endpoint), headers=headers, json=body, timeout=timeout)
+
+    def close(self):
+        self._session.close()
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class UnixSocketTransport(Transport):
+    """
+    HTTP over a unix domain socket, for a runtime running as a sidecar on the same host.
+    Keeps a keep-alive connection per thread.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.namespace = get_api_namespace()
+        self._local = threading.local()
+
+    def _get_connection(self) -> UnixHTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = UnixHTTPConnection(self.socket_path, self.timeout)
+        return conn
+
+    def request(self, method: str, endpoint: str, headers: dict, body: dict = None,
+                timeout: float = None) -> Response:
+        path = urljoin(self.namespace, endpoint)
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = dict(headers)
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+        try:
+            status, reason, resp_headers, content = self._request(
+                method, path, headers, payload, timeout)
+        except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The runtime closed the idle keep-alive connection: idempotent calls are
+            # retried on a new one.
+            self.close()
+            if method.upper() not in IDEMPOTENT_METHODS:
+                raise
+            status, reason, resp_headers, content = self._request(
+                method, path, headers, payload, timeout)
+        except TimeoutError:
+            # The connection is left with a pending response.
+            self.close()
+            raise
+
+        return build_response(status, content, resp_headers,
+                              'http+unix://%s%s' % (self.socket_path, path), reason)
+
+    def _request(self, method: str, path: str, headers: dict, payload: bytes = None,
+                 timeout: float = None) -> Tuple[int, str, dict, bytes]:
+        conn = self._get_connection()
+        conn.timeout = self.timeout if timeout is None else timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(conn.timeout)
+        conn.request(method, path, body=payload, headers=headers)
+        resp = conn.getresponse()
+        content = resp.read()
+        if resp.will_close:
+            self.close()
+
+        return resp.status, resp.reason, dict(resp.getheaders()), content
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def accepts_headers(handler: Callable) -> bool:
+    """Whether a runtime API handler takes the request headers, as a headers argument."""
+    try:
+        parameters = inspect.signature(handler).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(parameter.name == 'headers' or parameter.kind == parameter.VAR_KEYWORD
+               for parameter in parameters)
+
+
+def call_handler(handler: Callable[..., tuple], method: str, endpoint: str,
+                 authorization: str, body: dict = None, headers: dict = None,
+                 with_headers: bool = None) -> Tuple[int, dict, dict]:
+    """
+    Calls a runtime API handler, (method, endpoint, authorization, body=None) returning
+    (status code, data), and returns (status code, data, response headers).
+    Handlers taking a headers argument get the request headers and may also return the
+    response headers: (status code, data, response headers).
+
+    :param with_headers: (bool) whether handler takes headers, default inspects it.
+    """
+    if with_headers is None:
+        with_headers = accepts_headers(handler)
+    if with_headers:
+        result = handler(method, endpoint, authorization, body, headers=headers)
+    else:
+        result = handler(method, endpoint, authorization, body)
+    status, data, *resp_headers = result
+
+    return status, data, resp_headers[0] if resp_headers else {}
+
+
+class InProcessTransport(Transport):
+    """
+    Hands runtime API calls to a handler in the same process, with no sockets at all,
+    i.e: InProcessTransport(FakeRuntime().handle). See call_handler about handlers.
+    """
+
+    def __init__(self, handler: Callable[..., tuple]):
+        self.handler = handler
+        self._with_headers = accepts_headers(handler)
+
+    def request(self, method: str, endpoint: str, headers: dict, body: dict = None,
+                timeout: float = None) -> Response:
+        authorization = CaseInsensitiveDict(headers).get('Authorization')
+        status, data, resp_headers = call_handler(
+            self.handler, method, endpoint, authorization, body, headers, self._with_headers)
+        resp_headers = dict(resp_headers, **{'Content-Type': 'application/json'})
+
+        return build_response(status, json.dumps(data).encode() if status != 304 else b'',
+                              resp_headers, url='inprocess://' + endpoint)
+
+
+def create_transport() -> Transport:
+    """
+    Factory function of the default transport: over the SCALADE_API_SERVER_SOCKET unix
+    socket if it is set, else over TCP to SCALADE_API_SERVER_HOST:SCALADE_API_SERVER_PORT.
+    """
+    socket_path = os.getenv('SCALADE_API_SERVER_SOCKET')
+    if socket_path:
+        return UnixSocketTransport(socket_path)
+
+    return HTTPTransport.from_environ()
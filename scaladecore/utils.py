@@ -1,14 +1,19 @@
 import base64
+from collections import OrderedDict
 import configparser
 from datetime import datetime, timedelta
+from functools import lru_cache
+from hashlib import sha256
 import jwt
-import yaml
+from jwt.algorithms import RSAAlgorithm
 import os
 from pkg_resources import get_distribution, DistributionNotFound
 import re
-from typing import TypeVar, Any
+import threading
+from time import monotonic, time
+from typing import Any, List, Optional, TypeVar
 
-from .config import FunctionConfig
+from .config import FunctionConfig, load_config_file
 from .exceptions import BearerTokenParseError
 
 ISO_8601_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
@@ -18,7 +23,11 @@ TOKEN_REGEX = re.compile("[A-Za-z_.+-]*$")
 
 Base64Str = TypeVar('Base64Str')
 
+_RS256 = RSAAlgorithm(RSAAlgorithm.SHA256)
+_RSA_KEYS = {}
 
+
+@lru_cache(maxsize=4096)
 def parse_dt(date_str):
     return datetime.strptime(date_str, ISO_8601_FORMAT)
 
@@ -38,8 +47,7 @@ def bytes_to_b64str(_bytes: bytes) -> Base64Str:
 def get_foo_function_config() -> FunctionConfig:
     filename = os.path.join(
         os.path.dirname(__file__), 'fixture', 'config', 'function.yml')
-    with open(filename, 'r') as file:
-        config_data = yaml.safe_load(file)
+    config_data = load_config_file(filename)
 
     inputs_ = config_data.get('inputs', [])
     for rk in range(len(inputs_)):
@@ -63,13 +71,89 @@ def parse_bearer_token(bearer_token):
     return token
 
 
+class TokenClaimsCache:
+    """
+    Thread-safe LRU cache of verified token claims, keyed by the token SHA-256 digest.
+    Entries expire with the token 'exp' claim and are only valid for the key that verified them,
+    so rotating the key invalidates them.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str, key) -> dict:
+        digest = sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry:
+                claims, verified_with, exp = entry
+                if verified_with is key and (exp is None or exp > time()):
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return dict(claims)
+                del self._entries[digest]
+            self.misses += 1
+
+        return None
+
+    def put(self, token: str, key, claims: dict):
+        if self.maxsize <= 0:
+            return
+        digest = sha256(token.encode()).digest()
+        with self._lock:
+            self._entries[digest] = (dict(claims), key, claims.get('exp'))
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size=len(self._entries),
+            maxsize=self.maxsize, )
+
+
+TOKEN_CLAIMS_CACHE = TokenClaimsCache(int(os.getenv('SCALADE_TOKEN_CACHE_SIZE', '1024')))
+
+
+def get_rsa_key(env_var: str):
+    """
+    Returns the parsed RSA key whose PEM is set in the env_var environment variable.
+    The key is parsed once and parsed again only when the variable changes (key rotation).
+    """
+    pem = os.getenv(env_var, '')
+    cached = _RSA_KEYS.get(env_var)
+    if cached and cached[0] == pem:
+        return cached[1]
+    key = _RS256.prepare_key(pem.encode())
+    _RSA_KEYS[env_var] = (pem, key)
+
+    return key
+
+
 def encode_scalade_token(payload):
-    private_key = os.getenv('SCALADE_PRIVATE_KEY', '').encode()
+    private_key = get_rsa_key('SCALADE_PRIVATE_KEY')
     return jwt.encode(payload, private_key, algorithm='RS256')
 
 
 def decode_scalade_token(token: str) -> dict:
-    public_key = os.getenv('SCALADE_PUBLIC_KEY', '').encode()
+    public_key = get_rsa_key('SCALADE_PUBLIC_KEY')
+    decoded_token = TOKEN_CLAIMS_CACHE.get(token, public_key)
+    if decoded_token is not None:
+        return decoded_token
     try:
         decoded_token = jwt.decode(token, public_key, algorithms='RS256')
     except jwt.exceptions.DecodeError:
@@ -79,9 +163,42 @@ def decode_scalade_token(token: str) -> dict:
     except jwt.exceptions.ExpiredSignatureError:
         raise jwt.exceptions.ExpiredSignatureError(
             'The function Token has been expired')
+    TOKEN_CLAIMS_CACHE.put(token, public_key, decoded_token)
+
     return decoded_token
 
 
+def get_token_cache_stats() -> dict:
+    """Hit/miss metrics of the verified token claims cache."""
+    return TOKEN_CLAIMS_CACHE.stats
+
+
+def read_token_claims(token: str) -> dict:
+    """Reads the claims of a token without verifying its signature, {} if it is malformed."""
+    try:
+        return jwt.decode(token, options={'verify_signature': False})
+    except jwt.exceptions.DecodeError:
+        return {}
+
+
+def get_fi_deadline(token: str = None) -> Optional[float]:
+    """
+    Deadline of a function instance as a time.monotonic() timestamp: the earliest of the token
+    'exp' claim (read without verifying the signature) and SCALADE_FI_TIMEOUT seconds from now.
+    None if there is neither.
+    """
+    deadlines = []
+    timeout = os.getenv('SCALADE_FI_TIMEOUT')
+    if timeout:
+        deadlines.append(monotonic() + float(timeout))
+    if token:
+        exp = read_token_claims(token).get('exp')
+        if exp is not None:
+            deadlines.append(monotonic() + (exp - time()))
+
+    return min(deadlines) if deadlines else None
+
+
 def generate_token_payload(fi_uuid: str, ttl=7200):
     gen_time = datetime.now()
     exp_time = gen_time + timedelta(hours=ttl / 3600)
@@ -120,6 +237,7 @@ def _get_pckg_config_subset(subset_fields_seq: list) -> Any:
     return sb_conf
 
 
+@lru_cache(maxsize=1)
 def get_pckg_dist_version_num() -> str:
     try:
         dist = get_distribution('scaladecore')
@@ -127,3 +245,9 @@ def get_pckg_dist_version_num() -> str:
     except DistributionNotFound:
         version = _get_pckg_config_subset(['metadata', 'version'])
     return version[0]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile (pct in 0-100) of an already sorted list of values."""
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
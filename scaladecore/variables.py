@@ -1,18 +1,25 @@
 from datetime import datetime
+from functools import lru_cache
+import json
 import pickle
-import sys
 from tempfile import TemporaryFile
-from typing import Any
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, Type
 
+from pkg_resources import iter_entry_points
+
+from .exceptions import VariableTypeError
+from .memory import get_memory_budget
 from .utils import bytes_to_b64str
 
 DEFAULT_CHARSET = 'utf-8'
 ISO_8601_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+VARIABLE_TYPES_ENTRY_POINT = 'scaladecore.variable_types'
 
 
 class Variable:
+    # Built-in types, see get_variable_types for the registered ones.
     TYPES = ('text', 'integer', 'boolean', 'datetime',
-             'file')
+             'file', 'json')
 
     def __init__(self,
                  id_name: str,
@@ -23,7 +30,8 @@ class Variable:
         self._id_name = id_name
         self._set_type(type_)
         self._charset = charset
-        self._bytes = self.encode(value) if value else bytes_
+        self._release = None
+        self._set_bytes(self.encode(value) if value else bytes_)
 
     @property
     def id_name(self):
@@ -39,6 +47,10 @@ class Variable:
 
     @property
     def bytes(self) -> bytes:
+        """
+        The body, a bytes-like object (a memoryview if mapped from the data plane, spilled
+        out of the memory budget or viewed from a variable entity, i.e: context inputs).
+        """
         return self._bytes
 
     @property
@@ -50,19 +62,24 @@ class Variable:
 
     @property
     def decoded(self) -> Any:
-        return self._bytes.decode(encoding=self._charset)
+        return str(self._bytes, self._charset)
 
     @classmethod
     def create(cls, type_: str, *args, **kwargs):
         """Factory function"""
-        if type_ not in cls.TYPES:
-            raise Exception(
-                f'Invalid variable type: valid ones are {cls.TYPES}')
+        variable_class = get_variable_type(type_).variable_class
+        if len(args) > 1:
+            # type_ is passed positionally too (as a placeholder), the factory one is used.
+            return variable_class(args[0], type_, *args[2:], **kwargs)
+        return variable_class(*args, type_=type_, **kwargs)
 
-        class_name = '%sVariable' % type_.capitalize()
-        var_type = getattr(sys.modules[__name__], class_name)
+    def estimate_size(self) -> int:
+        """The body size in bytes, without encoding it if it is not yet."""
+        return len(self.buffer())
 
-        return var_type(*args, **kwargs)
+    def buffer(self):
+        """The body as a bytes-like object, zero-copy if the type supports it."""
+        return self.bytes
 
     def encode(self, value: Any) -> bytes:
         return value.encode(encoding=self._charset)
@@ -71,12 +88,31 @@ class Variable:
         return bytes_to_b64str(self._bytes)
 
     def update(self, value):
-        self._bytes = self.encode(value)
+        self._set_bytes(self.encode(value))
 
     def dump(self):
         serialized = pickle.dumps(self)
         return bytes_to_b64str(serialized)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if isinstance(self._bytes, memoryview):
+            state['_bytes'] = self._bytes.tobytes()
+        state.pop('_release', None)
+        return state
+
+    def __setstate__(self, state):
+        body = state.pop('_bytes', None)
+        self.__dict__.update(state)
+        self._release = None
+        self._set_bytes(body)
+
+    def _set_bytes(self, body):
+        """Sets the body, admitted into the process memory budget."""
+        if self._release is not None:
+            self._release()
+        self._bytes, self._release = get_memory_budget().admit(self, body)
+
     def _set_type(self, type_=None):
         if not type_:
             self.__type = self.__class__.__name__.split('Variable')[
@@ -148,6 +184,194 @@ class FileVariable(Variable):
         return file_bytes
 
 
+_NOT_PARSED = object()
+
+
+class JsonVariable(Variable):
+    """
+    JSON document, encoded compactly. It is parsed on first access and the parsed object
+    is cached, items are reached by path: var['a']['b'] or var.path('a', 'b').
+    The value and the items are the cached objects themselves: mutating them does not
+    change the body, call update with the changed document.
+    """
+
+    def __init__(self, id_name: str, type_: str = None, bytes_: bytes = None,
+                 value: Any = None, charset: str = DEFAULT_CHARSET):
+        self._parsed = _NOT_PARSED
+        super().__init__(id_name, type_, bytes_, charset=charset)
+        # Falsy documents ({}, [], 0 ..) are values too.
+        if value is not None:
+            self.update(value)
+
+    @property
+    def decoded(self) -> Any:
+        if self._parsed is _NOT_PARSED:
+            if self._bytes is None:
+                return None
+            # A null document is cached too.
+            self._parsed = json.loads(str(self._bytes, self._charset))
+        return self._parsed
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode(self._charset)
+
+    def path(self, *keys) -> Any:
+        """The item at the path of keys (object keys and array indexes) of the document."""
+        item = self.decoded
+        for key in keys:
+            item = item[key]
+        return item
+
+    def __getitem__(self, key) -> Any:
+        return self.decoded[key]
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_parsed', None)
+        return state
+
+    def __setstate__(self, state):
+        self._parsed = _NOT_PARSED
+        super().__setstate__(state)
+
+    def _set_bytes(self, body):
+        self._parsed = _NOT_PARSED
+        super()._set_bytes(body)
+
+
+class VariableCodec(NamedTuple):
+    """
+    Codec of a user-defined variable type.
+
+    :param encode: (callable) value -> bytes.
+    :param decode: (callable) bytes-like object (bytes or a memoryview) -> value.
+    :param buffer: (callable) value -> C-contiguous buffer over its memory, optional:
+        the value is then written to outputs and to the data plane without copying it, so
+        it must not be mutated while an output of it is being sent.
+    :param estimate_size: (callable) value -> estimated encoded size in bytes, optional.
+    """
+    encode: Callable[[Any], bytes]
+    decode: Callable[[Any], Any]
+    buffer: Optional[Callable[[Any], Any]] = None
+    estimate_size: Optional[Callable[[Any], int]] = None
+
+
+class CodecVariable(Variable):
+    """
+    Variable of a user-defined type, encoded and decoded by the codec registered for it.
+    A variable created from a value is encoded lazily and decodes to that same value.
+    """
+
+    def __init__(self, id_name: str, type_: str = None, bytes_: bytes = None,
+                 value: Any = None, charset: str = DEFAULT_CHARSET):
+        self._value = value
+        super().__init__(id_name, type_, bytes_, charset=charset)
+
+    @property
+    def codec(self) -> VariableCodec:
+        return get_variable_type(self.type).codec
+
+    @property
+    def bytes(self) -> bytes:
+        if self._bytes is None and self._value is not None:
+            # A copy: a view over the value would alias it and escape the memory budget.
+            self._set_bytes(bytes(self.buffer()))
+        return self._bytes
+
+    @property
+    def decoded(self) -> Any:
+        if self._value is None and self._bytes is not None:
+            self._value = self.codec.decode(self._bytes)
+        return self._value
+
+    def encode(self, value: Any) -> bytes:
+        return self.codec.encode(value)
+
+    def update(self, value):
+        self._value = value
+        self._set_bytes(None)
+
+    def estimate_size(self) -> int:
+        codec = self.codec
+        if self._bytes is None and self._value is not None and codec.estimate_size:
+            return codec.estimate_size(self._value)
+        return super().estimate_size()
+
+    def buffer(self):
+        if self._bytes is not None or self._value is None:
+            return self._bytes
+        codec = self.codec
+        if codec.buffer:
+            return memoryview(codec.buffer(self._value)).cast('B')
+        return codec.encode(self._value)
+
+    def get_body(self):
+        return bytes_to_b64str(self.bytes)
+
+    def __getstate__(self):
+        # Pickled variables only carry the encoded body, the codec is looked up on loading.
+        state = super().__getstate__()
+        if state['_bytes'] is None and self._value is not None:
+            state['_bytes'] = bytes(self.buffer())
+        state['_value'] = None
+        return state
+
+
+class VariableType(NamedTuple):
+    variable_class: Type[Variable]
+    codec: Optional[VariableCodec] = None
+
+
+_VARIABLE_TYPES: Dict[str, VariableType] = {
+    type_: VariableType(var_class) for type_, var_class in (
+        ('text', TextVariable),
+        ('integer', IntegerVariable),
+        ('boolean', BooleanVariable),
+        ('datetime', DatetimeVariable),
+        ('file', FileVariable),
+        ('json', JsonVariable), )}
+
+
+def register_variable_type(type_: str, encode: Callable[[Any], bytes],
+                           decode: Callable[[Any], Any], buffer: Callable[[Any], Any] = None,
+                           estimate_size: Callable[[Any], int] = None):
+    """
+    Registers a user-defined variable type, i.e: from the package that owns the format.
+    Its variables are CodecVariables, see VariableCodec for the codec functions.
+
+    :param type_: (str) the variable type name, registered ones (built-in ones included)
+        can't be replaced.
+    """
+    if type_ in _VARIABLE_TYPES:
+        raise VariableTypeError(type_, 'it is already registered')
+    _VARIABLE_TYPES[type_] = VariableType(
+        CodecVariable, VariableCodec(encode, decode, buffer, estimate_size))
+
+
+def get_variable_type(type_: str) -> VariableType:
+    if type_ not in _VARIABLE_TYPES:
+        _load_variable_type_plugins()
+    try:
+        return _VARIABLE_TYPES[type_]
+    except KeyError:
+        raise VariableTypeError(type_, 'valid ones are %s' % (get_variable_types(), ))
+
+
+@lru_cache(maxsize=1)
+def _load_variable_type_plugins():
+    """
+    Loads the 'scaladecore.variable_types' entry points of the installed packages, which
+    register their variable types: they are known even where their package is not imported
+    (i.e: config verification).
+    """
+    for entry_point in iter_entry_points(VARIABLE_TYPES_ENTRY_POINT):
+        entry_point.load()
+
+
+def get_variable_types() -> Tuple[str, ...]:
+    return tuple(_VARIABLE_TYPES)
+
+
 def format_dt(dt, format_=ISO_8601_FORMAT):
     return dt.strftime(format_)
 
@@ -1,12 +1,22 @@
 from datetime import datetime
 import os
+from typing import NamedTuple
 from uuid import uuid4
 
 import pytest
 
 
+from scaladecore.managers import ContextManager
+from scaladecore.testing import FakeRuntime
+from scaladecore.transports import InProcessTransport
 from scaladecore.utils import format_dt, get_foo_function_config, \
     encode_scalade_token, generate_token_payload
+from scaladecore.variables import Variable
+
+
+class FakeFunctionInstance(NamedTuple):
+    uuid: str
+    token: str
 
 
 @pytest.fixture(scope='session', name='function_cd')
@@ -27,108 +37,47 @@ def variable_config_data():
 
 @pytest.fixture(scope='session')
 def account_obj_d():
-    return dict(
-        **new_base_kwargs(),
-        auth_id='xxxxyyyy/test_user',
-        username='test_user',
-        email='test_user@tryscaffold.com',
-        date_joined=format_dt(datetime.utcnow()),
-        last_login=format_dt(datetime.utcnow()),
-    )
+    return new_account_obj_d()
 
 
 @pytest.fixture(scope='session')
 def business_obj_d(account_obj_d):
-    return dict(
-        **new_base_kwargs(),
-        master_account=account_obj_d,
-        organization_name='Fake Company',
-    )
+    return new_business_obj_d(account_obj_d)
 
 
 @pytest.fixture(scope='session')
 def user_obj_d(account_obj_d, business_obj_d):
-    return dict(
-        **new_base_kwargs(),
-        account=account_obj_d,
-        business=business_obj_d,
-        first_name='Foo',
-        last_name='Bar',
-    )
+    return new_user_obj_d(account_obj_d, business_obj_d)
 
 
 @pytest.fixture(scope='session')
 def workspace_obj_d(business_obj_d):
-    return dict(
-        **new_base_kwargs(),
-        name='default',
-        business=business_obj_d,
-    )
+    return new_workspace_obj_d(business_obj_d)
 
 
 @pytest.fixture(scope='session')
 def function_type_obj_d(function_cd, account_obj_d):
-    return dict(
-        **new_base_kwargs(),
-        key='%s/%s' % (str(account_obj_d.get('uuid'))[:8], function_cd['key']),
-        verbose_name=function_cd['verbose_name'],
-        description=function_cd['description'],
-        updated=format_dt(datetime.utcnow()),
-        inputs=function_cd['inputs'],
-        outputs=function_cd['outputs'],
-        account=account_obj_d,
-    )
+    return new_function_type_obj_d(function_cd, account_obj_d)
 
 
 @pytest.fixture(scope='session')
 def stream_obj_d(account_obj_d):
-    return dict(
-        **new_base_kwargs(),
-        name='FakeStream',
-        pushed=format_dt(datetime.utcnow()),
-        updated=format_dt(datetime.utcnow()),
-        finished=format_dt(datetime.utcnow()),
-        status='pushed',
-        account=account_obj_d,
-    )
+    return new_stream_obj_d(account_obj_d)
 
 
 @pytest.fixture(scope='session')
 def function_instance_obj_d(function_type_obj_d, stream_obj_d):
-    return dict(
-        **new_base_kwargs(),
-        function_type=function_type_obj_d,
-        stream=stream_obj_d,
-        position={'row': 0, 'col': 0},
-        initialized=format_dt(datetime.utcnow()),
-        updated=format_dt(datetime.utcnow()),
-        completed=format_dt(datetime.utcnow()),
-        status='pending',
-    )
+    return new_function_instance_obj_d(function_type_obj_d, stream_obj_d)
 
 
 @pytest.fixture(scope='session')
 def variable_obj_d():
-    return dict(
-        **new_base_kwargs(),
-        iot='input',
-        id_name='fake_input_1',
-        type='text',
-        charset='utf-8',
-        body='TXkgbmFtZSBpcyBGb28gYW5kIEkgbG92ZSBCYXJz',
-        fi_uuid=str(uuid4()),
-        __rank__=0,
-    )
+    return new_variable_obj_d()
 
 
 @pytest.fixture(scope='session')
 def fi_message_obj_d():
-    return dict(
-        **new_base_kwargs(),
-        fi_uuid=str(uuid4()),
-        log_message='This is a log message',
-        log_level='info',
-    )
+    return new_fi_message_obj_d()
 
 
 @pytest.fixture(scope='session')
@@ -210,7 +159,133 @@ def scalade_api_server(fi_uuid):
     os.environ['SCALADE_FI_TOKEN'] = token
 
 
+@pytest.fixture
+def fake_runtime(rsa_keys):
+    return FakeRuntime()
+
+
+@pytest.fixture
+def fake_fi(fake_runtime):
+    """A running function instance of fake_runtime, with the text input 'name' set to 'Foo'."""
+    fi_uuid = fake_runtime.register_function_instance(
+        inputs=[Variable.create('text', 'name', value='Foo')])
+    return FakeFunctionInstance(fi_uuid, encode_scalade_token(generate_token_payload(fi_uuid)))
+
+
+@pytest.fixture
+def fake_context(fake_runtime, fake_fi):
+    """
+    Initializes contexts of fake_fi over an in-process transport, calling handler instead of
+    fake_runtime.handle when given.
+    """
+    def initialize(handler=None) -> ContextManager:
+        return ContextManager.initialize_from_token(
+            fake_fi.token, InProcessTransport(handler or fake_runtime.handle))
+
+    return initialize
+
+
 def new_base_kwargs():
     return dict(
         uuid=str(uuid4()),
         created=format_dt(datetime.utcnow()), )
+
+
+# Fixture data builders, also used to generate the benchmarks fixtures.
+
+def new_account_obj_d():
+    return dict(
+        **new_base_kwargs(),
+        auth_id='xxxxyyyy/test_user',
+        username='test_user',
+        email='test_user@tryscaffold.com',
+        date_joined=format_dt(datetime.utcnow()),
+        last_login=format_dt(datetime.utcnow()),
+    )
+
+
+def new_business_obj_d(account_obj_d):
+    return dict(
+        **new_base_kwargs(),
+        master_account=account_obj_d,
+        organization_name='Fake Company',
+    )
+
+
+def new_user_obj_d(account_obj_d, business_obj_d):
+    return dict(
+        **new_base_kwargs(),
+        account=account_obj_d,
+        business=business_obj_d,
+        first_name='Foo',
+        last_name='Bar',
+    )
+
+
+def new_workspace_obj_d(business_obj_d):
+    return dict(
+        **new_base_kwargs(),
+        name='default',
+        business=business_obj_d,
+    )
+
+
+def new_function_type_obj_d(function_cd, account_obj_d):
+    return dict(
+        **new_base_kwargs(),
+        key='%s/%s' % (str(account_obj_d.get('uuid'))[:8], function_cd['key']),
+        verbose_name=function_cd['verbose_name'],
+        description=function_cd['description'],
+        updated=format_dt(datetime.utcnow()),
+        inputs=function_cd['inputs'],
+        outputs=function_cd['outputs'],
+        account=account_obj_d,
+    )
+
+
+def new_stream_obj_d(account_obj_d):
+    return dict(
+        **new_base_kwargs(),
+        name='FakeStream',
+        pushed=format_dt(datetime.utcnow()),
+        updated=format_dt(datetime.utcnow()),
+        finished=format_dt(datetime.utcnow()),
+        status='pushed',
+        account=account_obj_d,
+    )
+
+
+def new_function_instance_obj_d(function_type_obj_d, stream_obj_d):
+    return dict(
+        **new_base_kwargs(),
+        function_type=function_type_obj_d,
+        stream=stream_obj_d,
+        position={'row': 0, 'col': 0},
+        initialized=format_dt(datetime.utcnow()),
+        updated=format_dt(datetime.utcnow()),
+        completed=format_dt(datetime.utcnow()),
+        status='pending',
+    )
+
+
+def new_variable_obj_d(id_name='fake_input_1', body='TXkgbmFtZSBpcyBGb28gYW5kIEkgbG92ZSBCYXJz',
+                       rank=0, iot='input', type_='text'):
+    return dict(
+        **new_base_kwargs(),
+        iot=iot,
+        id_name=id_name,
+        type=type_,
+        charset='utf-8',
+        body=body,
+        fi_uuid=str(uuid4()),
+        __rank__=rank,
+    )
+
+
+def new_fi_message_obj_d(log_message='This is a log message'):
+    return dict(
+        **new_base_kwargs(),
+        fi_uuid=str(uuid4()),
+        log_message=log_message,
+        log_level='info',
+    )
@@ -1,23 +1,55 @@
-from datetime import datetime
+from array import array
+import contextlib
+from datetime import date, datetime
+import gc
+from http.client import RemoteDisconnected
+import io
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import tracemalloc
 from tempfile import TemporaryFile
 from typing import Tuple
 from unittest import mock
+from uuid import uuid4
 
+import click
 import pytest
+import requests
 
 from scaladecore.entities import EntityContract, AccountEntity, BusinessEntity, UserEntity, \
     WorkspaceEntity, FunctionTypeEntity, StreamEntity, FunctionInstanceEntity, VariableEntity, \
-    FunctionInstanceLogMessageEntity
-from scaladecore.exceptions import EntityFactoryError
+    FunctionInstanceLogMessageEntity, _ENTITY_TYPES, _split_chunks
+from scaladecore.clients import RecordingRuntimeAPIClient, ScaladeRuntimeAPIClient, \
+    create_runtime_api_client
+import scaladecore
+from scaladecore import dataplane
+from scaladecore.exceptions import ContextBlockError, ContextCompleteError, ContextInitError, \
+    ContextLogError, ContextOutputError, DataPlaneError, DuplicateEntityTypeError, \
+    DeadlineExceededError, EntityFactoryError, ReplayError, SpoolClosedError, VariableTypeError
+from scaladecore import OutputChunk, scalade_func
+from scaladecore.instrumentation import PHASE_USER_FUNCTION, phase, record_timings, \
+    set_timings_sink
+from scaladecore.managers import ContextManager
+from scaladecore.memory import MemoryBudget, set_memory_budget
+from scaladecore.profiling import create_profiler
 from scaladecore.variables import Variable, TextVariable, IntegerVariable, BooleanVariable, \
-    DatetimeVariable, FileVariable
+    DatetimeVariable, FileVariable, JsonVariable, _VARIABLE_TYPES, register_variable_type
+from scaladecore.cli import _generate_tokens, _run, _run_many, _verify_configs
 from scaladecore.config import VariableConfig, InputConfig, OutputConfig, FunctionConfig, \
-    FunctionConfigProvider
-from scaladecore.utils import encode_scalade_token, decode_scalade_token, generate_token_payload
+    FunctionConfigProvider, clear_config_cache, load_config_file, parse_yaml, write_config_snapshot
+from scaladecore.testing import FakeRuntime, FakeRuntimeServer
+from scaladecore.transports import HTTPTransport, InProcessTransport, UnixSocketTransport
+from scaladecore.utils import TokenClaimsCache, encode_scalade_token, decode_scalade_token, \
+    generate_token_payload, get_fi_deadline, get_rsa_key, get_token_cache_stats
+from tests.conftest import new_variable_obj_d
 
 
 class TestEntityContract:
-    class FakeEntity(EntityContract):
+    class FakeEntity(EntityContract, register=False):
         def __init__(self, *args, **kwargs):
             super().__init__(*args, **kwargs)
 
@@ -39,6 +71,40 @@ class TestEntityContract:
         fake_entity = self.FakeEntity()
         assert fake_entity.get('created') == fake_entity._created
 
+    def test_get_entity_type(self):
+        assert EntityContract.get_entity_type('FunctionType') is FunctionTypeEntity
+        assert EntityContract.get_entity_type('function_type') is FunctionTypeEntity
+        assert EntityContract.get_entity_type('variable') is VariableEntity
+
+    @pytest.mark.usefixtures('fi_message_obj_d')
+    def test_create_entities_from_dicts(self, fi_message_obj_d):
+        objs = [fi_message_obj_d] * 3
+        for objs_ in (objs, json.dumps(objs)):
+            log_messages = EntityContract.create_entities_from_dicts(
+                'FunctionInstanceLogMessage', objs_)
+            assert len(log_messages) == 3
+            for log_message in log_messages:
+                assert isinstance(log_message, FunctionInstanceLogMessageEntity)
+                assert log_message.as_dict == fi_message_obj_d
+
+        with pytest.raises(EntityFactoryError):
+            EntityContract.create_entities_from_dicts('UnknownEntity', objs)
+
+    @pytest.mark.usefixtures('fi_message_obj_d')
+    def test_create_entities_from_dicts_in_pool(self, fi_message_obj_d):
+        objs = [dict(fi_message_obj_d, log_message='Message %d' % i) for i in range(5)]
+        with mock.patch('scaladecore.entities.BULK_DECODE_POOL_THRESHOLD', 2), \
+                mock.patch('scaladecore.entities.BULK_DECODE_CHUNK_SIZE', 2):
+            log_messages = EntityContract.create_entities_from_dicts(
+                'FunctionInstanceLogMessage', objs, max_workers=2)
+        assert [log_message.as_dict for log_message in log_messages] == objs
+
+    def test_duplicate_entity_type(self):
+        with pytest.raises(DuplicateEntityTypeError):
+            type('AccountEntity', (EntityContract,), {})
+        assert EntityContract.get_entity_type('account') is AccountEntity
+        assert 'fake' not in _ENTITY_TYPES
+
 
 class TestAccountEntity:
     @pytest.mark.usefixtures('account_obj_d')
@@ -93,6 +159,19 @@ class TestStreamEntity:
         assert isinstance(stream.get('account'), AccountEntity)
         assert stream.as_dict == stream_obj_d
 
+    @pytest.mark.usefixtures('stream_obj_d')
+    def test_to_json_bytes(self, stream_obj_d):
+        stream = StreamEntity.create_from_dict(stream_obj_d)
+        json_bytes = stream.to_json_bytes()
+        assert json_bytes == json.dumps(stream.as_dict).encode()
+        assert json.loads(json_bytes) == stream_obj_d
+        assert stream.to_json_bytes() is json_bytes
+
+        stream.get('account')._username = 'other_user'
+        assert json.loads(stream.to_json_bytes())['account']['username'] == 'other_user'
+        stream._status = 'finished'
+        assert json.loads(stream.to_json_bytes())['status'] == 'finished'
+
 
 class TestFunctionInstanceEntity:
     @pytest.mark.usefixtures('function_instance_obj_d')
@@ -103,6 +182,25 @@ class TestFunctionInstanceEntity:
         assert isinstance(fi.get('stream'), StreamEntity)
         assert fi.as_dict == function_instance_obj_d
 
+    @pytest.mark.usefixtures('function_instance_obj_d')
+    def test_to_json_bytes(self, function_instance_obj_d):
+        fi = FunctionInstanceEntity.create_from_dict(function_instance_obj_d)
+        # Same keys order as the entity data, nested entities included.
+        assert json.dumps(fi.as_dict) == json.dumps(function_instance_obj_d)
+        assert fi.to_json_bytes() == json.dumps(function_instance_obj_d).encode()
+        assert fi.to_json_bytes() is fi.to_json_bytes()
+
+        fi.get('position').row = 3
+        assert json.loads(fi.to_json_bytes())['position']['row'] == 3
+        fi.get('function_type').get('inputs').pop()
+        assert json.loads(fi.to_json_bytes())['function_type']['inputs'] == \
+            fi.as_dict['function_type']['inputs']
+        fi.get('function_type').get('inputs')[0].verbose_name = 'Foo'
+        assert json.loads(fi.to_json_bytes())['function_type']['inputs'][0]['verbose_name'] == \
+            'Foo'
+        fi._status = 'completed'
+        assert json.loads(fi.to_json_bytes())['status'] == 'completed'
+
 
 class TestVariableEntity:
     @pytest.mark.usefixtures('variable_obj_d')
@@ -111,6 +209,16 @@ class TestVariableEntity:
         assert isinstance(variable, VariableEntity)
         assert variable.as_dict == variable_obj_d
 
+    def test_create_entities_by_size_in_pool(self):
+        objs = [new_variable_obj_d(id_name='fake_input_%d' % i, body='Rm9v' * (i + 1), rank=i)
+                for i in range(6)]
+        with mock.patch.dict('os.environ', {'SCALADE_DECODE_POOL_THRESHOLD': '16'}):
+            variables = EntityContract.create_entities_from_dicts('Variable', objs, max_workers=2)
+        assert [variable.as_dict for variable in variables] == objs
+        assert [len(chunk) for chunk in _split_chunks(objs, 10, 24, 'body')] == [3, 2, 1]
+        assert [len(chunk) for chunk in _split_chunks(objs, 2, 12, 'body')] == [2, 1, 1, 1, 1]
+        assert [len(chunk) for chunk in _split_chunks(objs, 4)] == [4, 2]
+
 
 class TestFunctionInstanceLogMessageEntity:
     @pytest.mark.usefixtures('fi_message_obj_d')
@@ -157,6 +265,121 @@ class TestFunctionConfigProvider:
             assert isinstance(ot, OutputConfig)
 
 
+class TestLoadConfigFile:
+    def test_cache_invalidation(self, tmp_path):
+        filepath = tmp_path / 'function.yml'
+        filepath.write_text('key: foo\n')
+        with mock.patch('scaladecore.config.parse_yaml', wraps=parse_yaml) as parse_yaml_:
+            config_data = load_config_file(str(filepath))
+            config_data['key'] = 'mutated'
+            assert load_config_file(str(filepath)) == {'key': 'foo'}
+            assert parse_yaml_.call_count == 1
+
+            filepath.write_text('key: foo_bar\n')
+            assert load_config_file(str(filepath)) == {'key': 'foo_bar'}
+            assert parse_yaml_.call_count == 2
+
+    def test_snapshot(self, tmp_path):
+        filepath = tmp_path / 'function.yml'
+        filepath.write_text('key: foo\n')
+        snapshot_path = write_config_snapshot(str(filepath))
+        clear_config_cache()
+        with mock.patch('scaladecore.config.parse_yaml') as parse_yaml_:
+            assert load_config_file(str(filepath)) == {'key': 'foo'}
+            filepath.unlink()
+            clear_config_cache()
+            assert load_config_file(str(filepath)) == {'key': 'foo'}
+            parse_yaml_.assert_not_called()
+        assert snapshot_path == str(filepath) + '.json'
+
+    def test_stale_snapshot(self, tmp_path):
+        filepath = tmp_path / 'function.yml'
+        filepath.write_text('key: foo\n')
+        write_config_snapshot(str(filepath))
+        stat = os.stat(str(filepath))
+        filepath.write_text('key: bar\n')
+        # Same size and an older mtime than the snapshot, i.e: a checkout or a copy.
+        os.utime(str(filepath), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        clear_config_cache()
+        assert load_config_file(str(filepath)) == {'key': 'bar'}
+
+    def test_snapshot_skipped_on_dates(self, tmp_path):
+        filepath = tmp_path / 'function.yml'
+        filepath.write_text('key: foo\n')
+        snapshot_path = write_config_snapshot(str(filepath))
+        filepath.write_text('released: 2020-01-01\n')
+        assert write_config_snapshot(str(filepath)) is None
+        assert not os.path.exists(snapshot_path)
+        clear_config_cache()
+        assert load_config_file(str(filepath)) == {'released': date(2020, 1, 1)}
+
+
+class TestProfiling:
+    @pytest.mark.parametrize('mode', ['cprofile', 'sample', 'tracemalloc'])
+    def test_profile_phases(self, tmp_path, mode):
+        output_file = str(tmp_path / 'profile')
+        with create_profiler(mode, output_file=output_file, interval=0.001) as profiler:
+            with phase(PHASE_USER_FUNCTION):
+                deadline = time.perf_counter() + 0.05
+                while time.perf_counter() < deadline:
+                    _ = [str(i) for i in range(1000)]
+        assert profiler.write() == output_file
+        assert os.path.getsize(output_file) > 0
+        assert '[user       ] user_function ' in profiler.summary()
+
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError):
+            create_profiler('foo')
+
+    def test_label(self, tmp_path):
+        user_dir = str(tmp_path / 'src')
+        profiler = create_profiler('cprofile', user_paths=[user_dir])
+        assert profiler.label(os.path.join(user_dir, 'function.py')) == 'user'
+        assert profiler.label(user_dir + '_lib.py') == 'library'
+        assert profiler.label(scaladecore.__file__) == 'scaladecore'
+
+    def test_failed_start(self, tmp_path):
+        profiler = create_profiler('sample', output_file=str(tmp_path / 'profile'))
+        with mock.patch('threading.Thread.start', side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                profiler.start()
+        assert profiler.write() is None
+        assert 'not started' in profiler.summary()
+
+    def test_tracemalloc_left_running(self, tmp_path):
+        tracemalloc.start()
+        try:
+            with create_profiler('tracemalloc', output_file=str(tmp_path / 'profile')):
+                pass
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+
+class TestVerifyConfigs:
+    def test_verify_configs(self, tmp_path):
+        valid_dir = tmp_path / 'valid' / 'config'
+        valid_dir.mkdir(parents=True)
+        (valid_dir / 'function.yml').write_text(
+            'key: foo\nverbose_name: Foo\ndescription: Foo function\n'
+            'inputs:\n  - id_name: name\n    type: text\noutputs: []\n')
+        invalid_dir = tmp_path / 'invalid' / 'config'
+        invalid_dir.mkdir(parents=True)
+        (invalid_dir / 'function.yml').write_text('key: foo\n')
+        cache_file = str(tmp_path / 'cache.json')
+
+        report = _verify_configs([str(tmp_path)], jobs=1, cache_file=cache_file)
+        assert not report['valid']
+        assert report['counts'] == {'valid': 1, 'cached': 0, 'invalid': 1, 'error': 0}
+
+        report = _verify_configs([str(tmp_path / '*' / 'config' / 'function.yml')],
+                                 jobs=1, cache_file=cache_file)
+        assert report['counts'] == {'valid': 0, 'cached': 1, 'invalid': 1, 'error': 0}
+
+        report = _verify_configs([str(tmp_path / 'missing.yml')], cache_file=cache_file)
+        assert report['results'][0]['status'] == 'error'
+
+
 class TestVariable:
     def test_create(self):
         my_var = Variable.create(type_='text',
@@ -189,6 +412,16 @@ class TestVariable:
         tmp_file_.seek(0)
         assert tmp_file_.read() == file_bytes
 
+    def test_create_positional_args(self):
+        my_var = Variable.create('text', 'my_var', None, b'fake_value')
+        assert isinstance(my_var, TextVariable)
+        assert my_var.type == 'text'
+        assert my_var.value == 'fake_value'
+
+        my_var = Variable.create('json', 'my_var', 'text', None, {'foo': 'bar'})
+        assert my_var.type == 'json'
+        assert my_var.value == {'foo': 'bar'}
+
 
 class TestTextVariable:
     @pytest.fixture(scope='class')
@@ -206,6 +439,36 @@ class TestTextVariable:
         assert variable.decoded == 'foo'
 
 
+class TestJsonVariable:
+    def test_creation(self):
+        variable = JsonVariable('my_var', value={'a': {'b': [1, 2]}, 'c': 'é'})
+
+        assert getattr(variable, 'type') == 'json'
+        assert variable.bytes == '{"a":{"b":[1,2]},"c":"é"}'.encode()
+        assert variable['a']['b'] == [1, 2]
+        assert variable.path('a', 'b', 1) == 2
+        assert JsonVariable('my_var', value={}).value == {}
+
+    def test_lazy_cached_parsing(self):
+        variable = Variable.create('json', 'my_var', bytes_=b'{"a":1}')
+        with mock.patch('scaladecore.variables.json.loads', wraps=json.loads) as loads:
+            assert variable['a'] == 1
+            assert variable.value == {'a': 1}
+            assert loads.call_count == 1
+            variable.update([1])
+            assert variable.value == [1]
+            assert loads.call_count == 2
+        assert pickle.loads(pickle.dumps(variable)).value == [1]
+
+    def test_null_document_cached(self):
+        variable = Variable.create('json', 'my_var', bytes_=b'null')
+        with mock.patch('scaladecore.variables.json.loads', wraps=json.loads) as loads:
+            assert variable.value is None
+            assert variable.value is None
+            assert loads.call_count == 1
+        assert pickle.loads(pickle.dumps(variable)).value is None
+
+
 class TestIntegerVariable:
     @pytest.fixture(scope='class')
     def var_data(self):
@@ -292,6 +555,56 @@ class TestScaladeJWToken:
         decoded_payload = decode_scalade_token(token)
         assert payload == decoded_payload
 
+    @pytest.mark.usefixtures('rsa_keys')
+    def test_decode_scalade_token_cache(self, payload):
+        token = encode_scalade_token(payload)
+        public_key = get_rsa_key('SCALADE_PUBLIC_KEY')
+        assert get_rsa_key('SCALADE_PUBLIC_KEY') is public_key
+
+        decode_scalade_token(token)
+        hits = get_token_cache_stats()['hits']
+        decoded_payload = decode_scalade_token(token)
+        decoded_payload['fi_uuid'] = None
+        assert decode_scalade_token(token) == payload
+        assert get_token_cache_stats()['hits'] == hits + 2
+
+        # Rotating the key invalidates the cached claims.
+        with mock.patch.dict('os.environ', {
+                'SCALADE_PUBLIC_KEY': os.environ['SCALADE_PUBLIC_KEY'] + '\n'}):
+            assert get_rsa_key('SCALADE_PUBLIC_KEY') is not public_key
+            misses = get_token_cache_stats()['misses']
+            assert decode_scalade_token(token) == payload
+            assert get_token_cache_stats()['misses'] == misses + 1
+
+    @pytest.mark.usefixtures('rsa_keys')
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_generate_tokens(self, jobs):
+        fi_uuids = [str(uuid4()) for _ in range(7)]
+        output = io.StringIO()
+        # Small batches split into several chunks per batch on the process pool.
+        with mock.patch('scaladecore.cli.TOKENS_BATCH_SIZE', 4):
+            _generate_tokens(io.StringIO('\n'.join(fi_uuids) + '\n\n'), jobs=jobs,
+                             output=output)
+
+        lines = output.getvalue().splitlines()
+        assert len(lines) == 7
+        for fi_uuid, line in zip(fi_uuids, lines):
+            uuid_, token = line.split(',')
+            assert uuid_ == fi_uuid
+            assert decode_scalade_token(token)['fi_uuid'] == fi_uuid
+
+    def test_token_claims_cache_expiry_and_eviction(self):
+        key = object()
+        cache = TokenClaimsCache(maxsize=1)
+        cache.put('expired', key, {'exp': 1})
+        assert cache.get('expired', key) is None
+        cache.put('token_1', key, {'exp': None})
+        cache.put('token_2', key, {'exp': None})
+        assert cache.get('token_1', key) is None
+        assert cache.get('token_2', key) == {'exp': None}
+        assert cache.get('token_2', object()) is None
+        assert cache.stats['evictions'] == 1
+
 
 def _create_tmp_file() -> Tuple[TemporaryFile, bytes]:
     tmp_file = TemporaryFile()
@@ -305,3 +618,692 @@ class TestScaladeRuntimeAPIClient:
     def test_creation(self):
         # TODO
         pass
+
+
+class TestFakeRuntime:
+    def test_context_manager_round_trip(self, fake_runtime, fake_fi):
+        with FakeRuntimeServer(fake_runtime) as server, mock.patch.dict('os.environ'):
+            server.configure_environ()
+            ctx = ContextManager.initialize_from_token(fake_fi.token)
+            assert ctx.GetInput('name').value == 'Foo'
+
+            ctx.Log('Fake log message')
+            ctx.Output(Variable.create('integer', 'count', value=3))
+            assert ctx.GetOutput('count').value == 3
+            ctx.Complete()
+            assert ctx.fi.get('status') == 'completed'
+            with pytest.raises(ContextCompleteError):
+                ctx.Complete()
+
+        assert len(fake_runtime.get_function_instance(fake_fi.uuid)['log_messages']) == 1
+
+
+class TestTimings:
+    def test_scalade_func_timings_record(self, fake_runtime, fake_fi):
+        @scalade_func
+        def function(ctx):
+            ctx.Log('Fake log message')
+            ctx.Log('Fake log message')
+            ctx.Complete()
+
+        records = []
+        set_timings_sink(records.append)
+        try:
+            with FakeRuntimeServer(fake_runtime) as server, mock.patch.dict('os.environ'):
+                server.configure_environ()
+                os.environ['SCALADE_FI_TOKEN'] = fake_fi.token
+                function()
+        finally:
+            set_timings_sink(None)
+
+        record, = records
+        assert record['fi_uuid'] == fake_fi.uuid
+        assert record['status'] == 'ok'
+        assert set(record['phases']) == {
+            'token_read', 'context_init', 'context_retrieval', 'context_decode', 'user_function'}
+        assert record['api_calls']['create_fi_log_message']['count'] == 2
+        assert record['api_calls']['update_fi_status']['count'] == 1
+
+    def test_file_sink(self, tmp_path):
+        filepath = str(tmp_path / 'timings.jsonl')
+        with mock.patch.dict('os.environ', {'SCALADE_TIMINGS_FILE': filepath}):
+            for _ in range(2):
+                with pytest.raises(ValueError), record_timings('foo'):
+                    with phase('foo_phase'):
+                        raise ValueError()
+        with open(filepath) as file:
+            records = [json.loads(line) for line in file]
+        assert len(records) == 2
+        assert records[0]['error'] == 'ValueError'
+        assert 'foo_phase' in records[0]['phases']
+
+    def test_no_sink(self):
+        with record_timings('foo') as timings:
+            assert timings is None
+
+
+class TestRecordReplay:
+    @staticmethod
+    def _run_context(token: str) -> Tuple[str, int]:
+        ctx = ContextManager.initialize_from_token(token)
+        ctx.Log('Fake log message')
+        ctx.Output(Variable.create('integer', 'count', value=3))
+        ctx.Complete()
+        return ctx.GetInput('name').value, ctx.GetOutput('count').value
+
+    def test_record_and_replay(self, tmp_path, fake_runtime, fake_fi):
+        token = fake_fi.token
+        record_file = str(tmp_path / 'recording.jsonl')
+
+        with FakeRuntimeServer(fake_runtime) as server, \
+                mock.patch.dict('os.environ', {'SCALADE_RECORD_FILE': record_file}):
+            server.configure_environ()
+            recorded = self._run_context(token)
+            assert isinstance(create_runtime_api_client(token), RecordingRuntimeAPIClient)
+
+        with mock.patch.dict('os.environ', {'SCALADE_REPLAY_FILE': record_file}), \
+                mock.patch('requests.Session.request') as request:
+            assert self._run_context(token) == recorded == ('Foo', 3)
+            request.assert_not_called()
+
+            ctx = ContextManager.initialize_from_token(token)
+            ctx.Complete()
+            with pytest.raises(ReplayError):
+                ctx.Complete()
+
+    def test_self_mode_rejected(self, tmp_path):
+        with pytest.raises(click.UsageError):
+            _run(replay=str(tmp_path / 'recording.jsonl'), **{'self': True})
+
+
+class TestRunMany:
+    @pytest.mark.usefixtures('rsa_keys')
+    def test_run_many_threads(self):
+        runtime = FakeRuntime(auto_register=True)
+
+        @scalade_func
+        def function(ctx):
+            ctx.Log('Fake log message')
+            ctx.Complete()
+
+        fi_uuids = [str(uuid4()) for _ in range(10)]
+        tokens = [encode_scalade_token(generate_token_payload(fi_uuid)) for fi_uuid in fi_uuids]
+        with FakeRuntimeServer(runtime) as server, mock.patch.dict('os.environ'):
+            server.configure_environ()
+            summary = _run_many(function, None, tokens + ['invalid'], concurrency=3)
+
+        assert (summary['instances'], summary['completed'], summary['failed']) == (11, 10, 1)
+        assert list(summary['errors'])[0].startswith('ContextInitError')
+        assert summary['latency']['p50'] <= summary['latency']['max']
+        assert all(runtime.get_function_instance(fi_uuid)['fi'].get('status') == 'completed'
+                   for fi_uuid in fi_uuids)
+
+    @pytest.mark.usefixtures('rsa_keys')
+    def test_run_many_processes(self, tmp_path):
+        runtime = FakeRuntime(auto_register=True)
+        function_file = tmp_path / 'function.py'
+        function_file.write_text(
+            'from scaladecore import scalade_func\n\n\n'
+            '@scalade_func\n'
+            'def function(ctx):\n'
+            '    ctx.Log(\'Fake log message\')\n'
+            '    ctx.Complete()\n')
+
+        fi_uuids = [str(uuid4()) for _ in range(6)]
+        tokens = [encode_scalade_token(generate_token_payload(fi_uuid)) for fi_uuid in fi_uuids]
+        with FakeRuntimeServer(runtime) as server, mock.patch.dict('os.environ'):
+            server.configure_environ()
+            summary = _run_many(None, str(function_file), tokens + ['invalid'], concurrency=2,
+                                executor='process')
+
+        assert (summary['instances'], summary['completed'], summary['failed']) == (7, 6, 1)
+        assert summary['executor'] == 'process'
+        assert all(runtime.get_function_instance(fi_uuid)['fi'].get('status') == 'completed'
+                   for fi_uuid in fi_uuids)
+
+
+class TestTransports:
+    @pytest.mark.parametrize('transport_type', ['tcp', 'unix', 'inprocess'])
+    def test_context_manager_round_trip(self, tmp_path, transport_type, fake_runtime, fake_fi):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict('os.environ'))
+            transport = None
+            if transport_type == 'inprocess':
+                transport = InProcessTransport(fake_runtime.handle)
+            else:
+                server = stack.enter_context(FakeRuntimeServer(
+                    fake_runtime, socket_path=str(tmp_path / 'runtime.sock')
+                    if transport_type == 'unix' else None))
+                server.configure_environ()
+
+            ctx = ContextManager.initialize_from_token(fake_fi.token, transport)
+            assert ctx.GetInput('name').value == 'Foo'
+            for _ in range(3):
+                ctx.Log('Fake log message')
+            ctx.Output(Variable.create('integer', 'count', value=3))
+            assert ctx.GetOutput('count').value == 3
+            ctx.Complete()
+            with pytest.raises(ContextCompleteError):
+                ctx.Complete()
+
+        assert len(fake_runtime.get_function_instance(fake_fi.uuid)['log_messages']) == 3
+
+    @pytest.mark.parametrize('method,retried', [('GET', True), ('POST', False)])
+    def test_unix_socket_retries_idempotent_calls(self, method, retried):
+        transport = UnixSocketTransport('/nonexistent.sock')
+        response = (200, 'OK', {'Content-Type': 'application/json'}, b'{}')
+        with mock.patch.object(transport, '_request',
+                               side_effect=[RemoteDisconnected(), response]) as request:
+            if retried:
+                assert transport.request(method, 'endpoint/', {}).status_code == 200
+            else:
+                with pytest.raises(RemoteDisconnected):
+                    transport.request(method, 'endpoint/', {})
+        assert request.call_count == (2 if retried else 1)
+
+    def test_new_http_session(self):
+        client = ScaladeRuntimeAPIClient(
+            'token', transport=InProcessTransport(FakeRuntime().handle))
+        client.new_http_session()
+        assert isinstance(client.transport, HTTPTransport)
+        assert client._session.headers['Authorization'] == 'Bearer token'
+
+
+class TestDataPlane:
+    def test_output_handoff(self, tmp_path, fake_runtime, fake_fi, fake_context):
+        value = 'Foo Bar ' * 1000
+
+        with mock.patch.dict('os.environ', {'SCALADE_DATA_PLANE_DIR': str(tmp_path),
+                                            'SCALADE_DATA_PLANE_THRESHOLD': '1024'}):
+            ctx = fake_context()
+            ctx.Output(Variable.create('text', 'big', value=value))
+            ctx.Output(Variable.create('text', 'small', value='Foo'))
+
+            outputs = {opt.get('id_name'): opt.get('bytes')
+                       for opt in fake_runtime.get_function_instance(fake_fi.uuid)['outputs']}
+            assert dataplane.is_reference(outputs['big'])
+            assert outputs['small'] == b'Foo'
+
+            big = ctx.GetOutput('big')
+            assert isinstance(big.bytes, memoryview)
+            assert big.value == value
+            assert ctx.GetOutput('small').value == 'Foo'
+            assert Variable.create('text', 'copy', bytes_=big.bytes).dump()
+
+            with mock.patch('socket.gethostname', return_value='other-host'):
+                with pytest.raises(DataPlaneError):
+                    _ = ctx.GetOutput('big')
+
+            assert dataplane.purge_data_plane(max_age=-1) == 1
+
+    def test_resolve_checks(self, tmp_path):
+        data_plane_dir = tmp_path / 'shm'
+        body = b'Foo Bar ' * 1000
+        with mock.patch.dict('os.environ', {'SCALADE_DATA_PLANE_DIR': str(data_plane_dir)}):
+            reference = dataplane.publish(body)
+            assert bytes(dataplane.resolve(reference)) == body
+
+            reference_d = json.loads(reference[len(dataplane.REFERENCE_PREFIX):])
+            outside = tmp_path / reference_d['sha256']
+            outside.write_bytes(body)
+            for forged in (dict(reference_d, path=str(outside)),
+                           dict(reference_d, path=str(data_plane_dir / '..' / outside.name)),
+                           dict(reference_d, sha256='0' * 64)):
+                with pytest.raises(DataPlaneError):
+                    dataplane.resolve(dataplane.REFERENCE_PREFIX + json.dumps(forged).encode())
+
+            # Tampered after publishing.
+            with open(reference_d['path'], 'r+b') as file:
+                file.write(b'Bar')
+            with pytest.raises(DataPlaneError):
+                dataplane.resolve(reference)
+
+            not_reference = dataplane.REFERENCE_PREFIX + b'Foo'
+            assert dataplane.resolve(not_reference) is not_reference
+
+        # The data plane disabled, references are plain bodies.
+        assert dataplane.resolve(reference) is reference
+
+
+class TestOutputAsync:
+    def test_ordering_and_complete(self, fake_runtime, fake_fi, fake_context):
+        delays = iter([0.05, 0.0, 0.03, 0.0, 0.01, 0.0, 0.0])
+
+        def handler(method, endpoint, authorization, body=None):
+            if endpoint == 'create-fi-output/':
+                time.sleep(next(delays, 0.0))
+            return fake_runtime.handle(method, endpoint, authorization, body)
+
+        ctx = fake_context(handler)
+        futures = [ctx.OutputAsync(Variable.create('integer', 'count', value=i))
+                   for i in range(1, 6)]
+        futures.append(ctx.OutputAsync(Variable.create('text', 'name', value='Foo')))
+        ctx.Complete()
+
+        assert all(future.done() for future in futures)
+        assert ctx.GetOutput('count').value == 5
+        assert ctx.GetOutput('name').value == 'Foo'
+        stored = {opt.get('id_name'): opt.to_var.value
+                  for opt in fake_runtime.get_function_instance(fake_fi.uuid)['outputs']}
+        assert stored == {'count': 5, 'name': 'Foo'}
+        assert ctx.fi.get('status') == 'completed'
+
+    def test_failed_output_fails_complete(self, fake_runtime, fake_fi, fake_context):
+        def handler(method, endpoint, authorization, body=None):
+            if endpoint == 'create-fi-output/':
+                return 400, {'output': ['Invalid output variable.']}
+            return fake_runtime.handle(method, endpoint, authorization, body)
+
+        ctx = fake_context(handler)
+        future = ctx.OutputAsync(Variable.create('text', 'name', value='Foo'))
+        with pytest.raises(ContextOutputError):
+            ctx.Complete()
+        assert isinstance(future.exception(), ContextOutputError)
+        assert fake_runtime.get_function_instance(fake_fi.uuid)['fi'].get('status') == 'running'
+        assert ctx._output_executor is None
+
+    def test_output_merges_with_async_outputs(self, fake_runtime, fake_fi, fake_context):
+        def handler(method, endpoint, authorization, body=None):
+            if endpoint != 'create-fi-output/':
+                return fake_runtime.handle(method, endpoint, authorization, body)
+            if threading.current_thread().name.startswith('scalade-output'):
+                time.sleep(0.02)
+                return fake_runtime.handle(method, endpoint, authorization, body)
+            # The synchronous output response predates the async output, it arrives after.
+            result = fake_runtime.handle(method, endpoint, authorization, body)
+            time.sleep(0.05)
+            return result
+
+        ctx = fake_context(handler)
+        future = ctx.OutputAsync(Variable.create('integer', 'count', value=3))
+        ctx.Output(Variable.create('text', 'name', value='Foo'))
+        assert future.done()
+        assert ctx.GetOutput('count').value == 3
+        assert ctx.GetOutput('name').value == 'Foo'
+
+    def test_output_missing_from_response(self, fake_runtime, fake_context):
+        def handler(method, endpoint, authorization, body=None):
+            status, data = fake_runtime.handle(method, endpoint, authorization, body)
+            if endpoint == 'create-fi-output/':
+                data['outputs'] = [opt for opt in data['outputs'] if opt['id_name'] != 'name']
+            return status, data
+
+        ctx = fake_context(handler)
+        ctx.Output(Variable.create('integer', 'count', value=3))
+        ctx.Output(Variable.create('text', 'name', value='Foo'))
+        assert ctx.GetOutput('count').value == 3
+        with pytest.raises(Exception):
+            ctx.GetOutput('name')
+
+
+class TestSpool:
+    def test_spool_retries_and_replays(self, tmp_path, fake_runtime, fake_fi, fake_context):
+        state = {'down': True}
+
+        def handler(method, endpoint, authorization, body=None):
+            if endpoint != 'retrieve-fi-context/' and state['down']:
+                raise requests.ConnectionError()
+            return fake_runtime.handle(method, endpoint, authorization, body)
+
+        with mock.patch.dict('os.environ', {'SCALADE_SPOOL_DIR': str(tmp_path),
+                                            'SCALADE_SPOOL_FLUSH_TIMEOUT': '0.05'}), \
+                mock.patch('scaladecore.spool.RETRY_MAX_DELAY', 0.01):
+            ctx = fake_context(handler)
+            ctx.Log('Fake log message')
+            ctx.Output(Variable.create('integer', 'count', value=3))
+            assert ctx.GetOutput('count').value == 3
+            ctx.Close()
+            assert fake_runtime.get_function_instance(fake_fi.uuid)['outputs'] == []
+            assert os.path.exists(tmp_path / ('%s.jsonl' % fake_fi.uuid))
+
+            # Restarted: the unsent calls are replayed first.
+            state['down'] = False
+            ctx = fake_context(handler)
+            ctx.Complete()
+            assert ctx.Flush(timeout=5)
+            with pytest.raises(ContextCompleteError):
+                ctx.Complete()
+                ctx.Flush(timeout=5)
+            ctx.Close()
+
+        instance = fake_runtime.get_function_instance(fake_fi.uuid)
+        assert len(instance['log_messages']) == 1
+        assert instance['outputs'][0].to_var.value == 3
+        assert instance['fi'].get('status') == 'completed'
+        assert not os.listdir(tmp_path)
+
+    def test_close_abandons_hung_call(self, tmp_path, fake_runtime, fake_fi, fake_context):
+        released = threading.Event()
+
+        def handler(method, endpoint, authorization, body=None):
+            if endpoint == 'create-fi-log-message/':
+                released.wait(5)
+            return fake_runtime.handle(method, endpoint, authorization, body)
+
+        with mock.patch.dict('os.environ', {'SCALADE_SPOOL_DIR': str(tmp_path),
+                                            'SCALADE_SPOOL_FLUSH_TIMEOUT': '0.05'}):
+            ctx = fake_context(handler)
+            assert ctx._spool._client.timeout == 10
+            ctx.Log('Fake log message')
+            start = time.monotonic()
+            ctx.Close()
+            assert time.monotonic() - start < 1
+            released.set()
+            ctx._spool._sender.join(5)
+
+        # Sent, but not acknowledged: it is resent on replay.
+        assert len(fake_runtime.get_function_instance(fake_fi.uuid)['log_messages']) == 1
+        with open(tmp_path / ('%s.jsonl' % fake_fi.uuid), 'r') as file:
+            assert len(file.readlines()) == 1
+
+    def test_spool_rejections(self, tmp_path, fake_runtime, fake_fi, fake_context):
+        def handler(method, endpoint, authorization, body=None):
+            if endpoint == 'create-fi-log-message/':
+                return 400, {'log_message': ['Invalid log message.']}
+            return fake_runtime.handle(method, endpoint, authorization, body)
+
+        with mock.patch.dict('os.environ', {'SCALADE_SPOOL_DIR': str(tmp_path)}):
+            ctx = fake_context(handler)
+            ctx.Log('Fake log message')
+            with pytest.raises(ContextLogError):
+                ctx.Flush(timeout=5)
+            # Raised once.
+            assert ctx.Flush(timeout=5)
+
+            ctx.Block()
+            with pytest.raises(ContextBlockError):
+                ctx.Block()
+            with pytest.raises(ContextCompleteError):
+                ctx.Complete()
+            assert ctx.Flush(timeout=5)
+            ctx.Close()
+            with pytest.raises(SpoolClosedError):
+                ctx._spool.append('create_fi_log_message', {'log_message': 'Fake log message'})
+
+        assert fake_runtime.get_function_instance(fake_fi.uuid)['fi'].get('status') == 'blocked'
+
+
+class TestLogHandler:
+    def test_capture_logging(self, fake_runtime, fake_fi, fake_context):
+        ctx = fake_context()
+        logger = logging.getLogger('test_scalade')
+        logger.setLevel(logging.DEBUG)
+
+        handler = ctx.CaptureLogging(logger, level='INFO', rate=0.001, burst=5,
+                                     sample_rates={'test_scalade.noisy': 0})
+        logger.debug('Fake debug message')
+        for i in range(10):
+            logger.info('Fake info message %d', i)
+        logging.getLogger('test_scalade.noisy').warning('Fake noisy message')
+        logging.getLogger('test_scalade.db').error('Fake error message')
+        ctx.Close()
+
+        log_messages = fake_runtime.get_function_instance(fake_fi.uuid)['log_messages']
+        assert [log.get('log_level') for log in log_messages] == ['info'] * 5 + ['error']
+        assert log_messages[0].get('log_message') == 'Fake info message 0'
+        assert handler.dropped == {'rate_limited': 5, 'sampled': 1}
+        assert not logger.handlers
+
+    def test_internal_threads_not_captured(self, fake_runtime, fake_fi, fake_context):
+        ctx = fake_context()
+        logger = logging.getLogger('test_scalade_internal')
+        handler = ctx.CaptureLogging(logger, flush_timeout=1)
+        assert handler.flush_timeout == 1
+
+        for name in ('scalade-spool', 'scalade-output_0', 'worker'):
+            thread = threading.Thread(target=logger.warning, args=('From %s', name), name=name)
+            thread.start()
+            thread.join()
+        ctx.Close()
+
+        log_messages = fake_runtime.get_function_instance(fake_fi.uuid)['log_messages']
+        assert [log.get('log_message') for log in log_messages] == ['From worker']
+
+    def test_invalid_log_level(self):
+        ctx = ContextManager(fi=None, api_client=None, inputs=[])
+        with pytest.raises(ValueError):
+            ctx.Log('Fake log message', level='fatal')
+
+
+class TestDeadline:
+    @pytest.mark.usefixtures('rsa_keys')
+    def test_deadline_from_token(self):
+        token = encode_scalade_token(generate_token_payload(str(uuid4()), ttl=60))
+        assert 55 < get_fi_deadline(token) - time.monotonic() <= 60
+        with mock.patch.dict('os.environ', {'SCALADE_FI_TIMEOUT': '10'}):
+            assert get_fi_deadline(token) - time.monotonic() <= 10
+        assert get_fi_deadline(None) is None
+
+    def test_calls_bounded_by_deadline(self, fake_runtime, fake_fi):
+        handle = fake_runtime.handle
+
+        def slow_handle(method, endpoint, authorization, body=None):
+            if endpoint == 'create-fi-log-message/':
+                time.sleep(1)
+            return handle(method, endpoint, authorization, body)
+
+        with FakeRuntimeServer(fake_runtime) as server, \
+                mock.patch.object(fake_runtime, 'handle', slow_handle), \
+                mock.patch.dict('os.environ', {'SCALADE_FI_TIMEOUT': '0.3'}):
+            server.configure_environ()
+            ctx = ContextManager.initialize_from_token(fake_fi.token)
+            assert 0 < ctx.remaining() <= 0.3
+            assert ctx.near_deadline()
+
+            start = time.monotonic()
+            with pytest.raises(DeadlineExceededError):
+                ctx.Log('Fake log message')
+            assert time.monotonic() - start < 0.8
+            assert ctx.remaining() == 0
+            with pytest.raises(DeadlineExceededError):
+                ctx.Complete()
+
+
+class TestContextSnapshot:
+    def test_not_modified_context_loaded_from_snapshot(self, tmp_path, fake_runtime, fake_fi,
+                                                       fake_context):
+        statuses = []
+
+        def handler(method, endpoint, authorization, body=None, headers=None):
+            status, data, resp_headers = fake_runtime.handle(
+                method, endpoint, authorization, body, headers)
+            if endpoint == 'retrieve-fi-context/':
+                statuses.append(status)
+            return status, data, resp_headers
+
+        with mock.patch.dict('os.environ', {'SCALADE_CONTEXT_CACHE_DIR': str(tmp_path)}):
+            ctx = fake_context(handler)
+            with open(os.path.join(str(tmp_path), '%s.snapshot' % fake_fi.uuid), 'r') as file:
+                snapshot_d = json.load(file)
+            assert snapshot_d['inputs'] == [ctx._inputs[0].as_dict]
+
+            with mock.patch('scaladecore.managers.create_variables') as create_variables:
+                ctx = fake_context(handler)
+                create_variables.assert_not_called()
+            assert ctx.GetInput('name').value == 'Foo'
+            assert statuses == [200, 304]
+
+            ctx.Output(Variable.create('integer', 'count', value=3))
+            ctx = fake_context(handler)
+            assert statuses == [200, 304, 200]
+            assert ctx.GetOutput('count').value == 3
+
+
+class TestContextPrefetch:
+    def test_prefetched_context_handed_to_function(self, fake_runtime, fake_fi):
+        @scalade_func
+        def func(context):
+            context.Complete()
+            return context.GetInput('name').value
+
+        future = ContextManager.prefetch(fake_fi.token, InProcessTransport(fake_runtime.handle))
+        with mock.patch.object(ContextManager, 'initialize_from_token') as initialize:
+            assert func(context=future) == 'Foo'
+            initialize.assert_not_called()
+        assert fake_runtime.get_function_instance(fake_fi.uuid)['fi'].get('status') == 'completed'
+
+    def test_prefetch_error_raised_by_function(self):
+        @scalade_func
+        def func(context):
+            pass
+
+        with mock.patch.object(ContextManager, 'initialize_from_token',
+                               side_effect=ContextInitError({})):
+            future = ContextManager.prefetch(None)
+            with pytest.raises(ContextInitError):
+                func(context=future)
+
+
+class TestStreamingOutputs:
+    def test_generator_outputs_and_implicit_complete(self, fake_runtime, fake_fi, fake_context):
+        @scalade_func
+        def func(context):
+            for i in range(1, 4):
+                yield Variable.create('integer', 'count', value=i)
+            yield OutputChunk('report', b'foo,')
+            yield OutputChunk('report', b'bar')
+
+        func(token=fake_fi.token, context=fake_context())
+        instance = fake_runtime.get_function_instance(fake_fi.uuid)
+        stored = {opt.get('id_name'): opt.to_var for opt in instance['outputs']}
+        assert stored['count'].value == 3
+        assert stored['report'].bytes == b'foo,bar'
+        assert instance['fi'].get('status') == 'completed'
+
+    def test_async_generator_outputs(self, fake_runtime, fake_fi, fake_context):
+        @scalade_func
+        async def func(context):
+            yield Variable.create('text', 'name', value='Foo')
+            context.Complete()
+
+        func(context=fake_context())
+        instance = fake_runtime.get_function_instance(fake_fi.uuid)
+        assert [opt.to_var.value for opt in instance['outputs']] == ['Foo']
+        assert instance['fi'].get('status') == 'completed'
+
+    def test_invalid_item_does_not_complete(self, fake_runtime, fake_fi, fake_context):
+        @scalade_func
+        def func(context):
+            yield 'Foo'
+
+        with pytest.raises(TypeError):
+            func(context=fake_context())
+        assert fake_runtime.get_function_instance(fake_fi.uuid)['fi'].get('status') == 'running'
+
+
+class TestMemoryBudget:
+    @pytest.fixture
+    def budget(self, tmp_path):
+        budget = MemoryBudget(budget=100, spill_threshold=1000, spill_dir=str(tmp_path))
+        set_memory_budget(budget)
+        yield budget
+        set_memory_budget(None)
+
+    def test_spill_and_accounting(self, budget):
+        small = Variable.create('text', 'small', value='a' * 60)
+        assert isinstance(small.bytes, bytes)
+        over_budget = Variable.create('text', 'over_budget', value='b' * 60)
+        large = Variable.create('text', 'large', value='c' * 1000)
+        assert isinstance(over_budget.bytes, memoryview)
+        assert isinstance(large.bytes, memoryview)
+        assert large.value == 'c' * 1000
+        assert budget.stats()['resident'] == 60
+        assert budget.stats()['spilled'] == 1060
+
+        restored = pickle.loads(pickle.dumps(large))
+        assert restored.value == 'c' * 1000
+        assert budget.stats()['spills'] == 3
+
+        del over_budget, large, restored
+        gc.collect()
+        small.update('a' * 10)
+        assert budget.stats()['resident'] == 10
+        assert budget.stats()['spilled'] == 0
+        assert budget.stats()['peak_resident'] == 60
+
+    def test_entity_bodies_admitted_once(self, budget, fake_context):
+        ctx = fake_context()
+        ctx.Output(Variable.create('text', 'large', value='c' * 1000))
+        gc.collect()
+        stats = budget.stats()
+
+        variables = [ctx.GetInput('name') for _ in range(10)] + \
+            [ctx.GetOutput('large') for _ in range(10)]
+        assert budget.stats() == stats
+        assert all(isinstance(var.bytes, memoryview) for var in variables)
+        assert variables[0].value == 'Foo'
+        assert variables[-1].value == 'c' * 1000
+
+    def test_spills_share_segments(self, tmp_path):
+        budget = MemoryBudget(spill_threshold=100, spill_dir=str(tmp_path), segment_size=4096)
+        set_memory_budget(budget)
+        try:
+            fds = len(os.listdir('/proc/self/fd'))
+            variables = [Variable.create('text', 'var%d' % i, value=chr(97 + i % 26) * 1000)
+                         for i in range(40)]
+            large = Variable.create('text', 'large', value='z' * 10000)
+            # 4 bodies per segment, the large one in a segment of its own.
+            assert budget.stats()['spill_segments'] == 11
+            assert len(os.listdir('/proc/self/fd')) <= fds + 11
+            assert [var.value for var in variables[:2]] == ['a' * 1000, 'b' * 1000]
+            assert large.value == 'z' * 10000
+            with pytest.raises(TypeError):
+                variables[0].bytes[0] = 0
+
+            del variables, large
+            gc.collect()
+            assert budget.stats()['spill_segments'] == 1
+            assert budget.stats()['spilled'] == 0
+            assert len(os.listdir('/proc/self/fd')) <= fds + 1
+        finally:
+            set_memory_budget(None)
+
+
+class TestVariableCodec:
+    @pytest.fixture
+    def array_type(self):
+        encode = mock.Mock(side_effect=lambda value: value.tobytes())
+        register_variable_type(
+            'array', encode=encode, decode=lambda body: array('d', bytes(body)),
+            buffer=lambda value: value, estimate_size=lambda value: value.itemsize * len(value))
+        yield encode
+        _VARIABLE_TYPES.pop('array')
+
+    def test_output_round_trip(self, array_type, tmp_path, fake_runtime, fake_fi, fake_context):
+        value = array('d', range(1000))
+
+        with mock.patch.dict('os.environ', {'SCALADE_DATA_PLANE_DIR': str(tmp_path),
+                                            'SCALADE_DATA_PLANE_THRESHOLD': '1024'}):
+            ctx = fake_context()
+            variable = Variable.create('array', 'big', value=value)
+            assert variable.estimate_size() == 8000
+            ctx.Output(variable)
+            ctx.Output(Variable.create('array', 'small', value=array('d', [1.5])))
+
+            outputs = {opt.get('id_name'): opt.get('bytes')
+                       for opt in fake_runtime.get_function_instance(fake_fi.uuid)['outputs']}
+            assert dataplane.is_reference(outputs['big'])
+            assert ctx.GetOutput('big').value == value
+            assert ctx.GetOutput('small').value == array('d', [1.5])
+        # Written through the buffer interface, never encoded.
+        array_type.assert_not_called()
+
+    def test_type_validation(self, array_type):
+        var_cd = dict(id_name='xs', type='array', __rank__=0)
+        assert VariableConfig.deserialize(var_cd).type == 'array'
+        with pytest.raises(VariableTypeError):
+            VariableConfig.deserialize(dict(var_cd, type='table'))
+        with pytest.raises(VariableTypeError):
+            Variable.create('table', 'xs', value='Foo')
+        with pytest.raises(VariableTypeError):
+            register_variable_type('text', encode=str.encode, decode=bytes.decode)
+        with pytest.raises(VariableTypeError):
+            register_variable_type('array', encode=bytes, decode=bytes)
+
+    def test_bytes_do_not_alias_value(self, array_type):
+        value = array('d', [1.5])
+        variable = Variable.create('array', 'xs', value=value)
+        assert isinstance(variable.bytes, bytes)
+        value[0] = 2.5
+        assert variable.bytes == array('d', [1.5]).tobytes()
+        array_type.assert_not_called()